@@ -46,7 +46,72 @@ class Config:
     # Cache settings
     CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
     CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))  # seconds
-    
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 32 * 1024 * 1024))  # total size of cached replies
+
+    # Outbound HTTP connection pool (shared by every provider call)
+    HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))  # total open connections
+    HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+    HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))  # seconds
+    HTTP_KEEPALIVE_TIMEOUT = int(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))  # seconds
+
+    # Process pool for CPU-bound parsing (PDF, DOCX, OCR, HTML), kept off the event loop
+    CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", min(2, os.cpu_count() or 1)))
+    CPU_POOL_TIMEOUT = float(os.getenv("CPU_POOL_TIMEOUT", 60))  # seconds per job
+    CPU_POOL_MAX_PENDING = int(os.getenv("CPU_POOL_MAX_PENDING", 16))  # queued + running jobs
+
+    # OCR: its own small process pool, next to the CPU_POOL_WORKERS one, and image normalization
+    OCR_WORKERS = int(os.getenv("OCR_WORKERS", 1))
+    OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", 60))  # seconds per image
+    OCR_MIN_DIMENSION = int(os.getenv("OCR_MIN_DIMENSION", 1000))  # smaller images are enlarged (up to 3x)
+    OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", 2500))  # larger images are scaled down
+
+    # Web scraping: URLs scraped at once, overall and against any single host
+    SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", 8))
+    SCRAPE_PER_HOST_CONCURRENCY = int(os.getenv("SCRAPE_PER_HOST_CONCURRENCY", 2))
+    SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", 5 * 1024 * 1024))  # page HTML read at most
+    # Last fast-scrape result per URL, revalidated with ETag / Last-Modified on refresh
+    SCRAPE_CACHE_MAX_BYTES = int(os.getenv("SCRAPE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+    # Per-host memory of whether fast or browser scraping works; optional JSON file survives restarts
+    SCRAPE_ROUTE_TTL = int(os.getenv("SCRAPE_ROUTE_TTL", 3 * 24 * 3600))  # seconds
+    SCRAPE_ROUTES_FILE = os.getenv("SCRAPE_ROUTES_FILE", "")
+
+    # Deep scrapes share one headless Chromium per worker; pages are leased from pooled contexts
+    BROWSER_MAX_CONTEXTS = int(os.getenv("BROWSER_MAX_CONTEXTS", 3))  # concurrent deep scrapes
+    BROWSER_CONTEXT_MAX_USES = int(os.getenv("BROWSER_CONTEXT_MAX_USES", 20))  # leases before a context is replaced
+
+    # Knowledge sources: only the chunks relevant to each request go in the prompt
+    KNOWLEDGE_CONTEXT_CHARS = int(os.getenv("KNOWLEDGE_CONTEXT_CHARS", 6000))  # ~1500 tokens
+    KNOWLEDGE_CHUNK_CHARS = int(os.getenv("KNOWLEDGE_CHUNK_CHARS", 800))
+    KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", 8))
+    KNOWLEDGE_EMBEDDING_MODEL = os.getenv("KNOWLEDGE_EMBEDDING_MODEL", "")  # empty = BM25 only; opt in with e.g. all-MiniLM-L6-v2
+    KNOWLEDGE_INDEX_MAX_BYTES = int(os.getenv("KNOWLEDGE_INDEX_MAX_BYTES", 64 * 1024 * 1024))
+
+    # Chat system prompt budget; lower-priority sections are trimmed to fit
+    CHAT_SYSTEM_PROMPT_MAX_TOKENS = int(os.getenv("CHAT_SYSTEM_PROMPT_MAX_TOKENS", 8000))
+
+    # Memoized system prompt text, keyed by a fingerprint of its inputs
+    PROMPT_MEMO_SIZE = int(os.getenv("PROMPT_MEMO_SIZE", 512))  # entries
+
+    # Provider-side caching of the stable system prompt prefix (Claude caches it natively)
+    GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+    GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", 900))  # seconds per cachedContents entry; 0 disables
+    GEMINI_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", 1024))  # shorter prefixes are sent inline
+    GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", 1024))
+
+    # PDFs are read page by page and stop once this many characters are extracted
+    PDF_EXTRACT_MAX_CHARS = int(os.getenv("PDF_EXTRACT_MAX_CHARS", 100000))
+
+    # Document extraction results, keyed by the SHA-256 of the file bytes
+    EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", 64 * 1024 * 1024))  # in-memory text
+    EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "")  # optional disk tier; empty disables it
+    EXTRACTION_CACHE_DISK_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024))
+
+    # Chat context learning runs in the background after the reply is sent
+    CHAT_BACKGROUND_LEARNING = os.getenv("CHAT_BACKGROUND_LEARNING", "true").lower() == "true"
+    LEARNING_CONCURRENCY = int(os.getenv("LEARNING_CONCURRENCY", 4))  # extractions at once
+    LEARNING_DEBOUNCE_SECONDS = float(os.getenv("LEARNING_DEBOUNCE_SECONDS", 3))  # coalescing window per user
+    LEARNING_RESULT_TTL = int(os.getenv("LEARNING_RESULT_TTL", 600))  # seconds a result waits to be collected
+
     # AI Model Configuration
     GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
     GROQ_MODEL = os.getenv("GROQ_MODEL", "openai/gpt-oss-120b")
@@ -56,6 +121,22 @@ class Config:
     ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-opus-5")
     LEGACY_MODEL = os.getenv("LEGACY_MODEL", "gpt-3.5-turbo")  # For legacy system
 
+    # How /generate-content builds a task when the request does not say:
+    # sequential | parallel | single
+    GENERATE_CONTENT_MODE = os.getenv("GENERATE_CONTENT_MODE", "sequential").lower()
+
+    # Batch classification endpoints pack this many items into one provider call
+    CLASSIFY_BATCH_MAX_ITEMS = int(os.getenv("CLASSIFY_BATCH_MAX_ITEMS", 40))
+
+    # Local task type classifier; titles it is less sure of go to the LLM
+    TASK_TYPE_MODEL_DIR = os.getenv("TASK_TYPE_MODEL_DIR", "")  # versioned models; empty disables it
+    TASK_TYPE_CONFIDENCE = float(os.getenv("TASK_TYPE_CONFIDENCE", 0.85))
+
+    # Local priority scoring (keyword rules plus a trained model); less sure tasks go to the LLM
+    PRIORITY_MODEL_DIR = os.getenv("PRIORITY_MODEL_DIR", TASK_TYPE_MODEL_DIR)  # empty: rules only
+    PRIORITY_CONFIDENCE = float(os.getenv("PRIORITY_CONFIDENCE", 0.8))
+    PRIORITY_BULK_MAX_TASKS = int(os.getenv("PRIORITY_BULK_MAX_TASKS", 10000))  # per /priority/bulk request
+
     @classmethod
     def validate(cls):
         """Validate required configuration"""
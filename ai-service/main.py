@@ -1,20 +1,39 @@
 from fastapi import FastAPI, HTTPException, Depends, Security
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import logging
 from datetime import datetime
 import psutil
 import os
 import asyncio
+import time
 import aiohttp
 from config import get_config
-from services.content_generator import ContentGenerator
+from services.content_generator import ContentGenerator, MissingAPIKeyError
 from services.web_scraper import WebScraper
 from services.chat_service import ChatService
+from services import http_transport
+from services import anthropic_client
+from services.rate_limiter import rate_limiter
+from services.response_cache import response_cache
+from services.learning_queue import learning_queue
+from services.extraction_cache import extraction_cache
+from services.cpu_pool import cpu_pool
+from services.ocr_engine import ocr_engine
+from services.browser_pool import browser_pool
+from services.scrape_cache import scrape_cache
+from services.scrape_router import scrape_router
+from services.knowledge_index import knowledge_index
+from services.prompt_budget import prompt_stats
+from services.prompt_memo import prompt_memo
+from services.prompt_cache import prompt_cache
+from services.task_type_classifier import task_type_classifier
+from services.priority_engine import priority_engine
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
 import traceback
+import json
 
 # Configure logging
 logger = logging.getLogger("ai_service")
@@ -77,6 +96,15 @@ def resolve_api_key(provided_key: str | None, endpoint_name: str) -> str:
         detail="AI is not configured for your company. Please contact your administrator to add an AI API key."
     )
 
+def optional_api_key(provided_key: str | None, endpoint_name: str) -> str | None:
+    """
+    resolve_api_key for endpoints that may answer without any provider call. With no
+    key, the generator raises MissingAPIKeyError only if a provider call is needed.
+    """
+    if provided_key and provided_key.strip():
+        return resolve_api_key(provided_key, endpoint_name)
+    return None
+
 def resolve_api_key_pool(provided_key: str | None, endpoint_name: str, provider: str = "gemini") -> list:
     """
     Build a pool of API keys from the company-provided key(s) ONLY.
@@ -148,6 +176,28 @@ async def keepalive():
         "message": "AI service is awake and running"
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Internal counters for the shared AI-call machinery"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "rate_limiter": rate_limiter.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "learning_queue": learning_queue.get_stats(),
+        "extraction_cache": extraction_cache.get_stats(),
+        "cpu_pool": cpu_pool.get_stats(),
+        "ocr_pool": ocr_engine.get_stats(),
+        "browser_pool": browser_pool.get_stats(),
+        "scrape_cache": scrape_cache.get_stats(),
+        "scrape_router": scrape_router.get_stats(),
+        "knowledge_index": knowledge_index.get_stats(),
+        "system_prompt": prompt_stats.get_stats(),
+        "prompt_memo": prompt_memo.get_stats(),
+        "prompt_cache": prompt_cache.get_stats(),
+        "task_type_classifier": task_type_classifier.get_stats(),
+        "priority_engine": priority_engine.get_stats(),
+    }
+
 @app.get("/api-keys-status")
 async def api_keys_status():
     """Check status of all configured API keys"""
@@ -165,7 +215,7 @@ async def api_keys_status():
             key_preview = f"{key[:6]}..."
             
             # Try a simple test request with this key
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{config.GEMINI_MODEL}:generateContent"
+            url = f"{config.GEMINI_API_BASE_URL}/models/{config.GEMINI_MODEL}:generateContent"
             headers = {
                 'Content-Type': 'application/json',
                 'X-goog-api-key': key
@@ -179,33 +229,33 @@ async def api_keys_status():
             }
             
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                        if response.status == 200:
-                            keys_status.append({
-                                "index": i,
-                                "preview": key_preview,
-                                "status": "active",
-                                "message": "Working"
-                            })
-                        elif response.status == 429:
-                            error_text = await response.text()
-                            keys_status.append({
-                                "index": i,
-                                "preview": key_preview,
-                                "status": "quota_exceeded",
-                                "message": "Quota exceeded",
-                                "error": error_text[:200]
-                            })
-                        else:
-                            error_text = await response.text()
-                            keys_status.append({
-                                "index": i,
-                                "preview": key_preview,
-                                "status": "error",
-                                "message": f"HTTP {response.status}",
-                                "error": error_text[:200]
-                            })
+                session = http_transport.get_session()
+                async with session.post(url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    if response.status == 200:
+                        keys_status.append({
+                            "index": i,
+                            "preview": key_preview,
+                            "status": "active",
+                            "message": "Working"
+                        })
+                    elif response.status == 429:
+                        error_text = await response.text()
+                        keys_status.append({
+                            "index": i,
+                            "preview": key_preview,
+                            "status": "quota_exceeded",
+                            "message": "Quota exceeded",
+                            "error": error_text[:200]
+                        })
+                    else:
+                        error_text = await response.text()
+                        keys_status.append({
+                            "index": i,
+                            "preview": key_preview,
+                            "status": "error",
+                            "message": f"HTTP {response.status}",
+                            "error": error_text[:200]
+                        })
             except Exception as e:
                 keys_status.append({
                     "index": i,
@@ -275,16 +325,23 @@ class GenerateContentRequest(BaseModel):
     api_key: Optional[str] = None  # Company-specific API key
     provider: Optional[str] = "gemini"  # Selected AI provider
     model: Optional[str] = None  # Optional model override (set by the platform key)
+    # sequential | parallel | single. Unset uses GENERATE_CONTENT_MODE.
+    mode: Optional[str] = None
 
 class ScrapeUrlRequest(BaseModel):
     url: str
 
+class ScrapeUrlsRequest(BaseModel):
+    urls: List[str]
+
 @app.post("/generate-content", dependencies=[Depends(require_service_token)])
 async def generate_content(request: GenerateContentRequest):
     """Generate content using configured AI provider with optional knowledge sources"""
     try:
         api_key_to_use = resolve_api_key(request.api_key, "generate-content")
-        temp_generator = ContentGenerator(api_key_to_use, provider=request.provider, model=request.model)
+        temp_generator = ContentGenerator(
+            api_key_to_use, provider=request.provider, model=request.model, cache_namespace="generate-content"
+        )
         
         # Set knowledge sources if provided
         if request.knowledge_sources:
@@ -294,17 +351,24 @@ async def generate_content(request: GenerateContentRequest):
         if request.company_name:
             temp_generator.set_company_name(request.company_name)
         
+        mode = (request.mode or config.GENERATE_CONTENT_MODE).lower()
+        if mode not in ContentGenerator.GENERATION_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown mode '{mode}'. Use one of: {', '.join(ContentGenerator.GENERATION_MODES)}"
+            )
+
         # Generate content
-        description = await temp_generator.generate_description(request.title)
-        goals = await temp_generator.generate_goals(request.title)
-        priority = await temp_generator.analyze_priority(request.title, description)
+        content = await temp_generator.generate_task_content(request.title, mode)
         
         return {
             "ai_provider": temp_generator.provider,
             "model": temp_generator.model,
-            "description": description,
-            "goals": goals,
-            "priority": priority
+            "mode": mode,
+            "description": content["description"],
+            "goals": content["goals"],
+            "priority": content["priority"],
+            "priority_source": content["priority_source"]
         }
     except HTTPException:
         raise
@@ -331,7 +395,9 @@ async def summarize(request: SummarizeRequest):
     """Summarize text using configured AI provider"""
     try:
         api_key_to_use = resolve_api_key(request.api_key, "summarize")
-        temp_generator = ContentGenerator(api_key_to_use, provider=request.provider, model=request.model)
+        temp_generator = ContentGenerator(
+            api_key_to_use, provider=request.provider, model=request.model, cache_namespace="summarize"
+        )
         summary = await temp_generator.summarize_text(request.text, request.max_length)
         return {"summary": summary}
     except Exception as e:
@@ -383,7 +449,9 @@ async def ticket_check(request: TicketCheckRequest):
     """
     try:
         api_key_to_use = resolve_api_key(request.api_key, "ticket-check")
-        generator = ContentGenerator(api_key_to_use, provider=request.provider, model=request.model)
+        generator = ContentGenerator(
+            api_key_to_use, provider=request.provider, model=request.model, cache_namespace="ticket-check"
+        )
         note = await generator.write_ticket_note(request.draftTitle, request.facts, request.max_length)
         return {"note": note}
     except Exception as e:
@@ -407,6 +475,23 @@ async def scrape_url(request: ScrapeUrlRequest):
             }
         )
 
+@app.post("/scrape-urls", dependencies=[Depends(require_service_token)])
+async def scrape_urls(request: ScrapeUrlsRequest):
+    """Scrape several URLs concurrently.
+
+    Streams newline-delimited JSON, one line per URL as it finishes (not in request
+    order): the /scrape-url result plus its "url".
+    """
+    async def result_lines():
+        async for url, result in web_scraper.scrape_each(request.urls):
+            yield json.dumps({"url": url, **result}, default=str) + "\n"
+
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
 class ChatRequest(BaseModel):
     message: str
     userContext: Dict[str, Any]
@@ -421,6 +506,7 @@ class ChatRequest(BaseModel):
     model: Optional[str] = None  # Optional model override (set by the platform key)
     files: Optional[List[Any]] = None # Use Any to avoid strict Pydantic dictionary validation if something weird is sent
     userToken: Optional[str] = None # User's access token for file fetching
+    learningCallbackUrl: Optional[str] = None  # Where background-learned context is POSTed, if set
 
 @app.post("/chat", dependencies=[Depends(require_service_token)])
 async def chat(request: ChatRequest):
@@ -440,7 +526,8 @@ async def chat(request: ChatRequest):
             is_deep_analysis=request.isDeepAnalysis,
             company_name=request.companyName,
             files=request.files, # Pass files here
-            user_token=request.userToken # Pass user token
+            user_token=request.userToken, # Pass user token
+            learning_callback_url=request.learningCallbackUrl
         )
         return result
     except HTTPException:
@@ -456,6 +543,60 @@ async def chat(request: ChatRequest):
             }
         )
 
+@app.post("/chat/stream", dependencies=[Depends(require_service_token)])
+async def chat_stream(request: ChatRequest):
+    """Stream a chat reply as server-sent events.
+
+    Emits `token` events ({"text": ...}) as the provider produces text, then one `done`
+    event with the same body /chat returns, or one `error` event. A missing API key is
+    reported as an `error` event too, so the client has a single failure path.
+    """
+    async def event_stream():
+        try:
+            api_key_pool = resolve_api_key_pool(request.api_key, "chat", provider=request.provider)
+        except HTTPException as e:
+            error = {"message": str(e.detail), "contextUsed": False, "learnedContext": None}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+            return
+        temp_chat_service = ChatService(api_key_pool, provider=request.provider, model=request.model)
+
+        async for event, data in temp_chat_service.stream_chat_message(
+            message=request.message,
+            user_context=request.userContext,
+            user=request.user,
+            conversation_history=request.conversationHistory,
+            knowledge_sources=request.knowledgeSources,
+            additional_context=request.additionalContext,
+            is_deep_analysis=request.isDeepAnalysis,
+            company_name=request.companyName,
+            files=request.files,
+            user_token=request.userToken,
+            learning_callback_url=request.learningCallbackUrl
+        ):
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # stop nginx/Render proxies from buffering the stream
+        },
+    )
+
+@app.get("/learned-context/{user_id}", dependencies=[Depends(require_service_token)])
+async def learned_context(user_id: str):
+    """Collect context learned in the background from this user's recent chat messages.
+
+    Each result is handed out once. `pending` is true while an extraction for the user
+    is still queued or running, so the caller knows to ask again.
+    """
+    return {
+        "userId": user_id,
+        "learnedContext": learning_queue.pop_result(user_id),
+        "pending": learning_queue.is_pending(user_id),
+    }
+
 @app.post("/detect-task-type", dependencies=[Depends(require_service_token)])
 async def detect_task_type(request: dict):
     """Detect task type from title"""
@@ -468,7 +609,9 @@ async def detect_task_type(request: dict):
         
         api_key_to_use = resolve_api_key(api_key, "detect-task-type")
         provider = request.get("provider", "gemini")
-        temp_generator = ContentGenerator(api_key_to_use, provider=provider, model=request.get("model"))
+        temp_generator = ContentGenerator(
+            api_key_to_use, provider=provider, model=request.get("model"), cache_namespace="detect-task-type"
+        )
         task_type = await temp_generator.detect_task_type(title)
         
         return {
@@ -481,6 +624,131 @@ async def detect_task_type(request: dict):
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+class DetectTaskTypeBatchRequest(BaseModel):
+    titles: List[str]
+    api_key: Optional[str] = None  # Company-specific API key
+    provider: Optional[str] = "gemini"
+    model: Optional[str] = None
+
+@app.post("/detect-task-type/batch", dependencies=[Depends(require_service_token)])
+async def detect_task_type_batch(request: DetectTaskTypeBatchRequest):
+    """Detect the task type of many titles, packed into a few provider calls"""
+    if not request.titles:
+        raise HTTPException(status_code=400, detail="Titles required")
+    try:
+        api_key_to_use = optional_api_key(request.api_key, "detect-task-type-batch")
+        temp_generator = ContentGenerator(
+            api_key_to_use, provider=request.provider, model=request.model, cache_namespace="detect-task-type"
+        )
+        task_types = await temp_generator.detect_task_types(request.titles)
+
+        return {
+            "task_types": task_types,
+            "ai_provider": temp_generator.provider,
+            "model": temp_generator.model,
+        }
+    except HTTPException:
+        raise
+    except MissingAPIKeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch task type detection failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+class PriorityTask(BaseModel):
+    title: str
+    description: Optional[str] = ""
+
+class AnalyzePriorityBatchRequest(BaseModel):
+    tasks: List[PriorityTask]
+    knowledge_sources: Optional[List[dict]] = None
+    company_name: Optional[str] = None
+    api_key: Optional[str] = None  # Company-specific API key
+    provider: Optional[str] = "gemini"
+    model: Optional[str] = None
+
+@app.post("/analyze-priority/batch", dependencies=[Depends(require_service_token)])
+async def analyze_priority_batch(request: AnalyzePriorityBatchRequest):
+    """Suggest a 1-5 priority for many tasks, packed into a few provider calls"""
+    if not request.tasks:
+        raise HTTPException(status_code=400, detail="Tasks required")
+    try:
+        api_key_to_use = optional_api_key(request.api_key, "analyze-priority-batch")
+        temp_generator = ContentGenerator(
+            api_key_to_use, provider=request.provider, model=request.model, cache_namespace="analyze-priority"
+        )
+        if request.knowledge_sources:
+            temp_generator.set_knowledge_sources(request.knowledge_sources)
+        if request.company_name:
+            temp_generator.set_company_name(request.company_name)
+
+        scored = await temp_generator.score_priorities([task.model_dump() for task in request.tasks])
+
+        return {
+            "priorities": [priority for priority, _ in scored],
+            "priority_sources": [source for _, source in scored],
+            "ai_provider": temp_generator.provider,
+            "model": temp_generator.model,
+        }
+    except HTTPException:
+        raise
+    except MissingAPIKeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch priority analysis failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+class BulkPriorityTask(BaseModel):
+    id: Optional[str] = None
+    title: str
+    description: Optional[str] = ""
+
+class BulkPriorityRequest(BaseModel):
+    tasks: List[BulkPriorityTask]
+    use_model: bool = True  # False: keyword rules only
+
+@app.post("/priority/bulk", dependencies=[Depends(require_service_token)])
+async def priority_bulk(request: BulkPriorityRequest):
+    """Score a whole backlog locally, without any provider call.
+
+    Each result says whether it clears PRIORITY_CONFIDENCE; the rest are worth
+    sending to /analyze-priority/batch.
+    """
+    if not request.tasks:
+        raise HTTPException(status_code=400, detail="Tasks required")
+    if len(request.tasks) > config.PRIORITY_BULK_MAX_TASKS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {config.PRIORITY_BULK_MAX_TASKS} tasks per request"
+        )
+    try:
+        started = time.perf_counter()
+        scores = await asyncio.to_thread(
+            priority_engine.triage,
+            [(task.title, task.description or "") for task in request.tasks],
+            request.use_model,
+        )
+        return {
+            "results": [
+                {
+                    "id": task.id,
+                    "priority": score.priority,
+                    "confidence": score.confidence,
+                    "source": score.source,
+                    "confident": score.confidence >= priority_engine.threshold,
+                }
+                for task, score in zip(request.tasks, scores)
+            ],
+            "model_version": priority_engine.version if request.use_model else None,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+    except Exception as e:
+        logger.error(f"Bulk priority scoring failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/generate-subtasks", dependencies=[Depends(require_service_token)])
 async def generate_subtasks(request: dict):
     """Generate intelligent subtasks"""
@@ -666,6 +934,16 @@ async def startup_event():
         # Validate configuration
         config.validate()
         logger.info("Configuration validated successfully")
+
+        # One pooled HTTP session for every outbound provider call
+        await http_transport.start()
+
+        # Make sure Chromium is installed for deep scrapes, once, without delaying startup
+        browser_pool.schedule_install()
+
+        # Local task type and priority models, if they have been trained
+        await asyncio.to_thread(task_type_classifier.load)
+        await asyncio.to_thread(priority_engine.load)
         
         # Log Gemini configuration
         logger.info("Using AI provider: Gemini")
@@ -686,6 +964,12 @@ async def startup_event():
 async def shutdown_event():
     """Run cleanup tasks"""
     logger.info("Shutting down AI service...")
+    await learning_queue.close()
+    await http_transport.close()
+    await anthropic_client.close_clients()
+    cpu_pool.close()
+    ocr_engine.close()
+    await browser_pool.close()
 
 # Main entry point for direct execution
 if __name__ == "__main__":
@@ -9,9 +9,15 @@ key a super admin saved in Settings → AI Platform. Nothing is read from the
 environment except the default model.
 """
 
+import hashlib
 import logging
 import os
-from typing import Any, Dict, List, Optional
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .prompt_cache import anthropic_system, prompt_cache
+from .rate_limiter import rate_limiter
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +37,11 @@ DEFAULT_EFFORT = os.getenv("ANTHROPIC_EFFORT", "medium")
 # instead of handing us an empty response.
 FALLBACK_BETA = "server-side-fallback-2026-07-01"
 
+# Live clients are kept per API key so a company's next call reuses the SDK's warm
+# httpx pool. Bounded, and clients idle for longer than this are closed.
+CLIENT_CACHE_SIZE = int(os.getenv("ANTHROPIC_CLIENT_CACHE_SIZE", "32"))
+CLIENT_IDLE_SECONDS = int(os.getenv("ANTHROPIC_CLIENT_IDLE_SECONDS", "600"))
+
 IMAGE_MIME_TYPES = {
     "image/jpeg": "image/jpeg",
     "image/jpg": "image/jpeg",
@@ -56,6 +67,80 @@ def _client(api_key: str):
     return AsyncAnthropic(api_key=api_key)
 
 
+class _CachedClient:
+    """One live AsyncAnthropic plus the bookkeeping needed to close it safely."""
+
+    __slots__ = ("client", "last_used", "leases", "retired")
+
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.leases = 0  # requests currently using this client
+        self.retired = False  # evicted; close once the last lease is returned
+
+
+# Keyed by a SHA-256 of the API key so raw keys never sit in a dict that might be
+# logged or inspected. Most-recently-used last.
+_clients: "OrderedDict[str, _CachedClient]" = OrderedDict()
+
+
+def _key_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+async def _retire(entry: _CachedClient) -> None:
+    """Close an evicted client now, or when its in-flight requests finish."""
+    entry.retired = True
+    if entry.leases == 0:
+        await entry.client.close()
+
+
+async def _evict_idle() -> None:
+    cutoff = time.monotonic() - CLIENT_IDLE_SECONDS
+    for key_hash, entry in list(_clients.items()):
+        if entry.leases == 0 and entry.last_used < cutoff:
+            del _clients[key_hash]
+            await _retire(entry)
+
+
+async def _lease_client(api_key: str) -> _CachedClient:
+    """Return the cached client for this key, creating it if needed."""
+    await _evict_idle()
+
+    key_hash = _key_hash(api_key)
+    entry = _clients.get(key_hash)
+    if entry is None:
+        entry = _CachedClient(_client(api_key))
+        _clients[key_hash] = entry
+        while len(_clients) > CLIENT_CACHE_SIZE:
+            _, oldest = _clients.popitem(last=False)
+            await _retire(oldest)
+    else:
+        _clients.move_to_end(key_hash)
+
+    entry.leases += 1
+    entry.last_used = time.monotonic()
+    return entry
+
+
+async def _release_client(entry: _CachedClient) -> None:
+    entry.leases -= 1
+    entry.last_used = time.monotonic()
+    if entry.retired and entry.leases == 0:
+        await entry.client.close()
+
+
+async def close_clients() -> None:
+    """Close every cached client. Called from the FastAPI shutdown hook."""
+    entries = list(_clients.values())
+    _clients.clear()
+    for entry in entries:
+        entry.retired = True
+        await entry.client.close()
+    if entries:
+        logger.info(f"Closed {len(entries)} cached Anthropic client(s)")
+
+
 def _guess_image_media_type(name: str, mime: str) -> Optional[str]:
     """Return a Claude-acceptable image media type, or None if this isn't an image."""
     if mime and mime.lower() in IMAGE_MIME_TYPES:
@@ -144,16 +229,17 @@ async def generate(
     files: Optional[List[Dict[str, Any]]] = None,
     max_tokens: Optional[int] = None,
     effort: Optional[str] = None,
+    cacheable_chars: int = 0,
 ) -> str:
     """Send one prompt to Claude and return the text response.
 
-    Raises AnthropicProviderError with a message worth showing a user. Rate limits
-    keep the literal "429" in the message so the NestJS layer classifies them the
-    same way it does for the other providers.
+    The first `cacheable_chars` of the system prompt are marked for prompt caching
+    (see prompt_cache). Raises AnthropicProviderError with a message worth showing a
+    user. Rate limits keep the literal "429" in the message so the NestJS layer
+    classifies them the same way it does for the other providers.
     """
     import anthropic
 
-    client = _client(api_key)
     model_id = model or DEFAULT_MODEL
 
     request: Dict[str, Any] = {
@@ -163,8 +249,11 @@ async def generate(
         "messages": [{"role": "user", "content": build_user_content(prompt, files)}],
     }
     if system_prompt:
-        request["system"] = system_prompt
+        request["system"] = anthropic_system(system_prompt, cacheable_chars)
 
+    await rate_limiter.acquire("anthropic", api_key)
+    lease = await _lease_client(api_key)
+    client = lease.client
     try:
         try:
             # Preferred path: refusals are retried server-side on a fallback model.
@@ -177,30 +266,97 @@ async def generate(
             logger.warning(f"Claude fallback beta unavailable ({beta_error}); retrying without it.")
             response = await client.messages.create(**request)
 
+        prompt_cache.record_anthropic_usage(getattr(response, "usage", None))
         return _extract_text(response)
 
-    except anthropic.AuthenticationError as e:
-        raise AnthropicProviderError(
+    except anthropic.APIError as e:
+        raise _provider_error(e, model_id) from e
+    finally:
+        await _release_client(lease)
+
+
+async def stream(
+    api_key: str,
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    model: Optional[str] = None,
+    files: Optional[List[Dict[str, Any]]] = None,
+    max_tokens: Optional[int] = None,
+    effort: Optional[str] = None,
+    cacheable_chars: int = 0,
+) -> AsyncIterator[str]:
+    """Like generate(), but yields the answer text as Claude produces it.
+
+    A refusal or an empty max_tokens answer is detected on the final message and
+    raised as AnthropicProviderError after whatever text was already yielded.
+    """
+    import anthropic
+
+    model_id = model or DEFAULT_MODEL
+
+    request: Dict[str, Any] = {
+        "model": model_id,
+        "max_tokens": max_tokens or DEFAULT_MAX_TOKENS,
+        "output_config": {"effort": effort or DEFAULT_EFFORT},
+        "messages": [{"role": "user", "content": build_user_content(prompt, files)}],
+    }
+    if system_prompt:
+        request["system"] = anthropic_system(system_prompt, cacheable_chars)
+
+    await rate_limiter.acquire("anthropic", api_key)
+    lease = await _lease_client(api_key)
+    client = lease.client
+    try:
+        try:
+            manager = client.beta.messages.stream(
+                **request, betas=[FALLBACK_BETA], extra_body={"fallbacks": "default"}
+            )
+            message_stream = await manager.__aenter__()
+        except (anthropic.BadRequestError, TypeError) as beta_error:
+            logger.warning(f"Claude fallback beta unavailable ({beta_error}); retrying without it.")
+            manager = client.messages.stream(**request)
+            message_stream = await manager.__aenter__()
+
+        try:
+            async for text in message_stream.text_stream:
+                yield text
+            final_message = await message_stream.get_final_message()
+            prompt_cache.record_anthropic_usage(getattr(final_message, "usage", None))
+            _extract_text(final_message)
+        finally:
+            await manager.__aexit__(None, None, None)
+
+    except anthropic.APIError as e:
+        raise _provider_error(e, model_id) from e
+    finally:
+        await _release_client(lease)
+
+
+def _provider_error(e: Exception, model_id: str) -> AnthropicProviderError:
+    """Map an SDK error to a message worth showing a user."""
+    import anthropic
+
+    if isinstance(e, anthropic.AuthenticationError):
+        return AnthropicProviderError(
             "The Anthropic API key is invalid or has been revoked. Update it in the admin panel."
-        ) from e
-    except anthropic.PermissionDeniedError as e:
-        raise AnthropicProviderError(
+        )
+    if isinstance(e, anthropic.PermissionDeniedError):
+        return AnthropicProviderError(
             "This Anthropic API key does not have access to the requested model. "
             f"Model: {model_id}."
-        ) from e
-    except anthropic.NotFoundError as e:
-        raise AnthropicProviderError(f"Unknown Anthropic model: {model_id}.") from e
-    except anthropic.RateLimitError as e:
-        raise AnthropicProviderError(
+        )
+    if isinstance(e, anthropic.NotFoundError):
+        return AnthropicProviderError(f"Unknown Anthropic model: {model_id}.")
+    if isinstance(e, anthropic.RateLimitError):
+        return AnthropicProviderError(
             f"AI quota exceeded (429) on the Anthropic key. Anthropic said: {e}"
-        ) from e
-    except anthropic.APIStatusError as e:
+        )
+    if isinstance(e, anthropic.APIStatusError):
         if e.status_code == 400 and "credit balance" in str(e).lower():
-            raise AnthropicProviderError(
+            return AnthropicProviderError(
                 "The Anthropic account has no credit left. Add credit at console.anthropic.com/billing."
-            ) from e
-        raise AnthropicProviderError(f"Anthropic API error ({e.status_code}): {e}") from e
-    except anthropic.APIConnectionError as e:
-        raise AnthropicProviderError(f"Could not reach Anthropic: {e}") from e
-    finally:
-        await client.close()
+            )
+        return AnthropicProviderError(f"Anthropic API error ({e.status_code}): {e}")
+    if isinstance(e, anthropic.APIConnectionError):
+        return AnthropicProviderError(f"Could not reach Anthropic: {e}")
+    return AnthropicProviderError(f"Anthropic API error: {e}")
@@ -0,0 +1,156 @@
+"""Chat attachments, decoded and extracted once per request.
+
+A file reaches /chat either as embedded base64 or as a URL on the backend. Each one is
+turned into an Attachment the first time it is needed. That means decoding the base64
+once, fetching the URL once, and parsing PDF/DOCX once (see document_parsing). The text-provider
+path (document text appended to the message) and the Gemini multimodal path (inline
+parts) both read from the same object.
+"""
+
+import asyncio
+import base64
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from . import document_parsing, http_transport
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+
+
+@dataclass
+class Attachment:
+    name: str
+    mime: str
+    kind: str  # image | pdf | docx | file
+    source: str = "url"  # "base64" when embedded in the request, "url" when fetched
+    url: str = ""
+    data: Optional[bytes] = None  # decoded or downloaded bytes, None if unavailable
+    b64: Optional[str] = None  # base64 of `data`, as sent or encoded once on demand
+    text: Optional[str] = None  # extracted text for pdf/docx/file, None if not extracted
+    page_count: int = 0
+    pages_included: int = 0  # pages whose text is in `text`
+    truncated: bool = False  # `text` stopped at the caller's character budget
+    error: Optional[str] = None  # why the bytes or the text could not be produced
+    fetch_status: Optional[int] = None  # HTTP status when fetching a URL failed
+
+    def as_base64(self) -> Optional[str]:
+        """The base64 form, encoding the bytes the first time it is asked for."""
+        if self.b64 is None and self.data is not None:
+            self.b64 = base64.b64encode(self.data).decode("utf-8")
+        return self.b64
+
+
+def classify(name: str, mime: str) -> str:
+    """Map a file name and mime type to the kinds the chat paths distinguish."""
+    lowered = (name or "").lower()
+    mime = mime or ""
+    if mime.startswith("image/") or lowered.endswith(IMAGE_EXTENSIONS):
+        return "image"
+    if lowered.endswith(".pdf") or mime == "application/pdf":
+        return "pdf"
+    if lowered.endswith((".docx", ".doc")) or "word" in mime.lower():
+        return "docx"
+    return "file"
+
+
+async def _extract(attachment: Attachment, max_chars: Optional[int]) -> None:
+    """Fill in attachment.text and the page report from attachment.data."""
+    if attachment.data is None or attachment.kind == "image":
+        return
+    try:
+        if attachment.kind in ("pdf", "docx"):
+            extracted = await document_parsing.extract(attachment.kind, attachment.data, max_chars)
+            attachment.text = extracted.text
+            attachment.page_count = extracted.page_count
+            attachment.pages_included = extracted.pages_included
+            attachment.truncated = extracted.truncated
+            if attachment.truncated and attachment.page_count:
+                logger.info(
+                    f"📄 Extracted {len(attachment.text)} chars from {attachment.kind.upper()} {attachment.name} "
+                    f"(pages 1-{attachment.pages_included} of {attachment.page_count}, budget {max_chars})"
+                )
+            else:
+                logger.info(f"📄 Extracted {len(attachment.text)} chars from {attachment.kind.upper()} {attachment.name}")
+        else:
+            attachment.text = attachment.data.decode("utf-8", errors="replace")
+    except Exception as e:
+        attachment.error = str(e)
+        logger.error(f"❌ {attachment.kind.upper()} extraction failed for {attachment.name}: {e}")
+
+
+async def from_file_payload(f: Dict[str, Any], max_chars: Optional[int] = None) -> Attachment:
+    """Build an Attachment from one /chat file entry, decoding embedded base64 if present.
+
+    Images are decoded but never parsed. Documents are parsed up to `max_chars`. Files
+    without base64 stay URL-only until fetch() is awaited.
+    """
+    name = f.get("name", "file")
+    mime = f.get("type", "")
+    attachment = Attachment(name=name, mime=mime, kind=classify(name, mime), url=f.get("url", ""))
+
+    b64 = f.get("base64")
+    if b64:
+        attachment.source = "base64"
+        attachment.b64 = b64
+        try:
+            attachment.data = base64.b64decode(b64)
+        except Exception as e:
+            attachment.error = str(e)
+            logger.error(f"❌ Base64 decode error for {name}: {e}")
+            return attachment
+        await _extract(attachment, max_chars)
+    return attachment
+
+
+async def prepare(files: Optional[List[Dict[str, Any]]], max_chars: Optional[int] = None) -> List[Attachment]:
+    """Decode and extract all embedded files, parsing them concurrently in the CPU pool."""
+    return list(await asyncio.gather(*(from_file_payload(f, max_chars) for f in files or [])))
+
+
+def _absolute_url(url: str) -> str:
+    if url.startswith("http://") or url.startswith("https://"):
+        return url
+    # Prefer absolute URLs sent by backend; fallback to robust local/remote guessing
+    backend_base = os.getenv("BACKEND_URL", "").rstrip('/')
+    if backend_base:
+        url_sep = "" if url.startswith("/") else "/"
+        return f"{backend_base}{url_sep}{url}"
+    return f"http://localhost:3001/{url.lstrip('/')}"
+
+
+async def fetch(
+    attachment: Attachment, user_token: Optional[str] = None, max_chars: Optional[int] = None
+) -> Attachment:
+    """Download a URL-only attachment and extract it. No-op if the bytes are already here."""
+    if attachment.data is not None or attachment.error:
+        return attachment
+
+    full_url = _absolute_url(attachment.url)
+    headers = {}
+    if user_token:
+        headers['Authorization'] = user_token if user_token.startswith('Bearer ') else f'Bearer {user_token}'
+
+    try:
+        logger.info(f"✨ MULTIMODAL FETCH: Trying {attachment.name} from {full_url}")
+        session = http_transport.get_session()
+        async with session.get(full_url, headers=headers, timeout=aiohttp.ClientTimeout(total=20)) as response:
+            if response.status != 200:
+                logger.error(f"❌ FETCH FAILED (Status {response.status}) for {full_url}")
+                attachment.fetch_status = response.status
+                attachment.error = f"Status {response.status}"
+                return attachment
+            attachment.data = await response.read()
+    except Exception as e:
+        logger.error(f"❌ MULTIMODAL EXCEPTION ({attachment.name}): {e}")
+        attachment.error = str(e)
+        return attachment
+
+    logger.info(f"✅ Downloaded {attachment.name} ({len(attachment.data)} bytes)")
+    await _extract(attachment, max_chars)
+    return attachment
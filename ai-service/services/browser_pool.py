@@ -0,0 +1,175 @@
+"""Long-lived headless Chromium for deep scrapes.
+
+Every deep scrape used to run `playwright install chromium`, launch a fresh browser,
+build a context and tear it all down again: seconds of overhead and around 300 MB of
+memory churn per URL. Now the install check runs once, in the background at startup,
+and one browser per worker is started on first use and reused. It is relaunched if it
+disconnects.
+
+Scrapes lease a page from a browser context. At most BROWSER_MAX_CONTEXTS contexts
+are in use at once, and further scrapes wait their turn. Contexts are reused, with
+cookies cleared in between, and replaced after BROWSER_CONTEXT_MAX_USES leases so a
+long-lived context cannot accumulate state or leak memory.
+"""
+
+import asyncio
+import logging
+import subprocess
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+VIEWPORT = {'width': 1280, 'height': 800}
+
+
+def _install_chromium() -> None:
+    # In a Native Python environment (like Render), Playwright needs to install the browser
+    # into its default user cache. This bypasses the need for root permissions or complex
+    # Dockerfile modifications, and is practically instant if already installed.
+    try:
+        subprocess.run(
+            ["playwright", "install", "chromium"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        logger.info("✅ Playwright Chromium is installed")
+    except Exception as e:
+        logger.error(f"⚠️ Playwright install check failed: {e}")
+
+
+class _PooledContext:
+    __slots__ = ("context", "browser", "uses", "user_agent")
+
+    def __init__(self, context, browser, user_agent: Optional[str]):
+        self.context = context
+        self.browser = browser
+        self.user_agent = user_agent
+        self.uses = 0
+
+
+class BrowserPool:
+    def __init__(self, max_contexts: int, max_uses: int):
+        self.max_contexts = max(1, max_contexts)
+        self.max_uses = max(1, max_uses)
+        self._slots = asyncio.Semaphore(self.max_contexts)
+        self._start_lock = asyncio.Lock()
+        self._playwright = None
+        self._browser = None
+        self._idle: List[_PooledContext] = []
+        self._install_task: Optional[asyncio.Task] = None
+
+        self.launches = 0
+        self.leases = 0
+        self.contexts_created = 0
+        self.leased = 0
+
+    def schedule_install(self) -> None:
+        """Run the Playwright install check in the background. Called from startup."""
+        if self._install_task is None:
+            self._install_task = asyncio.create_task(asyncio.to_thread(_install_chromium))
+
+    async def _ensure_browser(self):
+        async with self._start_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+
+            self.schedule_install()
+            await self._install_task
+
+            if self._browser is not None:
+                logger.warning("⚠️ Headless Chromium disconnected; relaunching")
+                await self._discard_idle()
+
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+                self._playwright = await async_playwright().start()
+
+            started = time.monotonic()
+            self._browser = await self._playwright.chromium.launch(headless=True)
+            self.launches += 1
+            logger.info(f"🌐 Launched headless Chromium in {time.monotonic() - started:.2f}s")
+            return self._browser
+
+    async def _discard_idle(self) -> None:
+        idle, self._idle = self._idle, []
+        for entry in idle:
+            await self._close_context(entry)
+
+    @staticmethod
+    async def _close_context(entry: _PooledContext) -> None:
+        try:
+            await entry.context.close()
+        except Exception:
+            pass  # browser already gone
+
+    async def _lease_context(self, browser, user_agent: Optional[str]) -> _PooledContext:
+        for i in range(len(self._idle) - 1, -1, -1):
+            entry = self._idle[i]
+            if entry.user_agent == user_agent and entry.browser is browser:
+                del self._idle[i]
+                return entry
+
+        context = await browser.new_context(user_agent=user_agent, viewport=VIEWPORT)
+        self.contexts_created += 1
+        return _PooledContext(context, browser, user_agent)
+
+    @asynccontextmanager
+    async def page(self, user_agent: Optional[str] = None) -> AsyncIterator[Any]:
+        """Lease a fresh page in a pooled context; it is closed when the block exits."""
+        async with self._slots:
+            browser = await self._ensure_browser()
+            entry = await self._lease_context(browser, user_agent)
+            self.leases += 1
+            self.leased += 1
+            page = None
+            try:
+                page = await entry.context.new_page()
+                yield page
+            finally:
+                self.leased -= 1
+                entry.uses += 1
+                reusable = browser.is_connected() and entry.uses < self.max_uses
+                if page is not None:
+                    try:
+                        await page.close()
+                        if reusable:
+                            await entry.context.clear_cookies()
+                    except Exception:
+                        reusable = False
+                if reusable and browser is self._browser:
+                    self._idle.append(entry)
+                else:
+                    await self._close_context(entry)
+
+    async def close(self) -> None:
+        """Close contexts, the browser and Playwright. Called from the FastAPI shutdown hook."""
+        await self._discard_idle()
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+        playwright, self._playwright = self._playwright, None
+        if playwright is not None:
+            await playwright.stop()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "browser_running": self._browser is not None and self._browser.is_connected(),
+            "launches": self.launches,
+            "leases": self.leases,
+            "leased": self.leased,
+            "idle_contexts": len(self._idle),
+            "contexts_created": self.contexts_created,
+            "max_contexts": self.max_contexts,
+        }
+
+
+_config = get_config()
+browser_pool = BrowserPool(_config.BROWSER_MAX_CONTEXTS, _config.BROWSER_CONTEXT_MAX_USES)
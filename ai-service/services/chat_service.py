@@ -1,5 +1,5 @@
 import logging
-from typing import Dict, List, Any, Optional
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
 import google.generativeai as genai
 from datetime import datetime
 import json
@@ -7,14 +7,58 @@ import os
 import aiohttp
 import asyncio
 from .context_learning import ContextLearningService
+from . import http_transport
+from .rate_limiter import rate_limiter
+from .learning_queue import learning_queue
+from . import attachments
+from .attachments import Attachment
+from .knowledge_index import is_whole, knowledge_index
+from .prompt_budget import PromptSection, assemble
+from .prompt_cache import prompt_cache, split_prefix
 
 from config import get_config
 
 logger = logging.getLogger(__name__)
 
+async def _iter_sse_data(response: aiohttp.ClientResponse) -> AsyncIterator[str]:
+    """Yield the payload of each `data:` line of a server-sent-events response."""
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if line.startswith("data:"):
+            yield line[5:].strip()
+
 class ChatService:
     """Service for handling conversational AI chat with context and memory"""
 
+    # Character budgets for attachment text. Extraction stops once these are reached
+    # rather than parsing a whole document and slicing it afterwards.
+    DOCUMENT_TEXT_CHARS = 30000  # all documents appended to the message
+    FETCHED_DOCUMENT_CHARS = 25000  # each downloaded document in a Gemini prompt
+    FETCHED_FILE_CHARS = 15000  # each plain-text file in a Gemini prompt
+
+    # System prompt sections: (priority, token cap). Caps and trimming only apply when
+    # the prompt is over CHAT_SYSTEM_PROMPT_MAX_TOKENS: capped sections are cut to their
+    # cap, then the highest numbers go first. Priority 0 is never trimmed.
+    PROMPT_SECTIONS = {
+        "instructions": (0, None),
+        "company_knowledge": (1, None),
+        "knowledge_warning": (0, None),
+        "competitor_knowledge": (2, None),
+        "competitor_guidelines": (0, None),
+        "speaker": (0, None),
+        "user_memory": (3, 400),
+        "referenced_tasks": (1, 1500),
+        "referenced_tickets": (1, 3000),
+        "active_tickets": (4, 800),
+        "user_statistics": (5, None),
+        "active_tasks": (4, 1200),
+        "objectives": (5, 600),
+        "quarters": (6, 300),
+        "meetings": (3, 3000),
+        "mentioned_users": (2, 600),
+        "answer_rules": (0, None),
+    }
+
     def __init__(self, api_keys: List[str], provider: str = "gemini", model: Optional[str] = None):
         self.config = get_config()
         self.api_keys = api_keys if isinstance(api_keys, list) else [api_keys]
@@ -34,7 +78,7 @@ class ChatService:
             self.base_url = "https://api.openai.com/v1"
         else:
             self.model_name = model or self.config.GEMINI_MODEL
-            self.base_url = "https://generativelanguage.googleapis.com/v1beta"
+            self.base_url = self.config.GEMINI_API_BASE_URL
 
         self.learning_service = ContextLearningService(self.api_key, self.model_name, provider=self.provider)
         logger.info(f"✅ ChatService initialized with {self.provider} ({self.model_name}) and {len(self.api_keys)} API keys")
@@ -62,10 +106,102 @@ class ChatService:
         is_deep_analysis: bool = False,
         company_name: str = None,
         files: Optional[List[Dict[str, Any]]] = None,
-        user_token: Optional[str] = None
+        user_token: Optional[str] = None,
+        learning_callback_url: Optional[str] = None
     ) -> Dict[str, Any]:
         """Process an incoming chat message with dynamic provider routing and multimodal support"""
-        
+        try:
+            turn = await self._prepare_turn(
+                message, user_context, user, conversation_history, knowledge_sources,
+                additional_context, is_deep_analysis, company_name, files
+            )
+
+            response_text = await self._generate_reply(turn, user_token)
+            response_text = response_text.strip()
+
+            learning = await self._learn_from_turn(turn, learning_callback_url)
+
+            logger.info(f"✅ Generated chat response using {self.provider}")
+            if learning["learnedContext"]:
+                logger.debug(f"✅ Learned new context")
+
+            return {
+                "message": response_text,
+                "contextUsed": True,
+                **learning
+            }
+
+        except Exception as e:
+            return {
+                "message": self._describe_chat_error(e),
+                "contextUsed": False,
+                "learnedContext": None
+            }
+
+    async def stream_chat_message(
+        self,
+        message: str,
+        user_context: Dict[str, Any],
+        user: Dict[str, Any],
+        conversation_history: List[Dict[str, Any]],
+        knowledge_sources: List[Dict[str, Any]],
+        additional_context: Dict[str, Any] = None,
+        is_deep_analysis: bool = False,
+        company_name: str = None,
+        files: Optional[List[Dict[str, Any]]] = None,
+        user_token: Optional[str] = None,
+        learning_callback_url: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Stream a chat reply as (event, data) pairs.
+
+        Yields ("token", {"text": ...}) as the provider produces text, then exactly one
+        ("done", ...) carrying the full message and learnedContext in the same shape
+        process_chat_message returns, or one ("error", ...) with the user-facing error.
+        """
+        try:
+            turn = await self._prepare_turn(
+                message, user_context, user, conversation_history, knowledge_sources,
+                additional_context, is_deep_analysis, company_name, files
+            )
+
+            chunks = []
+            async for chunk in self._stream_reply(turn, user_token):
+                if chunk:
+                    chunks.append(chunk)
+                    yield "token", {"text": chunk}
+
+            learning = await self._learn_from_turn(turn, learning_callback_url)
+            logger.info(f"✅ Streamed chat response using {self.provider}")
+
+            yield "done", {
+                "message": "".join(chunks).strip(),
+                "contextUsed": True,
+                **learning
+            }
+
+        except Exception as e:
+            yield "error", {
+                "message": self._describe_chat_error(e),
+                "contextUsed": False,
+                "learnedContext": None
+            }
+
+    async def _prepare_turn(
+        self,
+        message: str,
+        user_context: Dict[str, Any],
+        user: Dict[str, Any],
+        conversation_history: List[Dict[str, Any]],
+        knowledge_sources: List[Dict[str, Any]],
+        additional_context: Dict[str, Any],
+        is_deep_analysis: bool,
+        company_name: str,
+        files: Optional[List[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Normalise the request and build everything a provider call needs.
+
+        Shared by the blocking and streaming paths so they send identical prompts.
+        """
         additional_context = additional_context or {}
         user_context = user_context or {}
         knowledge_sources = knowledge_sources or []
@@ -78,7 +214,7 @@ class ChatService:
             user_context = user_context[0]
         if isinstance(additional_context, list) and len(additional_context) > 0:
             additional_context = additional_context[0]
-        
+
         # Flatten knowledge_sources if it contains a list
         norm_ks = []
         for ks in knowledge_sources:
@@ -100,173 +236,221 @@ class ChatService:
         if not isinstance(user, dict):
             user = {}
 
-        # ── File-type flags (MUST be initialized before the try block regardless of whether files exist) ──
-        has_media = False   # True if at least one image is attached
-        has_docs = False    # True if at least one PDF/DOCX is attached
-        document_text = ""  # Pre-extracted text from PDF/DOCX files
+        # Only the parts of the knowledge sources relevant to this message (and the
+        # turn before it, for follow-ups) go in the system prompt.
+        knowledge_sources = [
+            s for s in knowledge_sources if s.get('type') in ('COMPANY', 'OWN_COMPANY', 'COMPETITOR')
+        ]
+        previous_turn = str(conversation_history[-1].get('content', ''))[:500] if conversation_history else ''
+        knowledge_excerpts = await knowledge_index.retrieve(knowledge_sources, f"{message}\n{previous_turn}")
 
         logger.info(f"FILES RECEIVED: {len(files) if files else 'NONE'} files")
         if files:
             import json
             logger.info(f"FILES PAYLOAD (first item struct): {json.dumps(files[0], default=str)[:1000]}")
-            
-            # Determine if we have IMAGES or PDF/DOCX for multimodal/text extraction
-            for file in files:
-                mime = file.get("type", "")
-                name = file.get("name", "")
-                b64 = file.get("base64", "")
-                
-                is_image = any(mime.startswith(t) for t in ["image/"]) or name.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".gif"))
-                is_pdf = name.lower().endswith(".pdf") or mime == "application/pdf"
-                is_doc = name.lower().endswith((".docx", ".doc")) or "word" in mime.lower()
-
-                if is_image:
-                    has_media = True
-                if is_pdf or is_doc:
-                    has_docs = True
 
-                # Extraction for all models (text context)
-                if b64 and is_pdf:
-                    try:
-                        import base64 as b64_lib
-                        import PyPDF2
-                        import io
-                        decoded = b64_lib.b64decode(b64)
-                        reader = PyPDF2.PdfReader(io.BytesIO(decoded))
-                        for page in reader.pages:
-                            txt = page.extract_text()
-                            if txt: document_text += txt + "\n"
-                        logger.info(f"📄 Pre-extracted {len(document_text)} chars from PDF {name}")
-                    except Exception as e:
-                        logger.error(f"❌ PDF extraction failed: {str(e)}")
-                elif b64 and is_doc:
-                    try:
-                        import base64 as b64_lib
-                        from docx import Document
-                        import io
-                        decoded = b64_lib.b64decode(b64)
-                        doc = Document(io.BytesIO(decoded))
-                        text = "\n".join([para.text for para in doc.paragraphs])
-                        if text: document_text += text + "\n"
-                        logger.info(f"📄 Pre-extracted text from Word doc {name}")
-                    except Exception as e:
-                        logger.error(f"❌ DOCX extraction failed: {str(e)}")
-
-            # Append document text to the user's message natively so any text provider can read it
-            if document_text:
-                document_text_header = "\n\n=== ATTACHED DOCUMENT CONTENT ===\n"
-                message = f"{message}{document_text_header}{document_text[:30000]}"
+        # Decode and extract every embedded file once; the provider paths below all
+        # read from these instead of decoding the base64 again.
+        prepared = await attachments.prepare(files, max_chars=self.DOCUMENT_TEXT_CHARS)
+        has_media = any(a.kind == "image" for a in prepared)  # True if at least one image is attached
+        has_docs = any(a.kind in ("pdf", "docx") for a in prepared)  # True if at least one PDF/DOCX is attached
+
+        # Append document text to the user's message natively so any text provider can read it
+        documents = [
+            a for a in prepared
+            if a.source == "base64" and a.kind in ("pdf", "docx") and a.text
+        ]
+        # (PDF text already ends each page with a newline.)
+        document_text = "".join(a.text if a.kind == "pdf" else a.text + "\n" for a in documents)
+        if document_text:
+            document_text_header = "\n\n=== ATTACHED DOCUMENT CONTENT ===\n"
+            truncation_notes = "".join(self._truncation_note(a) for a in documents)
+            message = f"{message}{document_text_header}{document_text[:self.DOCUMENT_TEXT_CHARS]}"
+            if truncation_notes:
+                message = f"{message.rstrip()}\n{truncation_notes}"
+
+        logger.info(f"Processing chat message (Files: {len(files) if files else 0}, HasMedia: {has_media}, HasDocs: {has_docs})")
+
+        # Construct dynamic history block
+        # Oldest-first. reversed() fed the model the conversation backwards,
+        # which is a large part of why it lost the thread between turns.
+        history_text = "CHAT HISTORY (oldest first):\n"
+        for msg in conversation_history[-12:]:
+            role_label = "Aura Assist" if msg.get("role") == "assistant" else "User"
+
+        # Create highly dynamic system prompt
+        system_prompt, cacheable_chars = self._build_system_prompt(
+            user=user,
+            user_context=user_context,
+            knowledge_sources=knowledge_sources,
+            knowledge_excerpts=knowledge_excerpts,
+            additional_context=additional_context,
+            is_deep_analysis=is_deep_analysis,
+            company_name=company_name,
+            has_files=(has_media or has_docs) # Flag active if any asset is attached
+        )
+
+        return {
+            "message": message,
+            "user": user,
+            "user_context": user_context,
+            "conversation_history": conversation_history,
+            "files": files,
+            "attachments": prepared,
+            "has_media": has_media,
+            "history_text": history_text,
+            "system_prompt": system_prompt,
+            "cacheable_chars": cacheable_chars,
+        }
 
-        try:
-            logger.info(f"Processing chat message (Files: {len(files) if files else 0}, HasMedia: {has_media}, HasDocs: {has_docs})")
-            
-            # Construct dynamic history block
-            # Oldest-first. reversed() fed the model the conversation backwards,
-            # which is a large part of why it lost the thread between turns.
-            history_text = "CHAT HISTORY (oldest first):\n"
-            for msg in conversation_history[-12:]:
-                role_label = "Aura Assist" if msg.get("role") == "assistant" else "User"
-
-            # Create highly dynamic system prompt
-            system_prompt = self._build_system_prompt(
-                user=user,
-                user_context=user_context,
-                knowledge_sources=knowledge_sources,
-                additional_context=additional_context,
-                is_deep_analysis=is_deep_analysis,
-                company_name=company_name,
-                has_files=(has_media or has_docs) # Flag active if any asset is attached
+    @staticmethod
+    def _truncation_note(attachment: Attachment) -> str:
+        """Tell the model a document was cut short, so it does not treat the excerpt as whole."""
+        if not attachment.truncated:
+            return ""
+        if attachment.page_count:
+            return f"[Document truncated: pages 1-{attachment.pages_included} of {attachment.page_count} included]\n"
+        return "[Document truncated]\n"
+
+    def _check_provider_can_serve(self, turn: Dict[str, Any]) -> None:
+        """Reject requests the configured provider cannot handle before calling it."""
+        if self.provider in ("groq", "openai") and turn["has_media"]:
+            # Only Gemini and Claude handle image attachments here. Groq/OpenAI text models
+            # used in this deployment don't do vision, and we never fall back to a platform key.
+            raise Exception(
+                f"Image attachments require a Google Gemini API key. Your company is configured "
+                f"with {self.provider}, which is set up for text only here. Please ask your "
+                f"administrator to use a Gemini key for image support."
             )
 
-            # Generate response via appropriate provider
-            if self.provider == "anthropic":
-                # Claude reads images and PDFs natively, so attachments go through as
-                # real content blocks rather than being rejected like the text-only
-                # OpenAI-compatible providers below.
-                from .anthropic_client import generate as anthropic_generate
-
-                user_prompt = f"{history_text}\n\nUser: {message}\nAura Assist:"
-                response_text = await anthropic_generate(
-                    api_key=self.api_key,
-                    prompt=user_prompt,
-                    system_prompt=system_prompt,
-                    model=self.model_name,
-                    files=files,
-                )
-            elif self.provider in ("groq", "openai") and not has_media:
-                # Groq and OpenAI share the OpenAI-compatible chat API. We flatten the
-                # prompt (it already includes any appended document text).
-                full_prompt = f"{system_prompt}\n\n{history_text}\n\nUser: {message}\nAura Assist:"
-                response_text = await self._generate_via_openai_compatible(full_prompt)
-            else:
-                # Only Gemini handles image attachments here. Groq/OpenAI text models used
-                # in this deployment don't do vision, and we never fall back to a platform key.
-                if self.provider in ("groq", "openai") and has_media:
-                    raise Exception(
-                        f"Image attachments require a Google Gemini API key. Your company is configured "
-                        f"with {self.provider}, which is set up for text only here. Please ask your "
-                        f"administrator to use a Gemini key for image support."
-                    )
-
-                if self.api_key and self.api_key.startswith("gsk_") and "generativelanguage" in self.base_url:
-                    raise Exception("A Groq API key is being inappropriately sent to Google's Gemini endpoint. Please check system fallback keys.")
-
-                # Primary attempt via REST (Gemini)
-                try:
-                    response_text = await self._generate_via_rest(
-                        message=message,
-                        system_prompt=system_prompt,
-                        history_text=history_text,
-                        files=files, 
-                        user_token=user_token
-                    )
-                except Exception as rest_e:
-                    # No cross-provider/platform-key failover: the company's own key is the
-                    # only key used. If it hits a rate limit, surface the error so the client
-                    # sees a clear "quota exceeded, contact your administrator" message.
-                    raise rest_e
-                
-            response_text = response_text.strip()
+        if self.provider not in ("anthropic", "groq", "openai"):
+            if self.api_key and self.api_key.startswith("gsk_") and "generativelanguage" in self.base_url:
+                raise Exception("A Groq API key is being inappropriately sent to Google's Gemini endpoint. Please check system fallback keys.")
 
-            # Use AI to intelligently extract and update context
-            learned_context = None
-            try:
-                learned_context = await self.learning_service.extract_and_update_context(
-                    message=message,
-                    existing_context=user_context,
-                    conversation_history=conversation_history,
-                    user_info=user
-                )
-            except Exception as learn_err:
-                logger.warning(f"⚠️ Context learning failed (likely rate limited): {learn_err}")
-                learned_context = None
+    async def _generate_reply(self, turn: Dict[str, Any], user_token: Optional[str]) -> str:
+        """Generate the full reply via the configured provider."""
+        self._check_provider_can_serve(turn)
+        message = turn["message"]
+        history_text = turn["history_text"]
+        system_prompt = turn["system_prompt"]
 
-            logger.info(f"✅ Generated chat response using {self.provider}")
-            if learned_context:
-                logger.debug(f"✅ Learned new context")
+        if self.provider == "anthropic":
+            # Claude reads images and PDFs natively, so attachments go through as
+            # real content blocks rather than being rejected like the text-only
+            # OpenAI-compatible providers below.
+            from .anthropic_client import generate as anthropic_generate
+
+            user_prompt = f"{history_text}\n\nUser: {message}\nAura Assist:"
+            return await anthropic_generate(
+                api_key=self.api_key,
+                prompt=user_prompt,
+                system_prompt=system_prompt,
+                model=self.model_name,
+                files=turn["files"],
+                cacheable_chars=turn["cacheable_chars"],
+            )
 
-            return {
-                "message": response_text,
-                "contextUsed": True,
-                "learnedContext": learned_context
-            }
+        if self.provider in ("groq", "openai"):
+            # Groq and OpenAI share the OpenAI-compatible chat API. We flatten the
+            # prompt (it already includes any appended document text).
+            full_prompt = f"{system_prompt}\n\n{history_text}\n\nUser: {message}\nAura Assist:"
+            return await self._generate_via_openai_compatible(full_prompt)
+
+        # No cross-provider/platform-key failover: the company's own key is the
+        # only key used. If it hits a rate limit, the error surfaces so the client
+        # sees a clear "quota exceeded, contact your administrator" message.
+        return await self._generate_via_rest(
+            message=message,
+            system_prompt=system_prompt,
+            history_text=history_text,
+            prepared=turn["attachments"],
+            user_token=user_token,
+            cacheable_chars=turn["cacheable_chars"],
+        )
+
+    async def _stream_reply(self, turn: Dict[str, Any], user_token: Optional[str]) -> AsyncIterator[str]:
+        """Stream the reply via the configured provider, one text chunk at a time."""
+        self._check_provider_can_serve(turn)
+        message = turn["message"]
+        history_text = turn["history_text"]
+        system_prompt = turn["system_prompt"]
 
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"Error processing chat message: {error_msg}")
-            
-            # Surface the actual error message to the user/frontend for debugging
-            detailed_msg = f"I encountered an error: {error_msg}"
-            if "quota exhausted" in error_msg.lower() or "429" in error_msg:
-                detailed_msg = "⏳ AI quota exceeded. All available API keys have reached their rate limit. The system will automatically retry with a new key if one is available. If this persists, please ask your administrator to add an additional API key in the company settings."
-            elif "API key was reported as leaked" in error_msg:
-                detailed_msg = "Your AI API key has been revoked by the provider. Please update your company settings with a new key."
-            
-            return {
-                "message": detailed_msg,
-                "contextUsed": False,
-                "learnedContext": None
-            }
+        if self.provider == "anthropic":
+            from .anthropic_client import stream as anthropic_stream
+
+            user_prompt = f"{history_text}\n\nUser: {message}\nAura Assist:"
+            async for chunk in anthropic_stream(
+                api_key=self.api_key,
+                prompt=user_prompt,
+                system_prompt=system_prompt,
+                model=self.model_name,
+                files=turn["files"],
+                cacheable_chars=turn["cacheable_chars"],
+            ):
+                yield chunk
+            return
+
+        if self.provider in ("groq", "openai"):
+            full_prompt = f"{system_prompt}\n\n{history_text}\n\nUser: {message}\nAura Assist:"
+            async for chunk in self._stream_via_openai_compatible(full_prompt):
+                yield chunk
+            return
+
+        async for chunk in self._stream_via_rest(
+            message=message,
+            system_prompt=system_prompt,
+            history_text=history_text,
+            prepared=turn["attachments"],
+            user_token=user_token,
+            cacheable_chars=turn["cacheable_chars"],
+        ):
+            yield chunk
+
+    async def _learn_from_turn(
+        self, turn: Dict[str, Any], callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Use AI to intelligently extract and update context. Never raises.
+
+        With CHAT_BACKGROUND_LEARNING on and a known user id, the turn is queued instead
+        and learnedContext is None; the result arrives via /learned-context or the callback.
+        """
+        user_id = turn["user"].get("id") or turn["user"].get("email")
+        if self.config.CHAT_BACKGROUND_LEARNING and user_id:
+            learning_queue.submit(
+                user_id=str(user_id),
+                message=turn["message"],
+                existing_context=turn["user_context"],
+                conversation_history=turn["conversation_history"],
+                user_info=turn["user"],
+                learning_service=self.learning_service,
+                callback_url=callback_url,
+            )
+            return {"learnedContext": None, "learningQueued": True}
+
+        learned_context = None
+        try:
+            learned_context = await self.learning_service.extract_and_update_context(
+                message=turn["message"],
+                existing_context=turn["user_context"],
+                conversation_history=turn["conversation_history"],
+                user_info=turn["user"]
+            )
+        except Exception as learn_err:
+            logger.warning(f"⚠️ Context learning failed (likely rate limited): {learn_err}")
+        return {"learnedContext": learned_context, "learningQueued": False}
+
+    def _describe_chat_error(self, error: Exception) -> str:
+        """Turn a provider failure into the message shown in the chat window."""
+        error_msg = str(error)
+        logger.error(f"Error processing chat message: {error_msg}")
+
+        # Surface the actual error message to the user/frontend for debugging
+        detailed_msg = f"I encountered an error: {error_msg}"
+        if "quota exhausted" in error_msg.lower() or "429" in error_msg:
+            detailed_msg = "⏳ AI quota exceeded. All available API keys have reached their rate limit. The system will automatically retry with a new key if one is available. If this persists, please ask your administrator to add an additional API key in the company settings."
+        elif "API key was reported as leaked" in error_msg:
+            detailed_msg = "Your AI API key has been revoked by the provider. Please update your company settings with a new key."
+        return detailed_msg
 
     async def _generate_via_openai_compatible(self, prompt: str) -> str:
         """OpenAI-compatible chat API (Groq or OpenAI) with company-key rotation on 429."""
@@ -287,15 +471,16 @@ class ChatService:
         while attempts < max_attempts:
             headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.api_key}'}
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            return data['choices'][0]['message']['content']
-                        error_text = await response.text()
-                        logger.error(f"❌ {self.provider} Chat API error ({response.status}): {error_text[:200]}")
-                        last_error = f"{self.provider} API failure ({response.status}): {error_text}"
-                        last_was_429 = response.status == 429
+                await rate_limiter.acquire(self.provider, self.api_key)
+                session = http_transport.get_session()
+                async with session.post(url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        return data['choices'][0]['message']['content']
+                    error_text = await response.text()
+                    logger.error(f"❌ {self.provider} Chat API error ({response.status}): {error_text[:200]}")
+                    last_error = f"{self.provider} API failure ({response.status}): {error_text}"
+                    last_was_429 = response.status == 429
             except Exception as e:
                 last_error = str(e)
                 last_was_429 = False
@@ -311,155 +496,150 @@ class ChatService:
             raise Exception(f"AI quota exceeded (429) on the company's {self.provider} key(s).")
         raise Exception(last_error or f"{self.provider} request failed")
 
-    async def _generate_via_rest(
-        self, 
-        message: str, 
-        system_prompt: str,
-        history_text: str,
-        files: Optional[List[Dict[str, Any]]] = None, 
-        user_token: Optional[str] = None
-    ) -> str:
-        """Make a request to Gemini API via REST with multi-modal parts"""
+    async def _stream_via_openai_compatible(self, prompt: str) -> AsyncIterator[str]:
+        """Streaming variant of _generate_via_openai_compatible.
+
+        Keys are rotated on 429 only until the first token arrives; after that a failure
+        is raised, since the client has already shown part of the reply.
+        """
+        url = f"{self.base_url}/chat/completions"
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.5,
+            "max_tokens": 2048,
+            "stream": True,
+        }
+
         attempts = 0
+        max_attempts = max(len(self.api_keys) * 2, 2)
         last_error = None
+        last_was_429 = False
+
+        while attempts < max_attempts:
+            headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.api_key}'}
+            started = False
+            try:
+                await rate_limiter.acquire(self.provider, self.api_key)
+                session = http_transport.get_session()
+                # No total timeout: a long reply is fine as long as chunks keep arriving.
+                timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+                async with session.post(url, headers=headers, json=payload, timeout=timeout) as response:
+                    if response.status == 200:
+                        async for data in _iter_sse_data(response):
+                            if data == "[DONE]":
+                                break
+                            choices = json.loads(data).get("choices") or [{}]
+                            text = (choices[0].get("delta") or {}).get("content")
+                            if text:
+                                started = True
+                                yield text
+                        return
+                    error_text = await response.text()
+                    logger.error(f"❌ {self.provider} Chat API error ({response.status}): {error_text[:200]}")
+                    last_error = f"{self.provider} API failure ({response.status}): {error_text}"
+                    last_was_429 = response.status == 429
+            except Exception as e:
+                if started:
+                    raise
+                last_error = str(e)
+                last_was_429 = False
+
+            attempts += 1
+            if last_was_429 and self._rotate_api_key():
+                logger.info(f"🔄 Rotated to next {self.provider} company key after 429")
+                continue
+            break
 
-        # --- Multimodal Support: Fetch assets and binary content ---
+        if last_was_429:
+            raise Exception(f"AI quota exceeded (429) on the company's {self.provider} key(s).")
+        raise Exception(last_error or f"{self.provider} request failed")
+
+    async def _build_gemini_parts(
+        self,
+        message: str,
+        history_text: str,
+        prepared: List[Attachment],
+        user_token: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Build the multi-modal Gemini user parts: attachments first, then history and message."""
+        # --- Multimodal Support: inline binaries, add extracted text ---
         media_parts = []
         text_content_parts = []
         file_count = 0
 
-        if files:
-            # Prefer absolute URLs sent by backend; fallback to robust local/remote guessing
-            backend_base = os.getenv("BACKEND_URL", "").rstrip('/')
-            
-            for f in files:
-                url = f.get("url", "")
-                name = f.get("name", "file")
-                mime = f.get("type", "")
-
-                # --- STEP 1: PREFER EMBEDDED BASE64 (Eliminates Fetch Failures) ---
-                embedded_b64 = f.get("base64")
-                if embedded_b64:
-                    logger.info(f"🚀 MULTIMODAL: Processing embedded Base64 for {name} ({mime})")
-                    file_count += 1
-                    is_image = any(mime.startswith(t) for t in ["image/"]) or name.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".gif"))
-                    is_pdf = name.lower().endswith(".pdf") or mime == "application/pdf"
-                    
-                    if is_image:
-                        actual_mime = mime if mime else "image/jpeg"
-                        media_parts.append({
-                            "inlineData": {
-                                "mimeType": actual_mime,
-                                "data": embedded_b64
-                            }
-                        })
-                        logger.info(f"🖼️ Attached visual part via Base64: {name}")
-                    elif is_pdf:
-                        # Gemini 1.5/2.0 natively supports PDF parts!
-                        media_parts.append({
-                            "inlineData": {
-                                "mimeType": "application/pdf",
-                                "data": embedded_b64
-                            }
-                        })
-                        logger.info(f"📄 Attached binary PDF part via Base64: {name}")
-                    else:
-                        # Fallback for Word/Text docs: they are already in the text message, but we can add them here too
-                        try:
-                            import base64 as b64_lib
-                            decoded = b64_lib.b64decode(embedded_b64)
-                            if name.lower().endswith((".docx", ".doc")):
-                                # Word already handled by early extraction, adding a placeholder
-                                text_content_parts.append({"text": f"[Analyzing Document: {name}]"})
-                            else:
-                                text = decoded.decode("utf-8", errors="replace")
-                                text_content_parts.append({"text": f"[Attached File '{name}']: {text[:15000]}"})
-                                logger.info(f"📄 Attached textual doc part via Base64: {name}")
-                        except Exception as e:
-                            logger.error(f"❌ Base64 decode error for {name}: {str(e)}")
-                    continue 
-
-                # --- STEP 2: FALLBACK TO URL FETCHING ---
-                # Normalize URL for fetching
-                full_url = url
-                if not (url.startswith("http://") or url.startswith("https://")):
-                    if backend_base:
-                        url_sep = "" if url.startswith("/") else "/"
-                        full_url = f"{backend_base}{url_sep}{url}"
-                    else:
-                        full_url = f"http://localhost:3001/{url.lstrip('/')}"
-                
-                try:
-                    logger.info(f"✨ MULTIMODAL FETCH: Trying {name} from {full_url}")
-                    headers = {}
-                    if user_token:
-                        headers['Authorization'] = user_token if user_token.startswith('Bearer ') else f'Bearer {user_token}'
-
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(full_url, headers=headers, timeout=aiohttp.ClientTimeout(total=20)) as file_res:
-                            if file_res.status == 200:
-                                raw = await file_res.read()
-                                logger.info(f"✅ Downloaded {name} ({len(raw)} bytes)")
-                                file_count += 1
-                                
-                                # 1. Binary Parts (Gemini Inline Data)
-                                is_image = any(mime.startswith(t) for t in ["image/"]) or name.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".gif"))
-                                if is_image:
-                                    import base64
-                                    actual_mime = mime if mime else "image/jpeg"
-                                    b64 = base64.b64encode(raw).decode("utf-8")
-                                    media_parts.append({
-                                        "inlineData": {
-                                            "mimeType": actual_mime,
-                                            "data": b64
-                                        }
-                                    })
-                                    logger.info(f"🖼️ Attached visual part via URL: {name}")
-                                
-                                # 2. Text Parts (Extracted content)
-                                else:
-                                    content = None
-                                    if name.lower().endswith(".pdf"):
-                                        import PyPDF2
-                                        import io
-                                        try:
-                                            reader = PyPDF2.PdfReader(io.BytesIO(raw))
-                                            pdf_text = ""
-                                            for page in reader.pages:
-                                                text_extract = page.extract_text()
-                                                if text_extract:
-                                                    pdf_text += text_extract + "\n"
-                                            content = f"[Attached PDF '{name}']:\n{pdf_text[:25000]}"
-                                            logger.info(f"📄 Extracted {len(pdf_text)} chars from downloaded PDF: {name}")
-                                        except Exception as e:
-                                            content = f"[Error reading PDF '{name}': {str(e)}]"
-                                            logger.error(f"❌ PyPDF2 error for URL fetch {name}: {str(e)}")
-                                    elif name.lower().endswith((".docx", ".doc")):
-                                        try:
-                                            from docx import Document
-                                            import io
-                                            doc = Document(io.BytesIO(raw))
-                                            text = "\n".join([para.text for para in doc.paragraphs])
-                                            content = f"[Attached Word Document '{name}']:\n{text[:25000]}"
-                                        except Exception as e:
-                                            content = f"[Error reading Word Doc '{name}': {str(e)}]"
-                                    else:
-                                        # Plain text, CSV, JSON, MD, etc.
-                                        try:
-                                            text = raw.decode("utf-8", errors="replace")
-                                            content = f"[Attached File '{name}']:\n{text[:15000]}"
-                                        except:
-                                            content = f"[Attached Binary File '{name}' - Length: {len(raw)} bytes]"
-                                    
-                                    if content:
-                                        text_content_parts.append({"text": content})
-                                        logger.info(f"📄 Attached textual part: {name}")
-                            else:
-                                logger.error(f"❌ FETCH FAILED (Status {file_res.status}) for {full_url}")
-                                text_content_parts.append({"text": f"(System Error: Could not retrieve file '{name}' for analysis. Status {file_res.status})"})
-                except Exception as e:
-                    logger.error(f"❌ MULTIMODAL EXCEPTION ({name}): {str(e)}")
+        for attachment in prepared:
+            name = attachment.name
+
+            # --- STEP 1: PREFER EMBEDDED BASE64 (Eliminates Fetch Failures) ---
+            if attachment.source == "base64":
+                logger.info(f"🚀 MULTIMODAL: Processing embedded Base64 for {name} ({attachment.mime})")
+                file_count += 1
+                if attachment.kind == "image":
+                    media_parts.append({
+                        "inlineData": {
+                            "mimeType": attachment.mime or "image/jpeg",
+                            "data": attachment.b64
+                        }
+                    })
+                    logger.info(f"🖼️ Attached visual part via Base64: {name}")
+                elif attachment.kind == "pdf":
+                    # Gemini 1.5/2.0 natively supports PDF parts!
+                    media_parts.append({
+                        "inlineData": {
+                            "mimeType": "application/pdf",
+                            "data": attachment.b64
+                        }
+                    })
+                    logger.info(f"📄 Attached binary PDF part via Base64: {name}")
+                elif attachment.kind == "docx":
+                    # Word text is already in the message, adding a placeholder
+                    text_content_parts.append({"text": f"[Analyzing Document: {name}]"})
+                elif attachment.text is not None:
+                    text_content_parts.append({"text": f"[Attached File '{name}']: {attachment.text[:self.FETCHED_FILE_CHARS]}"})
+                    logger.info(f"📄 Attached textual doc part via Base64: {name}")
+                continue
+
+            # --- STEP 2: FALLBACK TO URL FETCHING ---
+            await attachments.fetch(attachment, user_token, max_chars=self.FETCHED_DOCUMENT_CHARS)
+            if attachment.data is None:
+                if attachment.fetch_status is not None:
+                    text_content_parts.append({"text": f"(System Error: Could not retrieve file '{name}' for analysis. Status {attachment.fetch_status})"})
+                else:
                     text_content_parts.append({"text": f"(System Error: Failed to fetch file '{name}')"})
+                continue
+
+            file_count += 1
+            content = None
+            if attachment.kind == "image":
+                # 1. Binary Parts (Gemini Inline Data)
+                media_parts.append({
+                    "inlineData": {
+                        "mimeType": attachment.mime or "image/jpeg",
+                        "data": attachment.as_base64()
+                    }
+                })
+                logger.info(f"🖼️ Attached visual part via URL: {name}")
+            # 2. Text Parts (Extracted content)
+            elif attachment.kind == "pdf":
+                if attachment.error:
+                    content = f"[Error reading PDF '{name}': {attachment.error}]"
+                else:
+                    content = f"[Attached PDF '{name}']:\n{attachment.text[:self.FETCHED_DOCUMENT_CHARS]}"
+            elif attachment.kind == "docx":
+                if attachment.error:
+                    content = f"[Error reading Word Doc '{name}': {attachment.error}]"
+                else:
+                    content = f"[Attached Word Document '{name}']:\n{attachment.text[:self.FETCHED_DOCUMENT_CHARS]}"
+            else:
+                # Plain text, CSV, JSON, MD, etc.
+                content = f"[Attached File '{name}']:\n{(attachment.text or '')[:self.FETCHED_FILE_CHARS]}"
+
+            if content:
+                if attachment.truncated:
+                    content = f"{content.rstrip()}\n{self._truncation_note(attachment)}"
+                text_content_parts.append({"text": content})
+                logger.info(f"📄 Attached textual part: {name}")
 
         # Final Prompt Construction: ATTACHMENTS FIRST, THEN RECENT HISTORY, THEN MESSAGE
         # This reordering is proven more effective for Gemini 1.5 context prioritization
@@ -483,63 +663,124 @@ class ChatService:
         if file_count > 0:
             parts.append({"text": f"\n[SYSTEM NOTICE: Task-specific analysis mode is ACTIVE for the {file_count} file(s) above. If the user asks about these files, ignore generic company knowledge and focus on the file content.]"})
 
+        return parts
+
+    @staticmethod
+    def _gemini_payload(system_prompt: str, parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "systemInstruction": {
+                "parts": [{"text": system_prompt}]
+            },
+            "contents": [
+                {
+                    "role": "user",
+                    "parts": parts
+                }
+            ],
+            "generationConfig": {
+                "temperature": 0.2, # Slightly lower for more reliable file analysis
+                "maxOutputTokens": 4096,
+                "topP": 0.9,
+            }
+        }
+
+    async def _gemini_cached_payload(
+        self, system_prompt: str, cacheable_chars: int, parts: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """The request payload, naming a cached copy of the system prompt prefix if there is one.
+
+        A request that names cached content may not carry a system instruction, so the
+        rest of the system prompt leads the user turn instead.
+        """
+        payload = self._gemini_payload(system_prompt, parts)
+        prefix, rest = split_prefix(system_prompt, cacheable_chars)
+        cached = await prompt_cache.gemini_cached_content(self.base_url, self.api_key, self.model_name, prefix)
+        if cached:
+            del payload["systemInstruction"]
+            payload["cachedContent"] = cached
+            if rest.strip():
+                payload["contents"][0]["parts"] = [{"text": rest}] + parts
+        return payload
+
+    @staticmethod
+    def _cached_content_gone(payload: Dict[str, Any], status: int, error_text: str) -> bool:
+        """True if a request failed because the cached content it named has expired or been deleted."""
+        if not payload.get("cachedContent"):
+            return False
+        if status == 404 or (status in (400, 403) and "cache" in (error_text or "").lower()):
+            prompt_cache.invalidate_gemini(payload["cachedContent"])
+            return True
+        return False
+
+    async def _generate_via_rest(
+        self, 
+        message: str, 
+        system_prompt: str,
+        history_text: str,
+        prepared: List[Attachment],
+        user_token: Optional[str] = None,
+        cacheable_chars: int = 0
+    ) -> str:
+        """Make a request to Gemini API via REST with multi-modal parts"""
+        attempts = 0
+        last_error = None
+
+        parts = await self._build_gemini_parts(message, history_text, prepared, user_token)
+        payload = None
+        payload_key = None
+
         max_attempts = max(len(self.api_keys) * 2, 4)  # Allow multiple passes through key pool
         last_was_429 = False
 
         while attempts < max_attempts:
             current_key = self.api_key
             url = f"{self.base_url}/models/{self.model_name}:generateContent"
-            
-            payload = {
-                "systemInstruction": {
-                    "parts": [{"text": system_prompt}]
-                },
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": parts
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.2, # Slightly lower for more reliable file analysis
-                    "maxOutputTokens": 4096,
-                    "topP": 0.9,
-                }
-            }
+            if payload_key != current_key:
+                # Cached content belongs to the key that created it; after a rotation
+                # look up (or create) the new key's copy instead of naming the old one
+                payload = await self._gemini_cached_payload(system_prompt, cacheable_chars, parts)
+                payload_key = current_key
 
             got_429 = False
             api_error = None
 
             try:
                 auth_url = f"{url}?key={current_key}"
-                async with aiohttp.ClientSession() as session:
-                    headers = {'Content-Type': 'application/json'}
-                    async with session.post(auth_url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=50)) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if data.get('candidates'):
-                                candidate = data['candidates'][0]
-                                if candidate.get('content'):
-                                    return candidate['content']['parts'][0]['text']
-                                elif candidate.get('finishReason'):
-                                    return f"⚠️ Google Gemini chose not to respond due to Safety/Policy settings (Finish Reason: {candidate['finishReason']})"
+                await rate_limiter.acquire(self.provider, current_key)
+                session = http_transport.get_session()
+                headers = {'Content-Type': 'application/json'}
+                async with session.post(auth_url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=50)) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        prompt_cache.record_gemini_usage(data.get('usageMetadata'))
+                        if data.get('candidates'):
+                            candidate = data['candidates'][0]
+                            if candidate.get('content'):
+                                return candidate['content']['parts'][0]['text']
+                            elif candidate.get('finishReason'):
+                                return f"⚠️ Google Gemini chose not to respond due to Safety/Policy settings (Finish Reason: {candidate['finishReason']})"
+                    
+                    # Handle errors
+                    try:
+                        error_text = await response.text()
+                    except Exception:
+                        error_text = "Unknown Error"
                         
-                        # Handle errors
-                        try:
-                            error_text = await response.text()
-                        except Exception:
-                            error_text = "Unknown Error"
-                            
-                        if response.status == 429:
-                            logger.warning(f"⚠️ Rate limited (429) on key index {self.current_key_index} (attempt {attempts+1}/{max_attempts}). Google said: {error_text[:400]}")
-                            last_error = error_text or "429"
-                            got_429 = True
-                            last_was_429 = True
-                        else:
-                            logger.warning(f"API error ({response.status}): {error_text[:200]}")
-                            last_error = error_text
-                            api_error = error_text
-                            last_was_429 = False
+                    if self._cached_content_gone(payload, response.status, error_text):
+                        # Resend with the whole system prompt; this does not count as an attempt
+                        payload = self._gemini_payload(system_prompt, parts)
+                        continue
+
+                    if response.status == 429:
+                        logger.warning(f"⚠️ Rate limited (429) on key index {self.current_key_index} (attempt {attempts+1}/{max_attempts}). Google said: {error_text[:400]}")
+                        last_error = error_text or "429"
+                        got_429 = True
+                        last_was_429 = True
+                    else:
+                        logger.warning(f"API error ({response.status}): {error_text[:200]}")
+                        last_error = error_text
+                        api_error = error_text
+                        last_was_429 = False
 
             except Exception as e:
                 last_error = str(e)
@@ -572,6 +813,112 @@ class ChatService:
         raise Exception(f"AI request to Gemini failed after {attempts} attempt(s): {last_error}")
 
 
+    async def _stream_via_rest(
+        self,
+        message: str,
+        system_prompt: str,
+        history_text: str,
+        prepared: List[Attachment],
+        user_token: Optional[str] = None,
+        cacheable_chars: int = 0
+    ) -> AsyncIterator[str]:
+        """Streaming variant of _generate_via_rest using Gemini's streamGenerateContent SSE.
+
+        Retries and key rotation follow _generate_via_rest, but only until the first
+        token has been yielded.
+        """
+        attempts = 0
+        last_error = None
+
+        parts = await self._build_gemini_parts(message, history_text, prepared, user_token)
+        payload = None
+        payload_key = None
+
+        max_attempts = max(len(self.api_keys) * 2, 4)
+        last_was_429 = False
+
+        while attempts < max_attempts:
+            current_key = self.api_key
+            url = f"{self.base_url}/models/{self.model_name}:streamGenerateContent"
+            if payload_key != current_key:
+                # Cached content belongs to the key that created it; after a rotation
+                # look up (or create) the new key's copy instead of naming the old one
+                payload = await self._gemini_cached_payload(system_prompt, cacheable_chars, parts)
+                payload_key = current_key
+
+            got_429 = False
+            api_error = None
+            started = False
+
+            try:
+                auth_url = f"{url}?alt=sse&key={current_key}"
+                await rate_limiter.acquire(self.provider, current_key)
+                session = http_transport.get_session()
+                headers = {'Content-Type': 'application/json'}
+                timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=50)
+                async with session.post(auth_url, headers=headers, json=payload, timeout=timeout) as response:
+                    if response.status == 200:
+                        finish_reason = None
+                        usage = None
+                        async for data in _iter_sse_data(response):
+                            chunk = json.loads(data)
+                            usage = chunk.get('usageMetadata') or usage
+                            for candidate in chunk.get('candidates') or []:
+                                finish_reason = candidate.get('finishReason') or finish_reason
+                                for part in (candidate.get('content') or {}).get('parts') or []:
+                                    text = part.get('text')
+                                    if text:
+                                        started = True
+                                        yield text
+                        prompt_cache.record_gemini_usage(usage)
+                        if not started and finish_reason:
+                            yield f"⚠️ Google Gemini chose not to respond due to Safety/Policy settings (Finish Reason: {finish_reason})"
+                        return
+
+                    try:
+                        error_text = await response.text()
+                    except Exception:
+                        error_text = "Unknown Error"
+
+                    if self._cached_content_gone(payload, response.status, error_text):
+                        # Resend with the whole system prompt; this does not count as an attempt
+                        payload = self._gemini_payload(system_prompt, parts)
+                        continue
+
+                    if response.status == 429:
+                        logger.warning(f"⚠️ Rate limited (429) on key index {self.current_key_index} (attempt {attempts+1}/{max_attempts}). Google said: {error_text[:400]}")
+                        last_error = error_text or "429"
+                        got_429 = True
+                        last_was_429 = True
+                    else:
+                        logger.warning(f"API error ({response.status}): {error_text[:200]}")
+                        last_error = error_text
+                        api_error = error_text
+                        last_was_429 = False
+
+            except Exception as e:
+                if started:
+                    raise
+                last_error = str(e)
+                logger.warning(f"Stream request exception (attempt {attempts+1}): {last_error[:200]}")
+
+            attempts += 1
+
+            if got_429:
+                if self._rotate_api_key():
+                    logger.info(f"🔄 Rotated to key index {self.current_key_index} after 429")
+                    continue
+                logger.warning(f"⏳ No more keys to rotate. Sleeping 3s before retry (attempt {attempts}/{max_attempts})...")
+                await asyncio.sleep(3)
+                continue
+            elif api_error and attempts < max_attempts:
+                self._rotate_api_key()
+                continue
+
+        if last_was_429:
+            raise Exception(f"AI quota exceeded (429) on the company's API key after {attempts} attempt(s). Google said: {str(last_error)[:400]}")
+        raise Exception(f"AI request to Gemini failed after {attempts} attempt(s): {last_error}")
+
     def _build_system_prompt(
         self,
         user: Dict[str, Any],
@@ -580,9 +927,20 @@ class ChatService:
         additional_context: Dict[str, Any],
         is_deep_analysis: bool,
         company_name: str = None,
-        has_files: bool = False
-    ) -> str:
-        """Build the system prompt with vision identity preservation"""
+        has_files: bool = False,
+        knowledge_excerpts: Optional[List[Optional[str]]] = None
+    ) -> Tuple[str, int]:
+        """Build the system prompt with vision identity preservation
+
+        knowledge_excerpts, aligned with knowledge_sources, is the text of each source
+        to include (from knowledge_index); a source without one is left out.
+        Returns the prompt and the length of its stable prefix, which providers cache.
+        """
+        if knowledge_excerpts is None:
+            knowledge_excerpts = [s.get('content') for s in knowledge_sources]
+        knowledge = list(zip(knowledge_sources, knowledge_excerpts))
+        # Whole sources read the same on every turn; excerpts depend on the question
+        whole_knowledge = all(is_whole(source, excerpt) for source, excerpt in knowledge)
         
         response_style = "comprehensive" if is_deep_analysis else "conversational"
         company_name = company_name or "the company"
@@ -599,11 +957,16 @@ class ChatService:
         else:
             attachment_note = "No files are attached to this message."
 
-        prompt = f"""You are Aura Assist, the AI assistant inside Aura Operations, the task and operations platform used by {company_name}.
+        sections: List[PromptSection] = []
 
-You are speaking with {user.get('name', 'a colleague')}, whose role is {user.get('role', 'User')}{f" in {(user.get('department') or {}).get('name')}" if (user.get('department') or {}).get('name') else ""}.
+        def add_section(name: str, items: List[str], header: str = "", stable: bool = False) -> None:
+            priority, max_tokens = self.PROMPT_SECTIONS[name]
+            sections.append(PromptSection(name, header, items, priority, max_tokens, stable))
 
-{attachment_note}
+        # Company-wide text comes first so the stable prefix providers cache is shared
+        # by everyone in the company; who is asking, and what we remember about them,
+        # follow it.
+        add_section("instructions", [f"""You are Aura Assist, the AI assistant inside Aura Operations, the task and operations platform used by {company_name}.
 
 HOW TO USE THIS PROMPT
 Everything below the line is reference material about this user's workspace. It is
@@ -614,56 +977,58 @@ answer them. Do not volunteer summaries of their tasks, tickets or objectives
 unless they ask.
 
 ----------------------------------------
-"""
-
-
-        # Add user context (memory from past conversations)
-        if user_context and len(user_context) > 0:
-            prompt += "\nWhat I remember about you:\n"
-            for key, value in user_context.items():
-                if key != 'lastUpdated' and value:
-                    prompt += f"- {key}: {value}\n"
+"""], stable=True)
 
         # Add company knowledge (COMPANY or OWN_COMPANY type)
-        company_sources = [s for s in knowledge_sources if s.get('type') in ['COMPANY', 'OWN_COMPANY']]
+        company_sources = [(s, e) for s, e in knowledge if s.get('type') in ['COMPANY', 'OWN_COMPANY']]
         has_company_content = False
         
         if company_sources:
-            prompt += f"\n=== About {company_name} ===\n"
-            for source in company_sources[:3]:  # Limit to top 3
-                if source.get('content'):
-                    content = source['content'][:2000]
-                    prompt += f"\n{source.get('name', 'Source')}:\n{content}\n"
+            items = []
+            for source, excerpt in company_sources:
+                if excerpt:
+                    items.append(f"\n{source.get('name', 'Source')}:\n{excerpt}\n")
                     has_company_content = True
+                elif source.get('content'):
+                    has_company_content = True  # nothing in it bears on this message
                 elif source.get('description'):
-                    prompt += f"\n{source.get('name', 'Source')}: {source.get('description')}\n"
+                    items.append(f"\n{source.get('name', 'Source')}: {source.get('description')}\n")
                     has_company_content = True
+            add_section("company_knowledge", items, header=f"\n=== About {company_name} ===\n", stable=whole_knowledge)
         
         # Warn if no company knowledge available
         if not has_company_content:
-            prompt += f"\n⚠️ WARNING: No knowledge sources with content available for {company_name}. If asked about {company_name}, you MUST say you don't have information yet.\n"
+            add_section("knowledge_warning", [f"\n⚠️ WARNING: No knowledge sources with content available for {company_name}. If asked about {company_name}, you MUST say you don't have information yet.\n"], stable=True)
 
         # Add competitor knowledge with competitive analysis instructions
-        competitor_sources = [s for s in knowledge_sources if s.get('type') == 'COMPETITOR']
+        competitor_sources = [(s, e) for s, e in knowledge if s.get('type') == 'COMPETITOR']
         has_competitor_content = False
         
         if competitor_sources:
-            prompt += "\n=== COMPETITIVE INTELLIGENCE ===\n"
-            prompt += f"Use this information to help {company_name} compete effectively:\n\n"
-            
-            # Every competitor, for the same reason. A question about the third one
-            # cannot be answered from the first two however much of them is sent.
-            for source in competitor_sources:
-                if source.get('content'):
-                    content = source['content'][:4000]
-                    prompt += f"\n{source.get('name', 'Competitor')}:\n{content}\n"
+            # Every competitor is searched, since a question about the third one cannot
+            # be answered from the first two; only the relevant excerpts are sent.
+            items = []
+            for source, excerpt in competitor_sources:
+                if excerpt:
+                    items.append(f"\n{source.get('name', 'Competitor')}:\n{excerpt}\n")
+                    has_competitor_content = True
+                elif source.get('content'):
                     has_competitor_content = True
                 elif source.get('description'):
-                    prompt += f"\n{source.get('name', 'Competitor')}: {source.get('description')}\n"
+                    items.append(f"\n{source.get('name', 'Competitor')}: {source.get('description')}\n")
                     has_competitor_content = True
+            add_section(
+                "competitor_knowledge",
+                items,
+                header=(
+                    "\n=== COMPETITIVE INTELLIGENCE ===\n"
+                    f"Use this information to help {company_name} compete effectively:\n\n"
+                ),
+                stable=whole_knowledge,
+            )
             
             if has_competitor_content:
-                prompt += f"""
+                add_section("competitor_guidelines", [f"""
 COMPETITIVE STRATEGY GUIDELINES:
 - When discussing competitors, identify {company_name}'s unique advantages and differentiators
 - Suggest ways {company_name} can improve based on competitor strengths
@@ -671,21 +1036,37 @@ COMPETITIVE STRATEGY GUIDELINES:
 - Recommend strategies to position {company_name} ahead of competitors
 - Focus on value propositions that set {company_name} apart
 - Never directly attack or disparage competitors - focus on {company_name}'s strengths
-"""
+"""], stable=True)
+
+        add_section("speaker", [f"""
+=== This Conversation ===
+You are speaking with {user.get('name', 'a colleague')}, whose role is {user.get('role', 'User')}{f" in {(user.get('department') or {}).get('name')}" if (user.get('department') or {}).get('name') else ""}.
+
+{attachment_note}
+"""])
+
+        # Add user context (memory from past conversations)
+        if user_context and len(user_context) > 0:
+            add_section("user_memory", [
+                f"- {key}: {value}\n"
+                for key, value in user_context.items()
+                if key != 'lastUpdated' and value
+            ], header="\nWhat I remember about you:\n")
 
         # Add task and ticket references
         if additional_context.get('referencedTasks'):
-            prompt += "\n=== Specifically Referenced Tasks ===\n"
-            for task in additional_context['referencedTasks']:
-                prompt += f"""
+            add_section("referenced_tasks", [
+                f"""
 Task: {task['title']} (TSK-{task.get('taskNumber', 'N/A')})
 Status: {task.get('currentPhase', {}).get('name', 'Unknown')}
 Priority: {task.get('priority', 'N/A')}
 Due: {task.get('dueDate', 'No due date')}
 """
+                for task in additional_context['referencedTasks']
+            ], header="\n=== Specifically Referenced Tasks ===\n")
 
         if additional_context.get('referencedTickets'):
-            prompt += "\n=== Specifically Referenced Tickets ===\n"
+            items = []
             for ticket in additional_context['referencedTickets']:
                 requester_name = (ticket.get('requester') or {}).get('name', 'Unknown')
                 target_dept = (ticket.get('receiverDept') or {}).get('name', 'Unknown')
@@ -698,7 +1079,7 @@ Due: {task.get('dueDate', 'No due date')}
                         user_name = (comment.get('user') or {}).get('name', 'User')
                         comments_text += f"- {user_name}: {comment.get('comment', '')}\n"
 
-                prompt += f"""
+                items.append(f"""
 Ticket: {ticket.get('title', 'Untitled')} ({ticket.get('ticketNumber', 'N/A')})
 Status: {ticket.get('status', 'Unknown')}
 Priority: {ticket.get('priority', 'N/A')}
@@ -707,61 +1088,69 @@ Logistical Target: {target_dept}
 Assignee: {assignee_name}
 Description: {ticket.get('description', 'No description')}
 {comments_text}
-"""
+""")
+            add_section("referenced_tickets", items, header="\n=== Specifically Referenced Tickets ===\n")
 
         # User's Active Tickets Context
         if additional_context.get('userActiveTickets'):
-            prompt += "\n=== User's Active Tickets ===\n"
-            for t in additional_context['userActiveTickets']:
-                prompt += f"- Ticket: {t.get('title')} ({t.get('ticketNumber')}) | Status: {t.get('status')} | Priority: {t.get('priority', 'N/A')}\n"
+            add_section("active_tickets", [
+                f"- Ticket: {t.get('title')} ({t.get('ticketNumber')}) | Status: {t.get('status')} | Priority: {t.get('priority', 'N/A')}\n"
+                for t in additional_context['userActiveTickets']
+            ], header="\n=== User's Active Tickets ===\n")
         
         # Give AI the user's workload context natively
         if additional_context.get('userAnalytics'):
             analytics = additional_context['userAnalytics']
-            prompt += f"\n=== Current User Statistics ===\n"
-            prompt += f"- Total Active Tasks: {analytics.get('activeTaskCount', 0)}\n"
-            prompt += f"- Total Completed Tasks: {analytics.get('completedTaskCount', 0)}\n"
+            add_section("user_statistics", [
+                f"- Total Active Tasks: {analytics.get('activeTaskCount', 0)}\n",
+                f"- Total Completed Tasks: {analytics.get('completedTaskCount', 0)}\n",
+            ], header="\n=== Current User Statistics ===\n")
 
         if additional_context.get('userActiveTasks'):
-            prompt += "\n=== User's Active Tasks ===\n"
-            for task in additional_context['userActiveTasks']:
-                phase_name = (task.get('currentPhase') or {}).get('name', 'Unknown')
-                prompt += f"- Task: {task.get('title', 'Untitled')} | Phase: {phase_name} | Priority: {task.get('priority', 'N/A')} | Due: {task.get('dueDate', 'No due date')}\n"
+            add_section("active_tasks", [
+                f"- Task: {task.get('title', 'Untitled')} | Phase: {(task.get('currentPhase') or {}).get('name', 'Unknown')} | Priority: {task.get('priority', 'N/A')} | Due: {task.get('dueDate', 'No due date')}\n"
+                for task in additional_context['userActiveTasks']
+            ], header="\n=== User's Active Tasks ===\n")
 
         if additional_context.get('companyObjectives'):
-            prompt += "\n=== Active Company Objectives ===\n"
-            for obj in additional_context['companyObjectives']:
-                prompt += f"- Objective: {obj.get('title')} | Status: {obj.get('status')}\n"
+            add_section("objectives", [
+                f"- Objective: {obj.get('title')} | Status: {obj.get('status')}\n"
+                for obj in additional_context['companyObjectives']
+            ], header="\n=== Active Company Objectives ===\n")
 
         if additional_context.get('companyQuarters'):
-            prompt += "\n=== Active/Upcoming Quarters ===\n"
-            for q in additional_context['companyQuarters']:
-                prompt += f"- Quarter: {q.get('name')} {q.get('year')} | Status: {q.get('status')} | Period: {q.get('startDate')} to {q.get('endDate')}\n"
+            add_section("quarters", [
+                f"- Quarter: {q.get('name')} {q.get('year')} | Status: {q.get('status')} | Period: {q.get('startDate')} to {q.get('endDate')}\n"
+                for q in additional_context['companyQuarters']
+            ], header="\n=== Active/Upcoming Quarters ===\n")
 
         # Add recent Microsoft meeting transcripts
         if additional_context.get('recentMeetings'):
-            prompt += "\n=== Recent Microsoft Teams Meetings ===\n"
-            prompt += "Use these transcripts to answer questions about recent discussions or decisions.\n"
-            for meeting in additional_context['recentMeetings']:
-                prompt += f"Meeting: {meeting.get('title')} ({meeting.get('date')})\n"
-                prompt += f"Transcript (up to 4000 chars):\n{meeting.get('transcript')[:4000]}\n---\n"
+            add_section("meetings", [
+                f"Meeting: {meeting.get('title')} ({meeting.get('date')})\n"
+                f"Transcript (up to 4000 chars):\n{(meeting.get('transcript') or '')[:4000]}\n---\n"
+                for meeting in additional_context['recentMeetings']
+            ], header=(
+                "\n=== Recent Microsoft Teams Meetings ===\n"
+                "Use these transcripts to answer questions about recent discussions or decisions.\n"
+            ))
 
         # Add mentioned users
         if additional_context.get('mentionedUsers'):
-            prompt += "\n=== Mentioned Users ===\n"
-            for u in additional_context['mentionedUsers']:
-                task_count = len(u.get('assignedTasks', []))
-                prompt += f"""
+            add_section("mentioned_users", [
+                f"""
 User: {u['name']} ({u.get('role', 'Unknown')})
 Position: {u.get('position', 'Not specified')}
-Active tasks: {task_count}
+Active tasks: {len(u.get('assignedTasks', []))}
 """
+                for u in additional_context['mentionedUsers']
+            ], header="\n=== Mentioned Users ===\n")
 
         # These rules are stated once, plainly. The previous version stacked CRITICAL /
         # NEVER / ABSOLUTE PRIORITY / FOLLOW STRICTLY across five numbered sections;
         # when everything is marked critical nothing is, and the emphasis pushed the
         # model toward reciting workspace data instead of answering the question.
-        prompt += f"""
+        add_section("answer_rules", [f"""
 ----------------------------------------
 
 HOW TO ANSWER
@@ -786,9 +1175,10 @@ When you don't know, say so.
 
 Write with plain punctuation. Do not use em dashes or en dashes anywhere in your
 replies; use a comma, a colon, or a full stop instead. Use "to" for ranges.
-"""
+"""])
 
-        return prompt
+        prompt, report = assemble(sections, self.provider, self.config.CHAT_SYSTEM_PROMPT_MAX_TOKENS)
+        return prompt, report["stable_chars"]
 
     def _build_conversation_history(self, history: List[Dict[str, Any]]) -> str:
         """Build conversation history text"""
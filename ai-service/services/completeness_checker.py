@@ -1,11 +1,13 @@
 import asyncio
 import logging
 import re
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
+from .keyword_matcher import KeywordMatcher
+
 logger = logging.getLogger(__name__)
 
 class CompletenessChecker:
@@ -48,6 +50,22 @@ class CompletenessChecker:
             'deployment': ['deployed', 'released', 'live', 'production', 'published'],
             'review': ['reviewed', 'approved', 'signed off', 'validated', 'accepted']
         }
+        
+        # Phrases that show a required element is covered
+        self.element_patterns = {
+            'description': ['describe', 'detail', 'explain', 'what', 'how'],
+            'goals': ['goal', 'objective', 'target', 'aim', 'purpose'],
+            'assignee': ['assign', 'responsible', 'owner', 'developer'],
+            'timeline': ['deadline', 'due', 'schedule', 'timeline', 'date'],
+            'progress_updates': ['progress', 'update', 'status', 'completed', 'working'],
+            'deliverables': ['deliver', 'output', 'result', 'outcome', 'product'],
+            'testing': ['test', 'verify', 'validate', 'check', 'qa'],
+            'documentation': ['document', 'readme', 'guide', 'manual', 'docs']
+        }
+        
+        # Each table is matched in one pass per text (substrings, as `in` did)
+        self.completion_matcher = KeywordMatcher(self.completion_keywords, whole_words=False)
+        self.element_matcher = KeywordMatcher(self.element_patterns, whole_words=False)
     
     async def check(self, description: str, goals: str, phase: str) -> Dict[str, Any]:
         """Check task completeness against goals and phase requirements"""
@@ -122,49 +140,36 @@ class CompletenessChecker:
         # Check for required elements
         elements_found = 0
         total_elements = len(requirements['required_elements'])
+        present = self.element_matcher.present(text)
         
         for element in requirements['required_elements']:
-            if self._check_element_presence(text, element):
+            if self._check_element_presence(text, element, present):
                 elements_found += 1
         
         element_score = elements_found / total_elements if total_elements > 0 else 1.0
         
         return element_score
     
-    def _check_element_presence(self, text: str, element: str) -> bool:
-        """Check if a required element is present in the text"""
-        element_patterns = {
-            'description': ['describe', 'detail', 'explain', 'what', 'how'],
-            'goals': ['goal', 'objective', 'target', 'aim', 'purpose'],
-            'assignee': ['assign', 'responsible', 'owner', 'developer'],
-            'timeline': ['deadline', 'due', 'schedule', 'timeline', 'date'],
-            'progress_updates': ['progress', 'update', 'status', 'completed', 'working'],
-            'deliverables': ['deliver', 'output', 'result', 'outcome', 'product'],
-            'testing': ['test', 'verify', 'validate', 'check', 'qa'],
-            'documentation': ['document', 'readme', 'guide', 'manual', 'docs']
-        }
-        
-        patterns = element_patterns.get(element, [element])
-        
-        for pattern in patterns:
-            if pattern in text:
-                return True
+    def _check_element_presence(self, text: str, element: str, present: Optional[Dict[str, int]] = None) -> bool:
+        """Check if a required element is present in the text
+
+        `present` is element_matcher.present(text), when the caller checks several elements.
+        """
+        if element not in self.element_patterns:
+            return element in text
         
-        return False
+        if present is None:
+            present = self.element_matcher.present(text)
+        return present[element] > 0
     
     def _analyze_completion_indicators(self, description: str) -> Dict[str, float]:
         """Analyze indicators of task completion"""
-        text = description.lower()
+        present = self.completion_matcher.present(description)
         indicators = {}
         
         for category, keywords in self.completion_keywords.items():
-            score = 0
-            for keyword in keywords:
-                if keyword in text:
-                    score += 1
-            
             # Normalize score
-            indicators[category] = min(score / len(keywords), 1.0)
+            indicators[category] = min(present[category] / len(keywords), 1.0)
         
         return indicators
     
@@ -1,5 +1,5 @@
 import logging
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import os
 from dotenv import load_dotenv
 import asyncio
@@ -7,6 +7,14 @@ from datetime import datetime
 import aiohttp
 import json
 from config import get_config
+from . import http_transport
+from .rate_limiter import rate_limiter
+from .response_cache import response_cache
+from .knowledge_index import is_whole, knowledge_index
+from .prompt_cache import prompt_cache, split_prefix
+from .prompt_memo import content_hash, prompt_memo
+from .task_type_classifier import task_type_classifier
+from .priority_engine import priority_engine
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +22,42 @@ class ContentGeneratorError(Exception):
     """Custom exception for ContentGenerator errors"""
     pass
 
+class MissingAPIKeyError(ContentGeneratorError):
+    """A provider call was needed but the company has no API key"""
+    pass
+
 class ContentGenerator:
-    def __init__(self, api_key: Optional[str] = None, provider: str = "gemini", model: Optional[str] = None):
+    # How /generate-content produces description, goals and priority
+    GENERATION_MODES = ("sequential", "parallel", "single")
+
+    # The task types detect_task_type chooses from, with the hint the model is given
+    TASK_TYPES = {
+        'SOCIAL_MEDIA_POST': 'Social media content about products/services',
+        'VIDEO_CONTENT': 'Product demos, explainer videos, testimonials',
+        'BLOG_ARTICLE': 'Thought leadership, technical articles',
+        'EMAIL_CAMPAIGN': 'Product announcements, feature launches',
+        'CASE_STUDY': 'Customer success stories, ROI demonstrations',
+        'WEBSITE_CONTENT': 'Landing pages, product pages',
+        'WHITEPAPER': 'Technical documentation, research papers',
+        'WEBINAR': 'Live presentations, product training',
+        'INFOGRAPHIC': 'Data visualizations, process flows',
+        'PRESS_RELEASE': 'Company announcements, partnerships',
+        'GENERAL': 'Other marketing activities',
+    }
+
+    # Batch priority prompts carry at most this much of each description
+    BATCH_DESCRIPTION_CHARS = 600
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        provider: str = "gemini",
+        model: Optional[str] = None,
+        cache_namespace: Optional[str] = None,
+    ):
         self.config = get_config()
-        self.last_request_time = None
-        self.request_interval = 1.0  # Minimum time between requests in seconds
+        # Endpoints opt in to the response cache by naming themselves; None disables it.
+        self.cache_namespace = cache_namespace
         self.knowledge_sources = None  # Store knowledge sources for enhanced prompts
         self.company_name = None  # Store company name for personalized responses
         self.provided_api_key = api_key  # Store the provided API key
@@ -59,7 +98,7 @@ class ContentGenerator:
                 logger.warning("Gemini initialized WITHOUT a company key: AI calls will be rejected until a key is provided")
 
             self.current_key_index = 0  # Track which key we're using
-            self.base_url = "https://generativelanguage.googleapis.com/v1beta"
+            self.base_url = self.config.GEMINI_API_BASE_URL
             self.model = self.config.GEMINI_MODEL
             self.api_type = "gemini"
 
@@ -102,12 +141,12 @@ class ContentGenerator:
         """Get the current API key"""
         if self.api_type == "gemini":
             if not self.api_keys:
-                raise ContentGeneratorError(
+                raise MissingAPIKeyError(
                     "AI is not configured for your company. Please contact your administrator to add an AI API key."
                 )
             return self.api_keys[self.current_key_index]
         if not self.api_key:
-            raise ContentGeneratorError(
+            raise MissingAPIKeyError(
                 "AI is not configured for your company. Please contact your administrator to add an AI API key."
             )
         return self.api_key
@@ -131,8 +170,62 @@ class ContentGenerator:
         self.company_name = company_name
         logger.info(f"✅ Set company name: {company_name}")
             
-    def _get_system_prompt(self, is_social_media: bool = False) -> str:
-        """Generate a dynamic company-aware system prompt"""
+    def _active_knowledge_sources(self) -> list:
+        """Active company and competitor sources, the ones the system prompt draws on."""
+        return [
+            ks for ks in (self.knowledge_sources or [])
+            if ks.get('type') in ['COMPANY', 'OWN_COMPANY', 'COMPETITOR'] and ks.get('isActive')
+        ]
+
+    async def _knowledge_for(
+        self, query: str
+    ) -> Tuple[List[Tuple[Dict[str, Any], Optional[str]]], List[Optional[str]]]:
+        """Each active source paired with its excerpt relevant to `query` (or None),
+        and the excerpts' versions from the knowledge index."""
+        sources = self._active_knowledge_sources()
+        if not sources:
+            return [], []
+        excerpts, versions = await knowledge_index.retrieve_versioned(sources, query)
+        return list(zip(sources, excerpts)), versions
+
+    def _get_system_prompt(
+        self,
+        is_social_media: bool = False,
+        knowledge: Optional[List[Tuple[Dict[str, Any], Optional[str]]]] = None,
+        versions: Optional[List[Optional[str]]] = None,
+    ) -> Tuple[str, int]:
+        """Generate a dynamic company-aware system prompt
+
+        knowledge pairs each active source with the excerpt to include, and versions
+        identifies those excerpts (see _knowledge_for); without them, sources are
+        included from the start of their content. Returns the prompt and the length of
+        its stable prefix, which providers cache. The result is memoized on a
+        fingerprint of everything it is built from.
+        """
+        if self.knowledge_sources and knowledge is None:
+            knowledge = [(ks, (ks.get('content') or '')[:3000] or None) for ks in self._active_knowledge_sources()]
+        if versions is None:
+            versions = [content_hash(excerpt) if excerpt else None for _, excerpt in (knowledge or [])]
+        fingerprint = (
+            self.company_name,
+            [
+                (ks.get('id'), ks.get('name'), ks.get('type'), bool(ks.get('content')),
+                 ks.get('description'), version)
+                for (ks, _), version in zip(knowledge or [], versions)
+            ],
+            bool(self.knowledge_sources),
+            is_social_media,
+        )
+        return prompt_memo.get_or_build(
+            "content_system_prompt", fingerprint,
+            lambda: self._build_system_prompt(is_social_media, knowledge)
+        )
+
+    def _build_system_prompt(
+        self,
+        is_social_media: bool,
+        knowledge: Optional[List[Tuple[Dict[str, Any], Optional[str]]]]
+    ) -> Tuple[str, int]:
         # Extract company name (use provided name, or fall back to knowledge sources, or generic)
         company_name = self.company_name or "this company"
         
@@ -160,22 +253,25 @@ Section 2 (Strategy & Deliverables): Specific execution steps, deliverables, suc
 
 For social media: Include caption, hashtags, posting recommendations about {company_name}'s business.
 For technical content: Include key talking points about {company_name}'s actual offerings and services."""
+        # The rules alone are well under the providers' minimum cacheable size, so a
+        # prefix is only marked once whole knowledge sources follow them (below).
+        cacheable_chars = 0
         
         # Add knowledge sources if available
         if self.knowledge_sources:
             # Filter by COMPANY or OWN_COMPANY type
-            company_sources = [ks for ks in self.knowledge_sources if ks.get('type') in ['COMPANY', 'OWN_COMPANY'] and ks.get('isActive')]
-            competitor_sources = [ks for ks in self.knowledge_sources if ks.get('type') == 'COMPETITOR' and ks.get('isActive')]
+            company_sources = [(ks, e) for ks, e in knowledge if ks.get('type') in ['COMPANY', 'OWN_COMPANY']]
+            competitor_sources = [(ks, e) for ks, e in knowledge if ks.get('type') == 'COMPETITOR']
             
             if company_sources:
                 system_prompt += f"\n\n=== {company_name.upper()} KNOWLEDGE BASE ===\n"
                 system_prompt += f"Use the following information about {company_name} to inform your content generation:\n\n"
-                for idx, source in enumerate(company_sources, 1):
+                for idx, (source, excerpt) in enumerate(company_sources, 1):
+                    if source.get('content') and not excerpt:
+                        continue  # nothing in it bears on this request
                     system_prompt += f"\n[Source {idx}: {source.get('name', 'Unknown')}]\n"
-                    if source.get('content'):
-                        # Truncate content to avoid exceeding token limits
-                        content = source['content'][:3000] + "..." if len(source['content']) > 3000 else source['content']
-                        system_prompt += f"{content}\n"
+                    if excerpt:
+                        system_prompt += f"{excerpt}\n"
                     elif source.get('description'):
                         # Fallback to description if content scraping failed (e.g., social media URLs)
                         system_prompt += f"Description: {source['description']}\n"
@@ -184,12 +280,12 @@ For technical content: Include key talking points about {company_name}'s actual
                 system_prompt += "\n\n=== COMPETITIVE INTELLIGENCE & STRATEGY ===\n"
                 system_prompt += f"Use this competitor analysis to help {company_name} compete effectively:\n\n"
                 
-                for idx, source in enumerate(competitor_sources, 1):
+                for idx, (source, excerpt) in enumerate(competitor_sources, 1):
+                    if source.get('content') and not excerpt:
+                        continue  # nothing in it bears on this request
                     system_prompt += f"\n[Competitor {idx}: {source.get('name', 'Unknown')}]\n"
-                    if source.get('content'):
-                        # Truncate content to avoid exceeding token limits
-                        content = source['content'][:2000] + "..." if len(source['content']) > 2000 else source['content']
-                        system_prompt += f"{content}\n"
+                    if excerpt:
+                        system_prompt += f"{excerpt}\n"
                     elif source.get('description'):
                         # Fallback to description if content scraping failed (e.g., social media URLs)
                         system_prompt += f"Description: {source['description']}\n"
@@ -222,6 +318,10 @@ Use the company information available or create general professional marketing c
 - Industry expertise and leadership
 - Business outcomes and ROI
 """
+        # The knowledge is the same for every request when each source is sent whole
+        # rather than as excerpts for this task
+        if knowledge and all(is_whole(source, excerpt) for source, excerpt in knowledge):
+            cacheable_chars = len(system_prompt)
         
         # Add social media specific instructions
         if is_social_media:
@@ -240,44 +340,82 @@ Caption:
 
 Hashtags: #hashtag1 #hashtag2 #hashtag3
 """
-        return system_prompt
+        return system_prompt, cacheable_chars
+
+    SOCIAL_MEDIA_KEYWORDS = ['post', 'social media', 'instagram', 'facebook', 'linkedin', 'twitter', 'tiktok']
+
+    @classmethod
+    def _is_social_media(cls, text: str) -> bool:
+        """Whether a task (or prompt) is about a social media post."""
+        text = (text or "").lower()
+        return any(keyword in text for keyword in cls.SOCIAL_MEDIA_KEYWORDS)
+
+    async def _make_request(
+        self,
+        prompt: str,
+        json_mode: bool = False,
+        query: Optional[str] = None,
+        social_media: Optional[bool] = None,
+        parse: Optional[Callable[[str], Any]] = None,
+    ) -> Any:
+        """Make a request to the appropriate AI API.
+
+        json_mode asks the provider for a JSON object where it supports structured
+        output natively. Claude has no such switch, so there the prompt alone has
+        to ask for JSON. query (usually the task title) picks the knowledge source
+        excerpts for the system prompt; it defaults to the prompt itself.
+        social_media adds the caption instructions to the system prompt; when not
+        given it is guessed from the prompt.
+
+        parse turns the reply into the caller's result, which is returned instead of
+        the text. It rejects an unusable reply by raising or returning None, and only
+        replies it accepts are cached, so a retry is not handed the same bad answer.
+        """
+        is_social_media = self._is_social_media(prompt) if social_media is None else social_media
+        knowledge, versions = await self._knowledge_for(query or prompt)
+        system_prompt, cacheable_chars = self._get_system_prompt(is_social_media, knowledge, versions)
+
+        cache_key = None
+        if self.cache_namespace and response_cache.enabled:
+            cache_key = response_cache.make_key(self.provider, self.model, system_prompt, prompt, json_mode)
+            cached = response_cache.get(cache_key, self.cache_namespace)
+            if cached is not None:
+                logger.info(f"⚡ Response cache hit ({self.cache_namespace})")
+                return parse(cached) if parse else cached
 
-    async def _make_request(self, prompt: str) -> str:
-        """Make a request to the appropriate AI API"""
         if self.api_type == "anthropic":
-            return await self._make_anthropic_request(prompt)
-        if self.api_type in ("groq", "openai"):
-            return await self._make_openai_compatible_request(prompt)
-        return await self._make_gemini_request(prompt)
+            response = await self._make_anthropic_request(prompt, system_prompt, cacheable_chars)
+        elif self.api_type in ("groq", "openai"):
+            response = await self._make_openai_compatible_request(prompt, system_prompt, json_mode)
+        else:
+            response = await self._make_gemini_request(prompt, system_prompt, json_mode, cacheable_chars)
 
-    async def _make_anthropic_request(self, prompt: str) -> str:
+        result = parse(response) if parse else response
+        if cache_key and result is not None:
+            response_cache.set(cache_key, response)
+        return result
+
+    async def _make_anthropic_request(self, prompt: str, system_prompt: str, cacheable_chars: int = 0) -> str:
         """Make a request to Claude with the same company-specific system prompt."""
         from .anthropic_client import generate as anthropic_generate, AnthropicProviderError
 
-        social_media_keywords = ['post', 'social media', 'instagram', 'facebook', 'linkedin', 'twitter', 'tiktok']
-        is_social_media = any(keyword in prompt.lower() for keyword in social_media_keywords)
-
         try:
             return await anthropic_generate(
                 api_key=self._get_current_api_key(),
                 prompt=prompt,
-                system_prompt=self._get_system_prompt(is_social_media),
+                system_prompt=system_prompt,
                 model=self.model,
+                cacheable_chars=cacheable_chars,
             )
         except AnthropicProviderError as e:
             # Re-raise in the shape the rest of this service (and the NestJS layer)
             # already knows how to classify.
             raise ContentGeneratorError(str(e))
 
-    async def _make_openai_compatible_request(self, prompt: str) -> str:
+    async def _make_openai_compatible_request(self, prompt: str, system_prompt: str, json_mode: bool = False) -> str:
         """Make a request to an OpenAI-compatible chat API (Groq or OpenAI)."""
         url = f"{self.base_url}/chat/completions"
         
-        social_media_keywords = ['post', 'social media', 'instagram', 'facebook', 'linkedin', 'twitter', 'tiktok']
-        is_social_media = any(keyword in prompt.lower() for keyword in social_media_keywords)
-        
-        system_prompt = self._get_system_prompt(is_social_media)
-        
         payload = {
             "model": self.model,
             "messages": [
@@ -288,6 +426,8 @@ Hashtags: #hashtag1 #hashtag2 #hashtag3
             "max_tokens": 4096,
             "stream": False
         }
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
         
         headers = {
             'Content-Type': 'application/json',
@@ -295,112 +435,133 @@ Hashtags: #hashtag1 #hashtag2 #hashtag3
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data['choices'][0]['message']['content']
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ {self.provider} API error ({response.status}): {error_text}")
-                        # No fallback to env/platform keys, the company's own key is
-                        # the only key used. Surface the error to the caller.
-                        raise ContentGeneratorError(f"{self.provider} API failure ({response.status}): {error_text}")
+            await rate_limiter.acquire(self.provider, self.api_key)
+            session = http_transport.get_session()
+            async with session.post(url, headers=headers, json=payload) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data['choices'][0]['message']['content']
+                else:
+                    error_text = await response.text()
+                    logger.error(f"❌ {self.provider} API error ({response.status}): {error_text}")
+                    # No fallback to env/platform keys, the company's own key is
+                    # the only key used. Surface the error to the caller.
+                    raise ContentGeneratorError(f"{self.provider} API failure ({response.status}): {error_text}")
         except Exception as e:
             if isinstance(e, ContentGeneratorError):
                 raise
             logger.error(f"❌ {self.provider} request failed: {str(e)}")
             raise ContentGeneratorError(f"{self.provider} request failed: {str(e)}")
 
-    async def _make_gemini_request(self, prompt: str) -> str:
-        """Make a request to Gemini API with dynamic company-specific system prompt"""
+    async def _make_gemini_request(
+        self, prompt: str, system_prompt: str, json_mode: bool = False, cacheable_chars: int = 0
+    ) -> str:
+        """Make a request to Gemini API with dynamic company-specific system prompt
+
+        When the stable prefix of the system prompt is cached on Gemini (see
+        prompt_cache), the request names the cached copy and sends only the rest.
+        """
         url = f"{self.base_url}/models/{self.model}:generateContent"
-        
-        # Check if this is a social media post
-        social_media_keywords = ['post', 'social media', 'instagram', 'facebook', 'linkedin', 'twitter', 'tiktok']
-        is_social_media = any(keyword in prompt.lower() for keyword in social_media_keywords)
-        
-        system_prompt = self._get_system_prompt(is_social_media)
-        
-        # Combine system prompt with user prompt
-        full_prompt = f"{system_prompt}\n\nUser Task: {prompt}"
-        
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": full_prompt
+        prefix, rest = split_prefix(system_prompt, cacheable_chars)
+
+        def build_payload(text: str) -> Dict[str, Any]:
+            payload = {
+                "contents": [{
+                    "parts": [{
+                        "text": text
+                    }]
                 }]
-            }]
-        }
+            }
+            if json_mode:
+                payload["generationConfig"] = {"responseMimeType": "application/json"}
+            return payload
         
         # Try all available API keys with automatic fallback
         last_error = None
         attempts = 0
         max_attempts = len(self.api_keys)
+        use_cache = True
         
         while attempts < max_attempts:
             current_key = self._get_current_api_key()
+            cached = None
+            if use_cache:
+                cached = await prompt_cache.gemini_cached_content(self.base_url, current_key, self.model, prefix)
+            if cached:
+                payload = build_payload(f"{rest.strip()}\n\nUser Task: {prompt}" if rest.strip() else f"User Task: {prompt}")
+                payload["cachedContent"] = cached
+            else:
+                # Combine system prompt with user prompt
+                payload = build_payload(f"{system_prompt}\n\nUser Task: {prompt}")
             headers = {
                 'Content-Type': 'application/json',
                 'X-goog-api-key': current_key
             }
             
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, json=payload) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if not data.get('candidates', []) or not data['candidates'][0].get('content'):
-                                raise ContentGeneratorError("AI returned an empty response. This is usually caused by safety filters.")
-                            
-                            # Success! Log which key worked
-                            if attempts > 0:
-                                logger.info(f"✅ Request succeeded with fallback API key (index {self.current_key_index})")
-                            
-                            return data['candidates'][0]['content']['parts'][0]['text']
+                await rate_limiter.acquire(self.provider, current_key)
+                session = http_transport.get_session()
+                async with session.post(url, headers=headers, json=payload) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        prompt_cache.record_gemini_usage(data.get('usageMetadata'))
+                        if not data.get('candidates', []) or not data['candidates'][0].get('content'):
+                            raise ContentGeneratorError("AI returned an empty response. This is usually caused by safety filters.")
+                        
+                        # Success! Log which key worked
+                        if attempts > 0:
+                            logger.info(f"✅ Request succeeded with fallback API key (index {self.current_key_index})")
+                        
+                        return data['candidates'][0]['content']['parts'][0]['text']
+                    
+                    # Handle quota/rate limit errors (429)
+                    elif response.status == 429:
+                        error_text = await response.text()
+                        logger.warning(f"⚠️ API key {self.current_key_index} quota exceeded: {error_text}")
                         
-                        # Handle quota/rate limit errors (429)
-                        elif response.status == 429:
-                            error_text = await response.text()
-                            logger.warning(f"⚠️ API key {self.current_key_index} quota exceeded: {error_text}")
-                            
+                        # Try next key if available
+                        if self._rotate_api_key():
+                            attempts += 1
+                            logger.info(f"🔄 Trying fallback API key {self.current_key_index} (attempt {attempts + 1}/{max_attempts})")
+                            continue
+                        else:
+                            last_error = f"All API keys exhausted. Quota exceeded: {error_text}"
+                            break
+                    
+                    # Handle other errors (400, 401, 403, 500 etc)
+                    else:
+                        error_text = await response.text()
+                        # Parse JSON error if possible
+                        try:
+                            error_json = json.loads(error_text)
+                            error_msg = error_json.get('error', {}).get('message', error_text)
+                        except:
+                            error_msg = error_text
+
+                        if cached and (response.status == 404 or (response.status in [400, 403] and 'cache' in error_msg.lower())):
+                            # The cached prefix expired or was deleted; resend the whole prompt
+                            prompt_cache.invalidate_gemini(cached)
+                            use_cache = False
+                            continue
+                        
+                        # CRITICAL: Detect expired or invalid keys and rotate!
+                        is_key_error = any(msg in error_msg.lower() for msg in ["api key expired", "invalid api key", "key not found", "api_key_invalid"])
+                        
+                        if (response.status in [400, 401, 403]) and is_key_error:
+                            logger.warning(f"❌ API key {self.current_key_index} is invalid or expired: {error_msg}")
                             # Try next key if available
                             if self._rotate_api_key():
                                 attempts += 1
                                 logger.info(f"🔄 Trying fallback API key {self.current_key_index} (attempt {attempts + 1}/{max_attempts})")
                                 continue
                             else:
-                                last_error = f"All API keys exhausted. Quota exceeded: {error_text}"
+                                last_error = f"All API keys are invalid or expired: {error_msg}"
                                 break
                         
-                        # Handle other errors (400, 401, 403, 500 etc)
-                        else:
-                            error_text = await response.text()
-                            # Parse JSON error if possible
-                            try:
-                                error_json = json.loads(error_text)
-                                error_msg = error_json.get('error', {}).get('message', error_text)
-                            except:
-                                error_msg = error_text
-                            
-                            # CRITICAL: Detect expired or invalid keys and rotate!
-                            is_key_error = any(msg in error_msg.lower() for msg in ["api key expired", "invalid api key", "key not found", "api_key_invalid"])
-                            
-                            if (response.status in [400, 401, 403]) and is_key_error:
-                                logger.warning(f"❌ API key {self.current_key_index} is invalid or expired: {error_msg}")
-                                # Try next key if available
-                                if self._rotate_api_key():
-                                    attempts += 1
-                                    logger.info(f"🔄 Trying fallback API key {self.current_key_index} (attempt {attempts + 1}/{max_attempts})")
-                                    continue
-                                else:
-                                    last_error = f"All API keys are invalid or expired: {error_msg}"
-                                    break
-                            
-                            logger.error(f"❌ Gemini API failure ({response.status}): {error_msg}")
-                            last_error = f"Gemini API failure ({response.status}): {error_msg}"
-                            break
-                            
+                        logger.error(f"❌ Gemini API failure ({response.status}): {error_msg}")
+                        last_error = f"Gemini API failure ({response.status}): {error_msg}"
+                        break
+                        
             except aiohttp.ClientError as e:
                 last_error = f"Connection error during AI request: {str(e)}"
                 logger.error(f"❌ {last_error}")
@@ -421,31 +582,31 @@ Hashtags: #hashtag1 #hashtag2 #hashtag3
     async def _make_legacy_request(self, prompt: str) -> str:
         """Make a request to legacy AI system"""
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {self.legacy_key}'
-                }
-                
-                payload = {
-                    'model': self.legacy_model,
-                    'prompt': prompt,
-                    'temperature': 0.7,
-                    'max_tokens': 500
-                }
-                
-                async with session.post(
-                    self.legacy_endpoint,
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Legacy API request failed: {error_text}")
-                        raise ContentGeneratorError(f"Legacy API request failed: {error_text}")
-                        
-                    data = await response.json()
-                    return data.get('text', '')
+            session = http_transport.get_session()
+            headers = {
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {self.legacy_key}'
+            }
+            
+            payload = {
+                'model': self.legacy_model,
+                'prompt': prompt,
+                'temperature': 0.7,
+                'max_tokens': 500
+            }
+            
+            async with session.post(
+                self.legacy_endpoint,
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Legacy API request failed: {error_text}")
+                    raise ContentGeneratorError(f"Legacy API request failed: {error_text}")
+                    
+                data = await response.json()
+                return data.get('text', '')
         except aiohttp.ClientError as e:
             logger.error(f"Legacy network error: {str(e)}")
             raise ContentGeneratorError(f"Legacy network error: {str(e)}")
@@ -453,19 +614,9 @@ Hashtags: #hashtag1 #hashtag2 #hashtag3
             logger.error(f"Error making legacy request: {str(e)}")
             raise ContentGeneratorError(f"Error making legacy request: {str(e)}")
 
-    async def _rate_limit(self):
-        """Implement rate limiting for API calls"""
-        if self.last_request_time:
-            elapsed = (datetime.now() - self.last_request_time).total_seconds()
-            if elapsed < self.request_interval:
-                await asyncio.sleep(self.request_interval - elapsed)
-        self.last_request_time = datetime.now()
-
     async def generate_description(self, title: str) -> str:
         """Generate a clean, concise task description - NO markdown, NO bold text"""
         try:
-            await self._rate_limit()
-            
             prompt = f"""Generate a clean, executive-level summary for this task.
 
 Task: {title}
@@ -484,22 +635,9 @@ EXAMPLE FORMAT:
 
 Respond with ONLY the plain text description, nothing else."""
 
-            description = await self._make_request(prompt)
-            
-            if not description:
-                raise ContentGeneratorError("Gemini returned empty response")
-                
-            description = description.strip()
-            
-            # Clean up any markdown and formatting
-            description = self._clean_ai_response(description)
-            description = self._remove_markdown(description)
-            
-            # Validate the response
-            if len(description.split()) < 15:
-                raise ContentGeneratorError("Generated description is too short")
-                
-            return description
+            return await self._make_request(
+                prompt, query=title, social_media=self._is_social_media(title), parse=self._finalize_description
+            )
 
         except Exception as e:
             logger.error(f"Error generating description: {str(e)}")
@@ -550,11 +688,61 @@ Respond with ONLY the plain text description, nothing else."""
         
         return text
 
+    def _finalize_description(self, description: str) -> str:
+        """Clean a raw description and reject one that is empty or too short."""
+        if not description:
+            raise ContentGeneratorError("Gemini returned empty response")
+
+        description = description.strip()
+
+        # Clean up any markdown and formatting
+        description = self._clean_ai_response(description)
+        description = self._remove_markdown(description)
+
+        # Validate the response
+        if len(description.split()) < 15:
+            raise ContentGeneratorError("Generated description is too short")
+
+        return description
+
+    def _finalize_goals(self, goals: str) -> str:
+        """Clean raw goals and reject ones that are empty or too short."""
+        if not goals:
+            raise ContentGeneratorError("Gemini returned empty response")
+
+        goals = goals.strip()
+
+        # Clean up any introductory phrases
+        goals = self._clean_ai_response(goals)
+
+        # Validate the response
+        if len(goals.split()) < 15:
+            raise ContentGeneratorError("Generated goals are too short")
+
+        return goals
+
+    @staticmethod
+    def _find_priority(response) -> Optional[int]:
+        """The first 1-5 digit in a model reply, or None."""
+        for char in str(response).strip():
+            if char.isdigit():
+                priority = int(char)
+                if 1 <= priority <= 5:
+                    return priority
+        return None
+
+    def _parse_priority(self, response) -> int:
+        """Pull a 1-5 priority out of a model reply, defaulting to medium."""
+        priority = self._find_priority(response)
+        if priority is None:
+            # Default to medium priority if parsing fails
+            logger.warning(f"Could not parse priority from response: {response}")
+            return 3
+        return priority
+
     async def generate_goals(self, title: str) -> str:
         """Generate specific goals and success criteria using Gemini"""
         try:
-            await self._rate_limit()
-            
             prompt = f"""Generate measurable goals and success criteria for this task.
 
 Task: {title}
@@ -575,21 +763,9 @@ EXAMPLE FORMAT:
 
 Respond with ONLY the bullet points, nothing else."""
 
-            goals = await self._make_request(prompt)
-            
-            if not goals:
-                raise ContentGeneratorError("Gemini returned empty response")
-                
-            goals = goals.strip()
-            
-            # Clean up any introductory phrases
-            goals = self._clean_ai_response(goals)
-            
-            # Validate the response
-            if len(goals.split()) < 15:
-                raise ContentGeneratorError("Generated goals are too short")
-                
-            return goals
+            return await self._make_request(
+                prompt, query=title, social_media=self._is_social_media(title), parse=self._finalize_goals
+            )
 
         except Exception as e:
             logger.error(f"Error generating goals: {str(e)}")
@@ -597,9 +773,22 @@ Respond with ONLY the bullet points, nothing else."""
 
     async def analyze_priority(self, title: str, description: str) -> int:
         """Analyze task priority based on title and description"""
+        priority, _ = await self.score_priority(title, description)
+        return priority
+
+    async def score_priority(self, title: str, description: str) -> Tuple[int, str]:
+        """The priority of a task and which path decided it: "rules", "model" or "llm".
+
+        The local priority engine answers first; the LLM is asked only when it is unsure.
+        """
+        local = priority_engine.decide(title, description)
+        if local:
+            logger.info(f"⚡ Priority {local.priority} from the local {local.source} ({local.confidence:.2f})")
+            return local.priority, local.source
+        return await self._ask_priority(title, description), "llm"
+
+    async def _ask_priority(self, title: str, description: str) -> int:
         try:
-            await self._rate_limit()
-            
             prompt = f"""
             Task: Analyze the priority level for this task:
             Title: {title}
@@ -622,69 +811,348 @@ Respond with ONLY the bullet points, nothing else."""
             Reply with ONLY a single number (1-5) representing the priority level.
             """
 
-            response = await self._make_request(prompt)
-            
-            # Extract number from response
-            priority_str = response.strip()
-            # Try to find a number in the response
-            for char in priority_str:
-                if char.isdigit():
-                    priority = int(char)
-                    if 1 <= priority <= 5:
-                        return priority
-            
-            # Default to medium priority if parsing fails
-            logger.warning(f"Could not parse priority from response: {response}")
-            return 3
+            priority = await self._make_request(
+                prompt,
+                query=f"{title}\n{description}",
+                social_media=self._is_social_media(title),
+                parse=self._find_priority,
+            )
+            if priority is None:
+                logger.warning(f"Could not parse priority for task: {title}")
+                return 3
+            return priority
 
         except Exception as e:
             logger.error(f"Error analyzing priority: {str(e)}")
             return 3  # Default to medium priority on error
 
+    async def generate_task_content(self, title: str, mode: str = "sequential") -> Dict[str, Any]:
+        """Generate the description, goals and priority for a new task.
+
+        sequential: three calls, one after another (the original behaviour).
+        parallel:   description and goals are requested together, and priority starts
+                    as soon as the description arrives since it is the only call that
+                    depends on another.
+        single:     one structured call returns all three fields, each put through the
+                    same validation as the separate calls. If the combined reply fails
+                    validation we fall back to parallel rather than fail the task.
+        """
+        mode = (mode or "sequential").lower()
+
+        if mode == "single":
+            try:
+                return await self._generate_task_content_single(title)
+            except ContentGeneratorError as e:
+                logger.warning(f"Single-shot generation unusable, falling back to parallel: {str(e)}")
+                mode = "parallel"
+
+        if mode == "parallel":
+            return await self._generate_task_content_parallel(title)
+
+        description = await self.generate_description(title)
+        goals = await self.generate_goals(title)
+        priority, priority_source = await self.score_priority(title, description)
+        return {"description": description, "goals": goals, "priority": priority, "priority_source": priority_source}
+
+    async def _generate_task_content_parallel(self, title: str) -> Dict[str, Any]:
+        """Run description and goals concurrently, chaining priority off the description."""
+        description_task = asyncio.create_task(self.generate_description(title))
+        goals_task = asyncio.create_task(self.generate_goals(title))
+        priority_task = None
+
+        try:
+            description = await description_task
+            priority_task = asyncio.create_task(self.score_priority(title, description))
+            goals = await goals_task
+            priority, priority_source = await priority_task
+        except BaseException:
+            # One field failed (or the request was cancelled): don't leave the other
+            # calls running against the company's quota for a result nobody reads.
+            for task in (description_task, goals_task, priority_task):
+                if task is not None and not task.done():
+                    task.cancel()
+            raise
+
+        return {"description": description, "goals": goals, "priority": priority, "priority_source": priority_source}
+
+    async def _generate_task_content_single(self, title: str) -> Dict[str, Any]:
+        """Ask for description, goals and priority in one structured call."""
+        prompt = f"""Plan this task and return its description, goals and priority together.
+
+Task: {title}
+
+"description": a clean, executive-level summary.
+- EXACTLY 2-3 sentences, plain text only
+- NO markdown, NO bold or italic text, NO bullet points or numbered lists
+- Focus on WHAT needs to be done and WHY; implementation details go in subtasks
+
+"goals": 3-4 clear, measurable objectives.
+- A JSON array of strings, one goal per item, no bullet characters
+- Each goal has a clear, measurable business outcome
+
+"priority": an integer from 1 to 5.
+5 = Critical/Urgent (immediate action required)
+4 = High (important, short timeline)
+3 = Medium (standard priority)
+2 = Low (can be scheduled flexibly)
+1 = Minimal (nice-to-have)
+Weigh urgency, impact, dependencies, complexity and strategic importance.
+
+Respond with ONLY a JSON object of this shape, nothing else:
+{{"description": "...", "goals": ["...", "..."], "priority": 3}}"""
+
+        return await self._make_request(
+            prompt,
+            json_mode=True,
+            query=title,
+            social_media=self._is_social_media(title),
+            parse=self._parse_task_content,
+        )
+
+    def _parse_task_content(self, response: str) -> Dict[str, Any]:
+        """Validate a combined reply the same way as the separate calls."""
+        data = self._parse_json_object(response)
+        if data is None:
+            raise ContentGeneratorError("Combined generation did not return a JSON object")
+
+        goals = data.get("goals")
+        if isinstance(goals, list):
+            goals = "\n".join(f"• {str(goal).strip().lstrip('•-* ').strip()}" for goal in goals if str(goal).strip())
+
+        return {
+            "description": self._finalize_description(data.get("description") or ""),
+            "goals": self._finalize_goals(goals or ""),
+            "priority": self._parse_priority(data.get("priority", "")),
+            "priority_source": "llm",
+        }
+
+    def _parse_json_object(self, response: str) -> Optional[Dict[str, Any]]:
+        """Return the first JSON object in a model reply, or None."""
+        if not response:
+            return None
+        try:
+            parsed = json.loads(response)
+        except json.JSONDecodeError:
+            # Some models wrap the object in prose or a code fence despite being told not to.
+            json_start = response.find('{')
+            json_end = response.rfind('}') + 1
+            if json_start < 0 or json_end <= json_start:
+                return None
+            try:
+                parsed = json.loads(response[json_start:json_end])
+            except json.JSONDecodeError:
+                return None
+        return parsed if isinstance(parsed, dict) else None
+
+    @staticmethod
+    def _parse_json_array(response: str) -> Optional[List[Any]]:
+        """Return the JSON array in a model reply, or None."""
+        json_start = (response or "").find('[')
+        json_end = (response or "").rfind(']') + 1
+        if json_start < 0 or json_end <= json_start:
+            return None
+        try:
+            parsed = json.loads(response[json_start:json_end])
+        except json.JSONDecodeError:
+            return None
+        return parsed if isinstance(parsed, list) else None
+
     async def detect_task_type(self, title: str) -> str:
-        """Detect task type from title using AI with company context"""
+        """Detect task type from title using AI with company context
+
+        The local classifier answers first; the LLM is asked only when it is unsure.
+        """
+        local = task_type_classifier.classify(title)
+        if local:
+            logger.info(f"⚡ Task type {local} from the local classifier")
+            return local
+
         try:
-            await self._rate_limit()
-            
+            type_list = "\n".join(f"            - {name}: {hint}" for name, hint in self.TASK_TYPES.items())
             prompt = f"""
             Analyze this task title and categorize it into ONE of these marketing task types:
             
-            - SOCIAL_MEDIA_POST: Social media content about products/services
-            - VIDEO_CONTENT: Product demos, explainer videos, testimonials
-            - BLOG_ARTICLE: Thought leadership, technical articles
-            - EMAIL_CAMPAIGN: Product announcements, feature launches
-            - CASE_STUDY: Customer success stories, ROI demonstrations
-            - WEBSITE_CONTENT: Landing pages, product pages
-            - WHITEPAPER: Technical documentation, research papers
-            - WEBINAR: Live presentations, product training
-            - INFOGRAPHIC: Data visualizations, process flows
-            - PRESS_RELEASE: Company announcements, partnerships
-            - GENERAL: Other marketing activities
+{type_list}
             
             Task Title: "{title}"
             
             Reply with ONLY the task type name (e.g., "SOCIAL_MEDIA_POST")
             """
 
-            response = await self._make_request(prompt)
-            task_type = response.strip().upper().replace(" ", "_")
+            task_type = await self._make_request(prompt, query=title, parse=self._parse_task_type)
             
-            valid_types = [
-                'SOCIAL_MEDIA_POST', 'VIDEO_CONTENT', 'BLOG_ARTICLE', 
-                'EMAIL_CAMPAIGN', 'CASE_STUDY', 'WEBSITE_CONTENT',
-                'WHITEPAPER', 'WEBINAR', 'INFOGRAPHIC', 'PRESS_RELEASE', 'GENERAL'
-            ]
-            
-            if task_type in valid_types:
+            if task_type:
                 return task_type
             
-            logger.warning(f"Unknown task type: {response}, defaulting to GENERAL")
+            logger.warning(f"Unknown task type for: {title}, defaulting to GENERAL")
             return 'GENERAL'
 
         except Exception as e:
             logger.error(f"Error detecting task type: {str(e)}")
             return 'GENERAL'
 
+    def _parse_task_type(self, value: Any) -> Optional[str]:
+        """The task type named by a model answer, or None if it is not one of TASK_TYPES."""
+        task_type = str(value or "").strip().strip('"\'').upper().replace(" ", "_")
+        return task_type if task_type in self.TASK_TYPES else None
+
+    @staticmethod
+    def _parse_priority_strict(value: Any) -> Optional[int]:
+        """A 1-5 priority from a batch answer, or None so the item is asked again."""
+        try:
+            priority = int(str(value).strip())
+        except (TypeError, ValueError):
+            return None
+        return priority if 1 <= priority <= 5 else None
+
+    async def _classify_batch(
+        self,
+        items: List[str],
+        instructions: str,
+        answer_key: str,
+        answer_hint: str,
+        parse: Callable[[Any], Optional[Any]],
+        default: Any,
+    ) -> List[Any]:
+        """Answer one short classification question for many items in few provider calls.
+
+        Items are numbered and packed up to CLASSIFY_BATCH_MAX_ITEMS per call, and the
+        model answers with a JSON list of {"id", answer_key} entries. Identical items are
+        asked once. Answers missing or rejected by `parse` are asked again, packed
+        together; whatever is still unanswered after that gets `default`.
+        """
+        unique = list(dict.fromkeys(items))
+        size = max(1, self.config.CLASSIFY_BATCH_MAX_ITEMS)
+        # Knowledge excerpts are picked for the batch as a whole
+        query = "\n".join(unique)[:2000]
+        answers: Dict[str, Any] = {}
+        pending = unique
+        calls = 0
+
+        for _ in range(2):  # the packed pass, then one re-ask for the failures
+            if not pending:
+                break
+            chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+            results = await asyncio.gather(
+                *(self._classify_chunk(chunk, instructions, answer_key, answer_hint, parse, query) for chunk in chunks),
+                return_exceptions=True,
+            )
+            calls += len(chunks)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"❌ Batch classification call failed: {result}")
+                else:
+                    answers.update(result)
+            pending = [item for item in pending if item not in answers]
+
+        if pending:
+            logger.warning(f"⚠️ {len(pending)} of {len(unique)} batch items unanswered, defaulting to {default}")
+        logger.info(f"📦 Classified {len(items)} items ({len(unique)} distinct) in {calls} provider call(s)")
+        return [answers.get(item, default) for item in items]
+
+    async def _classify_chunk(
+        self,
+        chunk: List[str],
+        instructions: str,
+        answer_key: str,
+        answer_hint: str,
+        parse: Callable[[Any], Optional[Any]],
+        query: str,
+    ) -> Dict[str, Any]:
+        """One packed call; returns the valid answers keyed by item."""
+        listing = "\n".join(f"{i}. {item}" for i, item in enumerate(chunk, 1))
+        prompt = f"""{instructions}
+
+ITEMS:
+{listing}
+
+Reply with ONLY a JSON object with one entry per item, using the item numbers as ids:
+{{"results": [{{"id": 1, "{answer_key}": {answer_hint}}}, ...]}}"""
+
+        data = await self._make_request(prompt, json_mode=True, query=query, parse=self._parse_json_object) or {}
+        answers: Dict[str, Any] = {}
+        for entry in data.get("results") or []:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                index = int(entry.get("id")) - 1
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < len(chunk):
+                value = parse(entry.get(answer_key))
+                if value is not None:
+                    answers[chunk[index]] = value
+        return answers
+
+    async def detect_task_types(self, titles: List[str]) -> List[str]:
+        """detect_task_type for many titles, packed into as few provider calls as possible.
+
+        Titles the local classifier is confident about are not sent at all, so no
+        API key is needed when it answers every title.
+        """
+        type_list = "\n".join(f"- {name}: {hint}" for name, hint in self.TASK_TYPES.items())
+        instructions = f"""Categorize each task title below into ONE of these marketing task types:
+
+{type_list}"""
+        original = titles
+        titles = [title.strip() for title in titles if title.strip()]
+        answers = dict(zip(titles, task_type_classifier.classify_many(titles)))
+        remaining = [title for title, label in answers.items() if not label]
+        if remaining:
+            self._get_current_api_key()  # raises MissingAPIKeyError before any packing
+            answers.update(zip(remaining, await self._classify_batch(
+                remaining,
+                instructions,
+                "type",
+                '"SOCIAL_MEDIA_POST"',
+                self._parse_task_type,
+                'GENERAL',
+            )))
+        return [answers.get(title.strip()) or 'GENERAL' for title in original]
+
+    async def analyze_priorities(self, tasks: List[Dict[str, str]]) -> List[int]:
+        """analyze_priority for many tasks, packed into as few provider calls as possible."""
+        return [priority for priority, _ in await self.score_priorities(tasks)]
+
+    async def score_priorities(self, tasks: List[Dict[str, str]]) -> List[Tuple[int, str]]:
+        """score_priority for many tasks. Tasks the local engine is sure of are not sent,
+        so no API key is needed when it is sure of all of them.
+
+        Each task is a dict with "title" and an optional "description"; descriptions are
+        cut to BATCH_DESCRIPTION_CHARS to keep packed prompts small.
+        """
+        local = priority_engine.decide_many(
+            [((task.get("title") or "").strip(), task.get("description") or "") for task in tasks]
+        )
+        results: List[Optional[Tuple[int, str]]] = [
+            (score.priority, score.source) if score else None for score in local
+        ]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        self._get_current_api_key()  # raises MissingAPIKeyError before any packing
+
+        instructions = """Determine the priority level (1-5) of each task below, based on urgency, impact,
+dependencies, complexity and strategic importance.
+
+Priority Scale:
+5 = Critical/Urgent (immediate action required)
+4 = High (important, short timeline)
+3 = Medium (standard priority)
+2 = Low (can be scheduled flexibly)
+1 = Minimal (nice-to-have)"""
+        items = []
+        for task in (tasks[i] for i in pending):
+            title = (task.get("title") or "").strip()
+            description = " ".join((task.get("description") or "").split())[:self.BATCH_DESCRIPTION_CHARS]
+            items.append(f"Title: {title}" + (f" | Description: {description}" if description else ""))
+        priorities = await self._classify_batch(
+            items, instructions, "priority", "3", self._parse_priority_strict, 3
+        )
+        for i, priority in zip(pending, priorities):
+            results[i] = (priority, "llm")
+        return results
+
     async def generate_subtasks(
         self, 
         title: str, 
@@ -695,8 +1163,6 @@ Respond with ONLY the bullet points, nothing else."""
     ) -> list:
         """Generate intelligent subtasks with AI using real user data"""
         try:
-            await self._rate_limit()
-            
             phases_str = ", ".join(workflow_phases) if workflow_phases else "various phases"
             
             # Format available users for AI context
@@ -749,21 +1215,11 @@ Generate 3-6 subtasks as JSON array ONLY:
 Make each description actionable and detailed. The assigned person should know exactly what to do.
 Respond with ONLY the JSON array, no other text."""
 
-            response = await self._make_request(prompt)
-            
-            try:
-                # Extract JSON from response
-                json_start = response.find('[')
-                json_end = response.rfind(']') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = response[json_start:json_end]
-                    subtasks = json.loads(json_str)
-                    return subtasks
-                else:
-                    raise ValueError("No JSON found")
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse subtasks JSON: {e}")
+            subtasks = await self._make_request(prompt, query=title, parse=self._parse_json_array)
+            if subtasks is None:
+                logger.error("Failed to parse subtasks JSON")
                 return self._generate_fallback_subtasks(title, task_type)
+            return subtasks
 
         except Exception as e:
             logger.error(f"Error generating subtasks: {str(e)}")
@@ -783,8 +1239,6 @@ Respond with ONLY the JSON array, no other text."""
         cannot name the wrong one, and it has no numbers of its own to reach for.
         """
         try:
-            await self._rate_limit()
-
             prompt = f"""
             You are Aura, and you are talking to {first_name} about their own day.
 
@@ -826,8 +1280,6 @@ Respond with ONLY the JSON array, no other text."""
         sends somebody to a ticket that is not theirs.
         """
         try:
-            await self._rate_limit()
-
             prompt = f"""
             You are Aura. Someone is about to raise this request: "{draft_title}"
 
@@ -869,8 +1321,6 @@ Respond with ONLY the JSON array, no other text."""
     async def summarize_text(self, text: str, max_length: int = 150) -> str:
         """Summarize long text into a concise summary"""
         try:
-            await self._rate_limit()
-            
             prompt = f"""
             Summarize the following text into a concise, professional summary.
             Max Length: {max_length} characters.
@@ -6,6 +6,9 @@ import json
 import re
 import aiohttp
 import asyncio
+from . import http_transport
+from .rate_limiter import rate_limiter
+from config import get_config
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +19,7 @@ class ContextLearningService:
         self.api_key = api_key
         self.model_name = model_name
         self.provider = (provider or "gemini").lower()
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta"
+        self.base_url = get_config().GEMINI_API_BASE_URL
         logger.info(f"✅ ContextLearningService initialized with {self.provider} ({model_name})")
 
     async def extract_and_update_context(
@@ -352,28 +355,29 @@ JSON Response:"""
                 if self.provider == "groq"
                 else "https://api.openai.com/v1"
             )
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{base_url}/chat/completions",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.api_key}",
-                    },
-                    json={
-                        "model": self.model_name,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.3,
-                        "max_tokens": 1024,
-                    },
-                    timeout=aiohttp.ClientTimeout(total=20),
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data["choices"][0]["message"]["content"]
-                    error_text = await response.text()
-                    raise Exception(
-                        f"{self.provider} learning API failure ({response.status}): {error_text[:200]}"
-                    )
+            await rate_limiter.acquire(self.provider, self.api_key)
+            session = http_transport.get_session()
+            async with session.post(
+                f"{base_url}/chat/completions",
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}",
+                },
+                json={
+                    "model": self.model_name,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.3,
+                    "max_tokens": 1024,
+                },
+                timeout=aiohttp.ClientTimeout(total=20),
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data["choices"][0]["message"]["content"]
+                error_text = await response.text()
+                raise Exception(
+                    f"{self.provider} learning API failure ({response.status}): {error_text[:200]}"
+                )
 
         payload = {
             "contents": [{"parts": [{"text": prompt}]}]
@@ -395,44 +399,46 @@ JSON Response:"""
             
             # --- Attempt 1: Query Param ---
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url_query, headers={'Content-Type': 'application/json'}, json=payload, timeout=aiohttp.ClientTimeout(total=45)) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if data.get('candidates') and data['candidates'][0].get('content'):
-                                return data['candidates'][0]['content']['parts'][0]['text']
+                await rate_limiter.acquire(self.provider, self.api_key)
+                session = http_transport.get_session()
+                async with session.post(url_query, headers={'Content-Type': 'application/json'}, json=payload, timeout=aiohttp.ClientTimeout(total=45)) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        if data.get('candidates') and data['candidates'][0].get('content'):
+                            return data['candidates'][0]['content']['parts'][0]['text']
+                    
+                    if response.status == 429:
+                        wait_time = 2 ** (attempts + 2) # Wait a bit longer for background tasks (4s, 8s)
+                        logger.warning(f"⚠️ Learning rate limited (429). Attempt {attempts + 1}/{max_attempts}. Waiting {wait_time}s...")
+                        await asyncio.sleep(wait_time)
+                        attempts += 1
+                        continue # Retry the loop
                         
-                        if response.status == 429:
-                            wait_time = 2 ** (attempts + 2) # Wait a bit longer for background tasks (4s, 8s)
-                            logger.warning(f"⚠️ Learning rate limited (429). Attempt {attempts + 1}/{max_attempts}. Waiting {wait_time}s...")
-                            await asyncio.sleep(wait_time)
-                            attempts += 1
-                            continue # Retry the loop
-                            
-                        # Fallback to header if not 429
+                    # Fallback to header if not 429
             except Exception as e:
                 if "Learning rate limited" in str(e): raise e
                 logger.debug(f"Query param learning attempt failed: {str(e)}")
 
             # --- Attempt 2: Header Auth ---
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url_header, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=45)) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if data.get('candidates') and data['candidates'][0].get('content'):
-                                return data['candidates'][0]['content']['parts'][0]['text']
-                        
-                        if response.status == 429:
-                                wait_time = 2 ** (attempts + 2)
-                                logger.warning(f"⚠️ Learning rate limited (429, Header). Attempt {attempts + 1}/{max_attempts}. Waiting {wait_time}s...")
-                                await asyncio.sleep(wait_time)
-                                attempts += 1
-                                continue # Retry the loop
-                                
-                        error_text = await response.text()
-                        last_error = f"Gemini API failure in learning ({response.status}): {error_text[:200]}"
-                        logger.error(f"❌ {last_error}")
+                await rate_limiter.acquire(self.provider, self.api_key)
+                session = http_transport.get_session()
+                async with session.post(url_header, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=45)) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        if data.get('candidates') and data['candidates'][0].get('content'):
+                            return data['candidates'][0]['content']['parts'][0]['text']
+                    
+                    if response.status == 429:
+                            wait_time = 2 ** (attempts + 2)
+                            logger.warning(f"⚠️ Learning rate limited (429, Header). Attempt {attempts + 1}/{max_attempts}. Waiting {wait_time}s...")
+                            await asyncio.sleep(wait_time)
+                            attempts += 1
+                            continue # Retry the loop
+                            
+                    error_text = await response.text()
+                    last_error = f"Gemini API failure in learning ({response.status}): {error_text[:200]}"
+                    logger.error(f"❌ {last_error}")
             except Exception as e:
                 logger.error(f"❌ Header auth failed for AI learning: {str(e)}")
                 last_error = str(e)
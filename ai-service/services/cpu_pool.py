@@ -0,0 +1,130 @@
+"""Process pools for CPU-bound work: document parsing, OCR and HTML parsing.
+
+The service runs a single worker, so a PyPDF2 pass over a large upload run on the
+event loop used to stall chat for everyone. CPU-bound calls go through a CpuPool
+instead. It is a small ProcessPoolExecutor, created on first use, with a cap on the
+number of queued jobs and a timeout per call.
+
+A job that runs past its timeout cannot be interrupted inside its process, so the pool
+is recycled: its processes are terminated and a fresh pool is started on the next
+call. Jobs that were running alongside it fail with CpuPoolError. If the caller stops
+waiting (say the client disconnected), a job that has not started yet is dropped.
+
+Functions passed to run() must be picklable, so they have to be module-level
+functions that take plain arguments.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class CpuPoolError(Exception):
+    """A pooled job could not produce a result (timeout or a crashed worker)."""
+
+
+class CpuPool:
+    def __init__(self, name: str, max_workers: int, timeout: float, max_pending: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.max_pending = max(self.max_workers, max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.max_pending)
+
+        self.submitted = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.recycles = 0
+        self.busy_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # forkserver children start from a clean process rather than a copy of this
+            # one with its event loop, sockets and threads.
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context(method)
+            )
+            logger.info(f"⚡ Started {self.name} process pool with {self.max_workers} worker(s)")
+        return self._executor
+
+    def _recycle(self, executor: Optional[ProcessPoolExecutor]) -> None:
+        """Kill the processes of `executor`; the next run() starts a fresh pool.
+
+        Does nothing if `executor` was already replaced: a job stranded in a recycled
+        pool must not take down the healthy pool that followed it.
+        """
+        if executor is None or executor is not self._executor:
+            return
+        self._executor = None
+        self.recycles += 1
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        logger.warning(f"🔄 Recycled {self.name} process pool")
+
+    async def run(self, fn: Callable, *args: Any, timeout: Optional[float] = None) -> Any:
+        """Run fn(*args) in the pool and return its result."""
+        timeout = timeout or self.timeout
+        async with self._slots:
+            self.submitted += 1
+            started = time.monotonic()
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._recycle(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+
+            try:
+                # Cancelling the wrapper also cancels the job if it has not started.
+                result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                if future.running():
+                    self._recycle(executor)
+                raise CpuPoolError(f"{fn.__name__} timed out after {timeout:g}s")
+            except BrokenProcessPool as e:
+                self.failures += 1
+                self._recycle(executor)
+                raise CpuPoolError(f"{fn.__name__} lost its worker process: {e}") from e
+            finally:
+                self.busy_seconds += time.monotonic() - started
+
+            self.completed += 1
+            return result
+
+    def close(self) -> None:
+        """Stop the pool. Called from the FastAPI shutdown hook."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "running": self._executor is not None,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "recycles": self.recycles,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+_config = get_config()
+cpu_pool = CpuPool("parsing", _config.CPU_POOL_WORKERS, _config.CPU_POOL_TIMEOUT, _config.CPU_POOL_MAX_PENDING)
@@ -0,0 +1,84 @@
+"""Text extraction for PDF and Word files, shared by chat attachments and TextExtractorService.
+
+extract() checks the content-addressed extraction cache before parsing, so the same
+bytes are only ever run through PyPDF2 or python-docx once. Parsing itself runs in the
+CPU process pool, which is why the parsers are plain module-level functions.
+"""
+
+import io
+import logging
+from typing import List, Optional
+
+from .cpu_pool import cpu_pool
+from .extraction_cache import ExtractedText, extraction_cache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_pdf(data: bytes, max_chars: Optional[int] = None) -> ExtractedText:
+    """Each page's text followed by a newline (blank pages add nothing), with page offsets.
+
+    Pages are read one at a time and reading stops as soon as `max_chars` is reached, so
+    a 500-page report asked for 30k characters only parses its first few pages.
+    """
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    parts: List[str] = []
+    offsets: List[int] = []
+    length = 0
+    truncated = False
+    for page_num in range(page_count):
+        if max_chars is not None and length >= max_chars:
+            truncated = True
+            break
+        offsets.append(length)
+        try:
+            page_text = reader.pages[page_num].extract_text()
+        except Exception as e:
+            logger.warning(f"Error extracting page {page_num}: {str(e)}")
+            continue
+        if page_text:
+            parts.append(page_text + "\n")
+            length += len(page_text) + 1
+
+    text = "".join(parts)
+    if max_chars is not None and len(text) > max_chars:
+        text, truncated = text[:max_chars], True
+    return ExtractedText(text=text, page_offsets=offsets, page_count=page_count, truncated=truncated)
+
+
+def parse_docx(data: bytes, max_chars: Optional[int] = None) -> ExtractedText:
+    from docx import Document
+
+    doc = Document(io.BytesIO(data))
+    text = "\n".join(para.text for para in doc.paragraphs)
+    if max_chars is not None and len(text) > max_chars:
+        return ExtractedText(text=text[:max_chars], truncated=True)
+    return ExtractedText(text=text)
+
+
+PARSERS = {
+    "pdf": parse_pdf,
+    "docx": parse_docx,
+}
+
+
+async def extract(
+    kind: str, data: bytes, max_chars: Optional[int] = None, digest: Optional[str] = None
+) -> ExtractedText:
+    """Parse `data` as `kind` ("pdf" or "docx"), or return the cached result for these bytes.
+
+    With `max_chars`, at most that much text is produced; `truncated` and
+    `pages_included` on the result say what was left out. A cached result cut to a
+    smaller budget is parsed again. Raises CpuPoolError if parsing times out.
+    """
+    digest = digest or extraction_cache.digest(data)
+    cached = extraction_cache.get(kind, digest)
+    if cached is not None and cached.covers(max_chars):
+        return cached.limited(max_chars)
+
+    result = await cpu_pool.run(PARSERS[kind], data, max_chars)
+    extraction_cache.put(kind, digest, result)
+    return result
@@ -0,0 +1,216 @@
+"""Content-addressed cache of document extraction results.
+
+Users keep the same PDF or DOCX attached for several chat turns, and every turn used to
+run PyPDF2 or python-docx over the whole file again. Results are keyed by the SHA-256
+of the decoded bytes (plus the kind of extraction), so a file is parsed once per worker
+however it arrives: as base64, as a URL download or as a file on disk.
+
+The memory tier is an LRU capped at EXTRACTION_CACHE_MAX_BYTES of text. Setting
+EXTRACTION_CACHE_DIR adds a disk tier that survives restarts and is shared by workers
+on the same host, trimmed oldest-first to EXTRACTION_CACHE_DISK_MAX_BYTES.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from cachetools import LRUCache
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExtractedText:
+    text: str
+    # Character offset in `text` where each included page starts; one entry per page.
+    page_offsets: List[int] = field(default_factory=list)
+    confidence: Optional[float] = None
+    page_count: int = 0  # pages in the whole document
+    truncated: bool = False  # extraction stopped at a character budget
+
+    def __post_init__(self):
+        self.page_count = self.page_count or len(self.page_offsets)
+
+    @property
+    def pages_included(self) -> int:
+        return len(self.page_offsets)
+
+    def pages(self) -> List[str]:
+        """Split `text` back into the per-page strings it was built from."""
+        bounds = self.page_offsets + [len(self.text)]
+        return [self.text[bounds[i]:bounds[i + 1]] for i in range(len(self.page_offsets))]
+
+    def covers(self, max_chars: Optional[int]) -> bool:
+        """True if this result holds everything an extraction with this budget would."""
+        if not self.truncated:
+            return True
+        return max_chars is not None and len(self.text) >= max_chars
+
+    def limited(self, max_chars: Optional[int]) -> "ExtractedText":
+        """This result cut to a character budget, with the page report to match."""
+        if max_chars is None or len(self.text) <= max_chars:
+            return self
+        return ExtractedText(
+            text=self.text[:max_chars],
+            page_offsets=[offset for offset in self.page_offsets if offset < max_chars],
+            confidence=self.confidence,
+            page_count=self.page_count,
+            truncated=True,
+        )
+
+
+def _sizeof(entry: ExtractedText) -> int:
+    return len(entry.text) + 8 * len(entry.page_offsets) + 64
+
+
+class ExtractionCache:
+    def __init__(self, max_bytes: int, directory: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=_sizeof)
+        # Extractions run in executor threads as well as on the event loop.
+        self._lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None  # measured on first write
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.directory, kind, digest[:2], f"{digest}.json")
+
+    def get(self, kind: str, digest: str) -> Optional[ExtractedText]:
+        key = (kind, digest)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+
+        if self.directory:
+            entry = self._read_disk(kind, digest)
+            if entry is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store_memory(key, entry)
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, kind: str, digest: str, entry: ExtractedText) -> None:
+        with self._lock:
+            self._store_memory((kind, digest), entry)
+        if self.directory:
+            self._write_disk(kind, digest, entry)
+
+    def _store_memory(self, key, entry: ExtractedText) -> None:
+        try:
+            self._memory[key] = entry
+        except ValueError:
+            # Larger than the whole memory tier; the disk tier can still hold it.
+            pass
+
+    def _read_disk(self, kind: str, digest: str) -> Optional[ExtractedText]:
+        path = self._path(kind, digest)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                entry = ExtractedText(**json.load(fh))
+            os.utime(path)  # keeps trimming least-recently-used
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Unreadable extraction cache entry {path}: {e}")
+            return None
+
+    def _write_disk(self, kind: str, digest: str, entry: ExtractedText) -> None:
+        path = self._path(kind, digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so a concurrent reader never sees half a file.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(asdict(entry), fh)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not write extraction cache entry {path}: {e}")
+            return
+
+        if self.disk_max_bytes:
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = self._measure_disk()
+                else:
+                    self._disk_bytes += size
+                over = self._disk_bytes > self.disk_max_bytes
+            if over:
+                self._trim_disk()
+
+    def _disk_files(self) -> List[str]:
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json"):
+                    files.append(os.path.join(root, name))
+        return files
+
+    def _measure_disk(self) -> int:
+        return sum(os.path.getsize(p) for p in self._disk_files() if os.path.exists(p))
+
+    def _trim_disk(self) -> None:
+        """Delete least recently used files until the tier is back under 90% of its cap."""
+        entries = []
+        for path in self._disk_files():
+            try:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "bytes": int(self._memory.currsize),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "disk_dir": self.directory,
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+_config = get_config()
+extraction_cache = ExtractionCache(
+    _config.EXTRACTION_CACHE_MAX_BYTES,
+    _config.EXTRACTION_CACHE_DIR,
+    _config.EXTRACTION_CACHE_DISK_MAX_BYTES,
+)
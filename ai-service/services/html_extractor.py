@@ -0,0 +1,181 @@
+"""Bounded HTML-to-text extraction for scraped pages.
+
+The scraper used to build a full BeautifulSoup tree with the pure-Python html.parser,
+decompose the noise elements, pick the main content area and only then cut the text
+to the character budget. On marketing sites with megabytes of inline JavaScript that
+cost hundreds of milliseconds of CPU per page.
+
+extract() feeds the page to lxml's C parser in chunks, with a parser target in place
+of a tree. Text inside noise elements (scripts, styles, navigation, forms...) is
+dropped as it streams past, and parsing stops as soon as the budget is filled.
+
+The content area is chosen as before: the first of CONTENT_SELECTORS present on the
+page, else the whole document. Parsing stops early once a <main> element is complete
+or full. Without a <main>, it stops after BODY_OVERSCAN times the budget of visible
+text.
+"""
+
+import codecs
+import re
+from typing import List, Optional, Tuple
+
+from lxml import etree
+
+NOISE_TAGS = frozenset({
+    'script', 'style', 'nav', 'header', 'footer',
+    'aside', 'iframe', 'noscript', 'svg', 'form',
+})
+
+# In order of preference, like select_one over this list
+CONTENT_SELECTORS = ('main', 'article', '[role="main"]', '.content', '#content', '.post-content')
+
+BODY_OVERSCAN = 4
+CHUNK_BYTES = 64 * 1024
+
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([A-Za-z0-9_-]+)', re.IGNORECASE)
+_SPACES = re.compile(r' +')
+
+
+def sniff_encoding(data: bytes, declared: Optional[str] = None) -> str:
+    """Charset from the Content-Type header, else a <meta> tag near the top, else UTF-8."""
+    candidates = [declared]
+    match = _META_CHARSET.search(data[:4096])
+    if match:
+        candidates.append(match.group(1).decode('ascii'))
+    for candidate in candidates:
+        if not candidate:
+            continue
+        try:
+            return codecs.lookup(candidate).name
+        except LookupError:
+            continue
+    return 'utf-8'
+
+
+def _selectors_matched(tag: str, attrib) -> List[int]:
+    classes = (attrib.get('class') or '').split()
+    checks = (
+        tag == 'main',
+        tag == 'article',
+        attrib.get('role') == 'main',
+        'content' in classes,
+        attrib.get('id') == 'content',
+        'post-content' in classes,
+    )
+    return [i for i, matched in enumerate(checks) if matched]
+
+
+class _Region:
+    """Deduplicated lines of text inside one element (or the whole document)."""
+    __slots__ = ('depth', 'lines', 'seen', 'length', 'closed')
+
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.lines: List[str] = []
+        self.seen = set()
+        self.length = 0
+        self.closed = False
+
+    def add(self, line: str, budget: int) -> None:
+        if self.length > budget or line in self.seen:
+            return
+        self.seen.add(line)
+        self.lines.append(line)
+        self.length += len(line) + 1
+
+
+class _TextTarget:
+    """lxml parser target that collects the title and visible text as the page streams in."""
+
+    def __init__(self, max_length: int):
+        self.budget = max_length
+        self.depth = 0
+        self.skip_depth: Optional[int] = None
+        self.in_title = False
+        self.title_parts: List[str] = []
+        self.title_done = False
+        self.pending: List[str] = []  # text since the last tag
+        self.document = _Region(0)
+        self.regions: List[Optional[_Region]] = [None] * len(CONTENT_SELECTORS)
+        self.done = False
+
+    def start(self, tag, attrib):
+        self._flush()
+        self.depth += 1
+        if self.skip_depth is not None or not isinstance(tag, str):
+            return
+        if tag in NOISE_TAGS:
+            self.skip_depth = self.depth
+            return
+        if tag == 'title' and not self.title_done:
+            self.in_title = True
+        for i in _selectors_matched(tag, attrib):
+            if self.regions[i] is None:
+                self.regions[i] = _Region(self.depth)
+
+    def end(self, tag):
+        self._flush()
+        if self.skip_depth == self.depth:
+            self.skip_depth = None
+        elif self.skip_depth is None:
+            if tag == 'title' and self.in_title:
+                self.in_title = False
+                self.title_done = True
+            for region in self.regions:
+                if region is not None and not region.closed and region.depth == self.depth:
+                    region.closed = True
+        self.depth -= 1
+
+        main = self.regions[0]
+        if main is not None:
+            self.done = main.closed or main.length > self.budget
+        else:
+            self.done = self.document.length > self.budget * BODY_OVERSCAN
+
+    def data(self, data):
+        if self.skip_depth is None:
+            self.pending.append(data)
+
+    def comment(self, text):
+        pass
+
+    def _flush(self) -> None:
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.pending = []
+        if self.in_title:
+            self.title_parts.append(text)
+            return
+        open_regions = [r for r in self.regions if r is not None and not r.closed]
+        for line in text.split('\n'):
+            line = _SPACES.sub(' ', line).strip()
+            if not line:
+                continue
+            self.document.add(line, self.budget * BODY_OVERSCAN)
+            for region in open_regions:
+                region.add(line, self.budget)
+
+    def close(self) -> Tuple[str, str]:
+        self._flush()
+        title = ''.join(self.title_parts).strip() or 'Untitled'
+        region = next((r for r in self.regions if r is not None), self.document)
+        return title, '\n'.join(region.lines)[:self.budget]
+
+
+def extract(data: bytes, max_length: int, encoding: Optional[str] = None) -> Tuple[str, str]:
+    """Title and cleaned main text (at most `max_length` characters) of an HTML page.
+
+    Runs in the CPU process pool, for both fast and browser scrapes.
+    """
+    target = _TextTarget(max_length)
+    parser = etree.HTMLParser(target=target, encoding=sniff_encoding(data, encoding), no_network=True)
+    for offset in range(0, len(data), CHUNK_BYTES):
+        parser.feed(data[offset:offset + CHUNK_BYTES])
+        if target.done:
+            break
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        pass  # empty or hopeless document; whatever was collected stands
+    return target.close()
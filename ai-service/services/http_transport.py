@@ -0,0 +1,70 @@
+"""Shared outbound HTTP transport for provider calls.
+
+Every Gemini/Groq/OpenAI request used to open its own aiohttp.ClientSession and close
+it again, paying DNS, TCP and TLS setup on every call. A chat turn makes two calls
+(reply plus context learning), so that cost landed twice per message.
+
+One session is now created on FastAPI startup and closed on shutdown. Its connector
+keeps per-host connection pools alive between requests and caches DNS lookups. Callers
+use it like any other session but must NOT close it:
+
+    session = http_transport.get_session()
+    async with session.post(url, json=payload) as response:
+        ...
+"""
+
+import logging
+from typing import Optional
+
+import aiohttp
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _build_session() -> aiohttp.ClientSession:
+    config = get_config()
+    connector = aiohttp.TCPConnector(
+        limit=config.HTTP_POOL_LIMIT,
+        limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=config.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+        enable_cleanup_closed=True,
+    )
+    logger.info(
+        f"🔌 HTTP transport ready (limit={config.HTTP_POOL_LIMIT}, "
+        f"per_host={config.HTTP_POOL_LIMIT_PER_HOST}, dns_ttl={config.HTTP_DNS_CACHE_TTL}s)"
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def start() -> None:
+    """Create the shared session. Called from the FastAPI startup hook."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _build_session()
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it lazily if startup has not run.
+
+    The lazy path covers scripts and one-off calls that import a service without
+    going through the app lifecycle.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = _build_session()
+    return _session
+
+
+async def close() -> None:
+    """Close the shared session and its pooled connections. Called on shutdown."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("🔌 HTTP transport closed")
+    _session = None
+
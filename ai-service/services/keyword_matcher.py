@@ -0,0 +1,74 @@
+"""One compiled pass over a text for a whole table of keyword lists.
+
+PriorityAnalyzer and CompletenessChecker scanned every text once per keyword: a
+re.findall or an `in` test for each word of each level or category. A KeywordMatcher
+compiles all the words of a table into a single alternation and reports every
+keyword occurrence from one scan.
+
+The alternation sits in a lookahead, so the scan tries every start position and
+overlapping keywords ("qa" inside "aqua") are all found. Longer keywords come first,
+and each also stands for the shorter ones it begins with, so "high priority" counts
+for "high" and "priority" as well, as the per-keyword scans did.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Hashable, Iterable, Mapping
+
+
+class KeywordMatcher:
+    def __init__(self, tables: Mapping[Hashable, Iterable[str]], whole_words: bool = True):
+        """`tables` maps a level or category to its keywords.
+
+        whole_words: match only at word boundaries (like r'\\bword\\b'); otherwise
+        anywhere in the text (like `word in text`).
+        """
+        self.tables = {key: [word.lower() for word in words] for key, words in tables.items()}
+        self.whole_words = whole_words
+
+        # keyword -> the keys listing it, once per listing
+        self._owners: Dict[str, list] = {}
+        for key, words in self.tables.items():
+            for word in words:
+                self._owners.setdefault(word, []).append(key)
+
+        keywords = sorted(self._owners, key=len, reverse=True)
+        alternation = "|".join(re.escape(word) for word in keywords)
+        if whole_words:
+            self._pattern = re.compile(rf"(?=\b({alternation})\b)")
+        else:
+            self._pattern = re.compile(f"(?=({alternation}))")
+
+        # A match of a keyword at some position is also a match of every keyword it begins with
+        self._implied: Dict[str, list] = {}
+        for word in keywords:
+            implied = [word]
+            for other in keywords:
+                if other != word and word.startswith(other):
+                    if not whole_words or re.match(re.escape(other) + r"\b", word):
+                        implied.append(other)
+            self._implied[word] = implied
+
+    def hits(self, text: str) -> Counter:
+        """How often each keyword occurs in the text."""
+        found: Counter = Counter()
+        for word in self._pattern.findall((text or "").lower()):
+            for keyword in self._implied[word]:
+                found[keyword] += 1
+        return found
+
+    def counts(self, text: str) -> Dict[Hashable, int]:
+        """Total keyword occurrences per key."""
+        result = dict.fromkeys(self.tables, 0)
+        for word, count in self.hits(text).items():
+            for key in self._owners[word]:
+                result[key] += count
+        return result
+
+    def present(self, text: str) -> Dict[Hashable, int]:
+        """Number of a key's keywords that occur at least once."""
+        result = dict.fromkeys(self.tables, 0)
+        for word in self.hits(text):
+            for key in self._owners[word]:
+                result[key] += 1
+        return result
@@ -0,0 +1,324 @@
+"""Relevant excerpts from a company's knowledge sources for one question.
+
+Chat and content generation used to paste the first few thousand characters of every
+knowledge source into every prompt, whatever was asked: tens of KB per request, and
+anything past the cut-off could never be used. Now each source is split into chunks
+of about KNOWLEDGE_CHUNK_CHARS the first time it arrives. The chunks are cached by a
+hash of the content, so a company's index is simply the chunks of its sources and is
+rebuilt only for sources that changed. Each request gets the top KNOWLEDGE_TOP_K
+chunks for its question, within KNOWLEDGE_CONTEXT_CHARS.
+
+Chunks are ranked with BM25. Setting KNOWLEDGE_EMBEDDING_MODEL to a
+sentence-transformers model ranks them by embeddings instead; it is off by default
+because it loads torch into the worker. The model loads in the background on first
+use; until it is ready, or if it cannot load, BM25 is used. When sources are small
+enough to fit the budget whole, they are passed through unchanged. Cached entries
+are sized by their text and, once computed, their embedding matrix, so
+KNOWLEDGE_INDEX_MAX_BYTES bounds both.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'\w+')
+
+# BM25 parameters
+_K1 = 1.5
+_B = 0.75
+
+
+def _terms(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def chunk_text(text: str, size: int) -> List[str]:
+    """Pack the lines of `text` into chunks of at most `size` characters.
+
+    Lines longer than a chunk are split at a space where possible.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    length = 0
+    for line in text.split('\n'):
+        line = line.strip()
+        while len(line) > size:
+            cut = line.rfind(' ', 0, size)
+            if cut < size // 2:
+                cut = size
+            head, line = line[:cut].strip(), line[cut:].strip()
+            if current:
+                chunks.append('\n'.join(current))
+                current, length = [], 0
+            chunks.append(head)
+        if not line:
+            continue
+        if current and length + len(line) + 1 > size:
+            chunks.append('\n'.join(current))
+            current, length = [], 0
+        current.append(line)
+        length += len(line) + 1
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def is_whole(source: Dict[str, Any], excerpt: Optional[str]) -> bool:
+    """True if `excerpt` is the source's entire content, as retrieve() passes small sources through."""
+    return excerpt == ((source.get('content') or '').strip() or None)
+
+
+@dataclass
+class _SourceChunks:
+    key: str
+    chunks: List[str]
+    term_counts: List[Counter]
+    embeddings: Any = None  # numpy array of normalized vectors, once computed
+    size: int = field(init=False)
+
+    def __post_init__(self):
+        self.size = sum(len(c) for c in self.chunks) * 2 + 256
+
+    def set_embeddings(self, embeddings: Any) -> None:
+        self.embeddings = embeddings
+        self.size += int(getattr(embeddings, "nbytes", 0))
+
+
+class KnowledgeIndex:
+    def __init__(
+        self,
+        context_chars: int,
+        chunk_chars: int,
+        top_k: int,
+        embedding_model: Optional[str],
+        max_bytes: int,
+    ):
+        self.context_chars = context_chars
+        self.chunk_chars = chunk_chars
+        self.top_k = top_k
+        self.embedding_model = embedding_model or None
+        self._sources: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=lambda entry: entry.size)
+
+        self._model = None
+        self._model_task: Optional[asyncio.Task] = None
+        self._model_failed = False
+        # sentence-transformers models are not safe to call from several threads at once
+        self._model_lock = threading.Lock()
+
+        self.retrievals = 0
+        self.passthrough = 0
+        self.embedding_retrievals = 0
+        self.lexical_retrievals = 0
+        self.chunks_built = 0
+
+    # --- embeddings ---------------------------------------------------------
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.embedding_model)
+
+    async def _load_model_in_background(self) -> None:
+        try:
+            self._model = await asyncio.to_thread(self._load_model)
+            logger.info(f"✅ Loaded knowledge embedding model {self.embedding_model}")
+        except Exception as e:
+            self._model_failed = True
+            logger.warning(f"⚠️ Knowledge embeddings unavailable, ranking with BM25: {e}")
+
+    def _embedder(self):
+        """The embedding model if it is ready; starts loading it on first call."""
+        if self._model is not None or self._model_failed or not self.embedding_model:
+            return self._model
+        if self._model_task is None:
+            self._model_task = asyncio.create_task(self._load_model_in_background())
+        return None
+
+    def _encode(self, model, texts: List[str]):
+        with self._model_lock:
+            return model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+
+    # --- index --------------------------------------------------------------
+
+    @staticmethod
+    def _key(content: str) -> str:
+        return hashlib.sha256(content.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def _entry(self, content: str) -> _SourceChunks:
+        key = self._key(content)
+        entry = self._sources.get(key)
+        if entry is None:
+            chunks = chunk_text(content, self.chunk_chars)
+            entry = _SourceChunks(key, chunks, [Counter(_terms(c)) for c in chunks])
+            self.chunks_built += len(chunks)
+            try:
+                self._sources[key] = entry
+            except ValueError:
+                pass  # larger than the whole cache; used for this request only
+        return entry
+
+    def _resize(self, entry: _SourceChunks) -> None:
+        """Store `entry` again so the cache accounts for its new size."""
+        if entry.key not in self._sources:
+            return
+        try:
+            self._sources[entry.key] = entry
+        except ValueError:
+            # Now larger than the whole cache; keep it for this request only
+            self._sources.pop(entry.key, None)
+
+    @staticmethod
+    def _bm25(query: str, entries: List[_SourceChunks]) -> List[List[float]]:
+        query_terms = set(_terms(query))
+        all_counts = [counts for entry in entries for counts in entry.term_counts]
+        if not query_terms or not all_counts:
+            return [[0.0] * len(entry.chunks) for entry in entries]
+        n = len(all_counts)
+        avg_len = sum(sum(c.values()) for c in all_counts) / n or 1.0
+        df = {term: sum(1 for c in all_counts if term in c) for term in query_terms}
+        idf = {term: math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5)) for term in query_terms}
+
+        scores = []
+        for entry in entries:
+            entry_scores = []
+            for counts in entry.term_counts:
+                length = sum(counts.values())
+                score = 0.0
+                for term in query_terms:
+                    tf = counts.get(term, 0)
+                    if tf:
+                        score += idf[term] * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * length / avg_len))
+                entry_scores.append(score)
+            scores.append(entry_scores)
+        return scores
+
+    async def _embedding_scores(self, model, query: str, entries: List[_SourceChunks]) -> List[List[float]]:
+        for entry in entries:
+            if entry.embeddings is None and entry.chunks:
+                entry.set_embeddings(await asyncio.to_thread(self._encode, model, entry.chunks))
+                self._resize(entry)
+        query_vector = (await asyncio.to_thread(self._encode, model, [query]))[0]
+        return [
+            [float(v) for v in entry.embeddings @ query_vector] if entry.chunks else []
+            for entry in entries
+        ]
+
+    # --- retrieval ----------------------------------------------------------
+
+    async def retrieve(
+        self, sources: List[Dict[str, Any]], query: str, max_chars: Optional[int] = None
+    ) -> List[Optional[str]]:
+        """The excerpt of each source to put in the prompt, aligned with `sources`.
+
+        None means nothing from that source was selected, or it has no content.
+        Chunks from one source keep their document order; gaps are marked with "...".
+        """
+        excerpts, _ = await self._retrieve(sources, query, max_chars, False)
+        return excerpts
+
+    async def retrieve_versioned(
+        self, sources: List[Dict[str, Any]], query: str, max_chars: Optional[int] = None
+    ) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+        """retrieve(), plus a version of each excerpt for callers that memoize on them.
+
+        A version is the hash the source's chunks are indexed by, followed by the
+        chunks selected, so equal versions mean equal excerpts without hashing the
+        excerpt text again.
+        """
+        return await self._retrieve(sources, query, max_chars, True)
+
+    async def _retrieve(
+        self, sources: List[Dict[str, Any]], query: str, max_chars: Optional[int], versioned: bool
+    ) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+        budget = max_chars or self.context_chars
+        contents = [(s.get('content') or '').strip() if isinstance(s, dict) else '' for s in sources]
+        self.retrievals += 1
+
+        if sum(len(c) for c in contents) <= budget:
+            self.passthrough += 1
+            versions = [self._key(c) if c and versioned else None for c in contents]
+            return [c or None for c in contents], versions
+
+        entries = [self._entry(c) if c else _SourceChunks('', [], []) for c in contents]
+        model = self._embedder()
+        scores = None
+        if model is not None and query.strip():
+            try:
+                scores = await self._embedding_scores(model, query, entries)
+                self.embedding_retrievals += 1
+            except Exception as e:
+                logger.warning(f"⚠️ Embedding retrieval failed, using BM25: {e}")
+        if scores is None:
+            scores = self._bm25(query, entries)
+            self.lexical_retrievals += 1
+
+        ranked: List[Tuple[float, int, int]] = sorted(
+            ((score, s, c) for s, entry_scores in enumerate(scores) for c, score in enumerate(entry_scores) if score > 0),
+            key=lambda item: -item[0],
+        )
+        if not ranked:
+            # Nothing matched the question: fall back to the start of each source.
+            ranked = [(0.0, s, 0) for s, entry in enumerate(entries) if entry.chunks]
+
+        selected: Dict[int, List[int]] = {}
+        used = 0
+        picked = 0
+        for _, s, c in ranked:
+            if picked >= self.top_k:
+                break
+            chunk = entries[s].chunks[c]
+            if used + len(chunk) > budget:
+                continue
+            selected.setdefault(s, []).append(c)
+            used += len(chunk)
+            picked += 1
+
+        excerpts: List[Optional[str]] = []
+        versions: List[Optional[str]] = []
+        for s, entry in enumerate(entries):
+            indices = sorted(selected.get(s, []))
+            if not indices:
+                excerpts.append(None)
+                versions.append(None)
+                continue
+            versions.append(f"{entry.key}:{','.join(map(str, indices))}")
+            parts = []
+            for i, c in enumerate(indices):
+                if i and c != indices[i - 1] + 1:
+                    parts.append('...')
+                parts.append(entry.chunks[c])
+            excerpts.append('\n'.join(parts))
+        return excerpts, versions
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "sources": len(self._sources),
+            "bytes": int(self._sources.currsize),
+            "chunks_built": self.chunks_built,
+            "retrievals": self.retrievals,
+            "passthrough": self.passthrough,
+            "embedding_retrievals": self.embedding_retrievals,
+            "lexical_retrievals": self.lexical_retrievals,
+            "embedding_model": self.embedding_model if self._model is not None else None,
+        }
+
+
+_config = get_config()
+knowledge_index = KnowledgeIndex(
+    _config.KNOWLEDGE_CONTEXT_CHARS,
+    _config.KNOWLEDGE_CHUNK_CHARS,
+    _config.KNOWLEDGE_TOP_K,
+    _config.KNOWLEDGE_EMBEDDING_MODEL,
+    _config.KNOWLEDGE_INDEX_MAX_BYTES,
+)
@@ -0,0 +1,171 @@
+"""Background queue for chat context learning.
+
+Learning what a user told us is a second LLM call, and on Gemini it can back off for
+several seconds. The reply does not depend on it, so chat hands the turn to this queue
+and returns as soon as the reply is ready.
+
+Messages from the same user that arrive within LEARNING_DEBOUNCE_SECONDS of each other
+are coalesced into one extraction, at most LEARNING_CONCURRENCY extractions run at
+once, and one user's extractions run in the order their messages arrived so a later
+correction always wins. Results are POSTed to the caller's callback URL when one was
+given, otherwise kept for LEARNING_RESULT_TTL seconds for GET /learned-context/{user_id}.
+Results live in this process, so with several workers the callback is the reliable route.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from cachetools import TTLCache
+
+from config import get_config
+from . import http_transport
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingLearning:
+    """Messages from one user waiting to be learned from in a single extraction."""
+
+    __slots__ = ("messages", "existing_context", "conversation_history", "user_info",
+                 "learning_service", "callback_url", "previous")
+
+    def __init__(self, learning_service, previous: Optional[asyncio.Task]):
+        self.messages: List[str] = []
+        self.existing_context: Dict[str, Any] = {}
+        self.conversation_history: List[Dict[str, Any]] = []
+        self.user_info: Dict[str, Any] = {}
+        self.learning_service = learning_service
+        self.callback_url: Optional[str] = None
+        self.previous = previous  # this user's earlier extraction, which must finish first
+
+
+class LearningQueue:
+    def __init__(self, concurrency: int, debounce_seconds: float, result_ttl: int, max_results: int = 10000):
+        self.debounce_seconds = debounce_seconds
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._pending: Dict[str, _PendingLearning] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._results: TTLCache = TTLCache(maxsize=max_results, ttl=result_ttl)
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(
+        self,
+        user_id: str,
+        message: str,
+        existing_context: Dict[str, Any],
+        conversation_history: List[Dict[str, Any]],
+        user_info: Dict[str, Any],
+        learning_service,
+        callback_url: Optional[str] = None,
+    ) -> None:
+        """Queue one chat turn for learning. Returns immediately."""
+        self.submitted += 1
+        job = self._pending.get(user_id)
+        if job is None:
+            job = _PendingLearning(learning_service, self._tasks.get(user_id))
+            self._pending[user_id] = job
+            self._tasks[user_id] = asyncio.create_task(self._run(user_id, job))
+        else:
+            self.coalesced += 1
+
+        # The newest turn carries the most recent context, history and key.
+        job.messages.append(message)
+        job.existing_context = existing_context
+        job.conversation_history = conversation_history
+        job.user_info = user_info
+        job.learning_service = learning_service
+        job.callback_url = callback_url or job.callback_url
+
+    async def _run(self, user_id: str, job: _PendingLearning) -> None:
+        try:
+            await asyncio.sleep(self.debounce_seconds)
+            if job.previous is not None:
+                await asyncio.gather(job.previous, return_exceptions=True)
+            # From here on, new messages start the next job instead of joining this one.
+            if self._pending.get(user_id) is job:
+                del self._pending[user_id]
+
+            async with self._semaphore:
+                if len(job.messages) > 1:
+                    logger.info(f"🔄 Learning from {len(job.messages)} coalesced messages for user {user_id}")
+                learned_context = await job.learning_service.extract_and_update_context(
+                    message="\n\n".join(job.messages),
+                    existing_context=job.existing_context,
+                    conversation_history=job.conversation_history,
+                    user_info=job.user_info,
+                )
+            self.completed += 1
+
+            if learned_context:
+                if not (job.callback_url and await self._deliver(job.callback_url, user_id, learned_context)):
+                    merged = dict(self._results.get(user_id) or {})
+                    merged.update(learned_context)
+                    self._results[user_id] = merged
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"⚠️ Background context learning failed for user {user_id}: {e}")
+        finally:
+            if self._pending.get(user_id) is job:
+                del self._pending[user_id]
+            if self._tasks.get(user_id) is asyncio.current_task():
+                del self._tasks[user_id]
+
+    async def _deliver(self, callback_url: str, user_id: str, learned_context: Dict[str, Any]) -> bool:
+        """POST a result to the backend. Returns False so the caller keeps it for polling."""
+        secret = os.getenv("AI_SERVICE_SECRET", "")
+        headers = {"Authorization": f"Bearer {secret}"} if secret else {}
+        try:
+            session = http_transport.get_session()
+            async with session.post(
+                callback_url,
+                json={"userId": user_id, "learnedContext": learned_context},
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=10),
+            ) as response:
+                if response.status < 300:
+                    return True
+                logger.warning(f"⚠️ Learning callback returned {response.status} for user {user_id}")
+        except Exception as e:
+            logger.warning(f"⚠️ Learning callback failed for user {user_id}: {e}")
+        return False
+
+    def is_pending(self, user_id: str) -> bool:
+        return user_id in self._tasks
+
+    def pop_result(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Hand over (and forget) what was learned for this user since the last call."""
+        return self._results.pop(user_id, None)
+
+    async def close(self) -> None:
+        """Cancel queued work. Called from the FastAPI shutdown hook."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+        self._tasks.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "pending_users": len(self._tasks),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "failed": self.failed,
+            "results_waiting": len(self._results),
+        }
+
+
+_config = get_config()
+learning_queue = LearningQueue(
+    _config.LEARNING_CONCURRENCY, _config.LEARNING_DEBOUNCE_SECONDS, _config.LEARNING_RESULT_TTL
+)
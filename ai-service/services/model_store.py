@@ -0,0 +1,90 @@
+"""Versioned joblib files for the locally trained models.
+
+Each save writes a new file named <prefix><UTC timestamp>.joblib holding the fitted
+pipeline and its metadata, so older versions stay on disk for comparison or rollback.
+Loading without a version picks the newest.
+"""
+
+import csv
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".joblib"
+
+
+def load_rows(path: str) -> List[Dict[str, Any]]:
+    """The rows of a training export: a JSON array, JSON lines, or CSV with a header."""
+    with open(path, "r", encoding="utf-8") as fh:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(fh))
+        text = fh.read()
+    if text.lstrip().startswith(("[", "{")):
+        rows = json.loads(text)
+        return rows.get("tasks") or [] if isinstance(rows, dict) else rows
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class ModelStore:
+    def __init__(self, model_dir: Optional[str], prefix: str):
+        self.model_dir = model_dir or None
+        self.prefix = prefix
+
+    def versions(self) -> List[str]:
+        if not self.model_dir or not os.path.isdir(self.model_dir):
+            return []
+        return sorted(
+            name[len(self.prefix):-len(SUFFIX)]
+            for name in os.listdir(self.model_dir)
+            if name.startswith(self.prefix) and name.endswith(SUFFIX)
+        )
+
+    def path(self, version: str) -> str:
+        return os.path.join(self.model_dir, f"{self.prefix}{version}{SUFFIX}")
+
+    def load(self, version: Optional[str] = None) -> Optional[Tuple[str, Any, Dict[str, Any]]]:
+        """(version, pipeline, meta) of the given or newest version, or None if there is none.
+
+        Warns when the model was trained with another scikit-learn release, since
+        pickled estimators are not guaranteed to behave the same across versions.
+        """
+        import joblib
+        import sklearn
+
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                return None
+            version = versions[-1]
+        bundle = joblib.load(self.path(version))
+        meta = bundle.get("meta", {})
+        trained_with = meta.get("sklearn_version")
+        if trained_with and trained_with != sklearn.__version__:
+            logger.warning(
+                f"⚠️ Model {self.prefix}{version} was trained with scikit-learn {trained_with}, "
+                f"running {sklearn.__version__}; retrain if predictions look wrong"
+            )
+        return version, bundle["pipeline"], meta
+
+    def save(self, pipeline: Any, meta: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+        """Save a fitted pipeline as a new version. Returns (version, path, meta)."""
+        import joblib
+        import sklearn
+
+        if not self.model_dir:
+            raise ValueError("No model directory configured")
+        os.makedirs(self.model_dir, exist_ok=True)
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        meta = {**meta, "version": version, "sklearn_version": sklearn.__version__}
+        # Write then rename, so a loading worker never sees half a file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.model_dir, suffix=".tmp")
+        os.close(fd)
+        joblib.dump({"pipeline": pipeline, "meta": meta}, tmp_path)
+        path = self.path(version)
+        os.replace(tmp_path, path)
+        return version, path, meta
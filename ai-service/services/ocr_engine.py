@@ -0,0 +1,171 @@
+"""OCR for uploaded images.
+
+Tesseract used to run twice per image, once with image_to_string for the text and once
+with image_to_data for confidences. This engine makes a single image_to_data pass and
+rebuilds the text from its word boxes.
+
+Before OCR the image is flattened onto white (so transparent backgrounds do not turn
+black), converted to grayscale, scaled so its longer side is within
+OCR_MAX_DIMENSION (small images are enlarged towards OCR_MIN_DIMENSION, where
+Tesseract reads better), and binarized with an Otsu threshold.
+
+Images are recognized in their own process pool of OCR_WORKERS processes (one by
+default; each holds its own Tesseract and image buffers, on top of the parsing pool),
+so OCR does not compete with document parsing. Every result carries per-stage timings.
+"""
+
+import io
+import logging
+import time
+from typing import Any, Dict, List
+
+from config import get_config
+from .cpu_pool import CpuPool
+
+logger = logging.getLogger(__name__)
+
+TESSERACT_CONFIG = '--psm 6'  # Assume uniform block of text
+
+
+def _otsu_threshold(histogram: List[int]) -> int:
+    """Grey level that best separates a 256-bin histogram into two classes."""
+    total = sum(histogram)
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+    background = 0
+    weighted_background = 0.0
+    best_level, best_variance = 127, 0.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def preprocess(image, min_dimension: int, max_dimension: int):
+    """Grayscale, normalize resolution and binarize a PIL image."""
+    from PIL import Image
+
+    # Transparent pixels are black under their alpha; put them on white paper
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    image = image.convert('L')
+
+    longest = max(image.size)
+    if longest > max_dimension:
+        scale = max_dimension / longest
+    elif longest < min_dimension:
+        scale = min(min_dimension / longest, 3.0)
+    else:
+        scale = 1.0
+    if scale != 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+
+    threshold = _otsu_threshold(image.histogram())
+    return image.point(lambda value: 255 if value > threshold else 0)
+
+
+def _text_from_data(data: Dict[str, List[Any]]) -> str:
+    """Rebuild page text from image_to_data word boxes: lines, then paragraphs, then blocks."""
+    blocks: List[List[List[str]]] = []
+    current = None
+    for i, word in enumerate(data['text']):
+        if int(data['level'][i]) != 5 or not word.strip():
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if current is None or key[0] != current[0]:
+            blocks.append([[word]])
+        elif key[1] != current[1]:
+            blocks[-1].append([word])
+        elif key[2] != current[2]:
+            blocks[-1][-1].append('\n' + word)
+        else:
+            blocks[-1][-1].append(' ' + word)
+        current = key
+    return '\n\n'.join('\n'.join(''.join(par) for par in block) for block in blocks)
+
+
+def recognize(data: bytes, min_dimension: int, max_dimension: int) -> Dict[str, Any]:
+    """OCR one image. Runs in the OCR process pool."""
+    import pytesseract
+    from PIL import Image
+
+    started = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    original_size = image.size
+    image = preprocess(image, min_dimension, max_dimension)
+    preprocessed = time.perf_counter()
+
+    ocr_data = pytesseract.image_to_data(
+        image,
+        output_type=pytesseract.Output.DICT,
+        config=TESSERACT_CONFIG
+    )
+    finished = time.perf_counter()
+
+    confidences = []
+    for conf in ocr_data['conf']:
+        try:
+            value = float(conf)
+        except (TypeError, ValueError):
+            continue
+        if value > 0:
+            confidences.append(value)
+    avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+
+    return {
+        'text': _text_from_data(ocr_data).strip(),
+        'confidence': avg_confidence / 100.0,
+        'original_size': list(original_size),
+        'processed_size': list(image.size),
+        'timings_ms': {
+            'preprocess': round((preprocessed - started) * 1000, 1),
+            'ocr': round((finished - preprocessed) * 1000, 1),
+            'total': round((finished - started) * 1000, 1),
+        },
+    }
+
+
+class OcrEngine:
+    def __init__(self, workers: int, timeout: float, min_dimension: int, max_dimension: int):
+        self.min_dimension = min_dimension
+        self.max_dimension = max_dimension
+        self.pool = CpuPool("ocr", workers, timeout, max_pending=workers * 4)
+
+    async def recognize(self, data: bytes) -> Dict[str, Any]:
+        """Text, mean word confidence (0-1), image sizes and per-stage timings for one image.
+
+        Raises CpuPoolError if Tesseract runs past OCR_TIMEOUT.
+        """
+        result = await self.pool.run(recognize, data, self.min_dimension, self.max_dimension)
+        logger.info(
+            f"🔍 OCR {result['original_size'][0]}x{result['original_size'][1]} image in "
+            f"{result['timings_ms']['total']}ms ({len(result['text'])} chars)"
+        )
+        return result
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.pool.get_stats()
+
+
+_config = get_config()
+ocr_engine = OcrEngine(
+    max(1, _config.OCR_WORKERS),
+    _config.OCR_TIMEOUT,
+    _config.OCR_MIN_DIMENSION,
+    _config.OCR_MAX_DIMENSION,
+)
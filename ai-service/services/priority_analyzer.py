@@ -1,9 +1,9 @@
 import asyncio
 import logging
 import re
-from typing import Dict, Any
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
+from typing import Dict, Any, Optional
+
+from .keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +25,18 @@ class PriorityAnalyzer:
             1: ['trivial', 'cosmetic', 'documentation', 'cleanup', 'refactor']
         }
         
+        # Fallback hints when no priority keyword matches
+        self.heuristic_keywords = {
+            'time': ['today', 'tomorrow', 'this week', 'deadline'],
+            'impact': ['bug', 'error', 'broken', 'not working'],
+            'audience': ['user', 'customer', 'client', 'production'],
+            'enhancement': ['enhancement', 'improvement', 'optimization', 'refactor']
+        }
+        
+        # Each table is matched in one pass per text
+        self.keyword_matcher = KeywordMatcher(self.priority_keywords)
+        self.heuristic_matcher = KeywordMatcher(self.heuristic_keywords, whole_words=False)
+        
     async def load_model(self):
         """Load the priority analysis model"""
         try:
@@ -33,6 +45,9 @@ class PriorityAnalyzer:
             loop = asyncio.get_event_loop()
             
             def _load_model():
+                # Imported here so the rule-based analysis works without transformers
+                from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+
                 tokenizer = AutoTokenizer.from_pretrained(self.model_name)
                 model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
                 
@@ -109,20 +124,15 @@ class PriorityAnalyzer:
                 'confidence': 0.5
             }
     
-    def _rule_based_analysis(self, text: str) -> int:
+    def keyword_scores(self, text: str) -> Dict[int, int]:
+        """Number of keyword matches in the text for each priority level"""
+        return self.keyword_matcher.counts(text)
+    
+    def _rule_based_analysis(self, text: str, priority_scores: Optional[Dict[int, int]] = None) -> int:
         """Rule-based priority analysis using keywords"""
-        text_lower = text.lower()
-        
         # Count keyword matches for each priority level
-        priority_scores = {}
-        
-        for priority, keywords in self.priority_keywords.items():
-            score = 0
-            for keyword in keywords:
-                # Count occurrences of each keyword
-                count = len(re.findall(r'\b' + re.escape(keyword) + r'\b', text_lower))
-                score += count
-            priority_scores[priority] = score
+        if priority_scores is None:
+            priority_scores = self.keyword_scores(text)
         
         # Find the priority with the highest score
         if any(priority_scores.values()):
@@ -131,21 +141,22 @@ class PriorityAnalyzer:
         
         # Additional heuristics
         priority = 3  # Default medium priority
+        hints = self.heuristic_matcher.present(text)
         
         # Check for time indicators
-        if any(word in text_lower for word in ['today', 'tomorrow', 'this week', 'deadline']):
+        if hints['time']:
             priority = max(priority, 4)
         
         # Check for impact indicators
-        if any(word in text_lower for word in ['bug', 'error', 'broken', 'not working']):
+        if hints['impact']:
             priority = max(priority, 4)
         
         # Check for user-facing issues
-        if any(word in text_lower for word in ['user', 'customer', 'client', 'production']):
+        if hints['audience']:
             priority = max(priority, 3)
         
         # Check for enhancement/improvement indicators
-        if any(word in text_lower for word in ['enhancement', 'improvement', 'optimization', 'refactor']):
+        if hints['enhancement']:
             priority = min(priority, 2)
         
         return priority
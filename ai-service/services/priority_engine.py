@@ -0,0 +1,367 @@
+"""Local priority scoring in front of the LLM.
+
+analyze_priority asked the provider for a 1-5 digit for every task, while
+PriorityAnalyzer's keyword rules sat unused. Priorities are now scored locally first:
+
+- rules: PriorityAnalyzer's keyword counts. On their own they are trusted only when
+  the task names a single priority level, at least twice ("urgent, blocker").
+- model: a logistic regression on the words of the title and description plus the
+  keyword counts, trained on the priorities teams actually set and calibrated so its
+  probabilities can be compared with a threshold. Its confidence is raised when the
+  rules agree with it and lowered when they do not.
+
+A score at or above PRIORITY_CONFIDENCE is returned at once; the LLM decides the rest
+as before. Callers are told which path answered ("rules", "model" or "llm").
+/priority/bulk returns the local scores of a whole backlog at once, confident or
+not, without calling the LLM.
+
+Models are trained with the CLI below from the backend export (GET
+/tasks/training-data) and saved as versioned joblib files in PRIORITY_MODEL_DIR. The
+newest is loaded at startup. Without one, only the rules answer.
+
+    python -m services.priority_engine train export.json   # fit, report, save
+    python -m services.priority_engine eval export.json    # accuracy and coverage
+    python -m services.priority_engine bench export.json   # scoring latency
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import get_config
+from .model_store import ModelStore, load_rows
+from .priority_analyzer import PriorityAnalyzer
+
+logger = logging.getLogger(__name__)
+
+MODEL_PREFIX = "priority-"
+LEVELS = (1, 2, 3, 4, 5)
+
+# Confidence of a keyword-only answer naming one level at least twice
+CLEAR_RULES_CONFIDENCE = 0.9
+
+_analyzer = PriorityAnalyzer()
+
+
+def task_text(title: str, description: str = "") -> str:
+    return f"Title: {title or ''}\nDescription: {description or ''}"
+
+
+def rule_features(texts: Sequence[str]):
+    """Keyword matches per priority level, one row per text (a pipeline step)."""
+    import numpy as np
+
+    rows = []
+    for text in texts:
+        scores = _analyzer.keyword_scores(text)
+        rows.append([scores.get(level, 0) for level in LEVELS])
+    return np.log1p(np.asarray(rows, dtype=float))
+
+
+def load_examples(path: str, label_field: str = "priority") -> Tuple[List[Tuple[str, str]], List[int]]:
+    """(title, description) pairs and priorities from a training export.
+
+    Rows without a title or a 1-5 priority are skipped.
+    """
+    tasks, labels = [], []
+    for row in load_rows(path):
+        title = str(row.get("title") or "").strip()
+        try:
+            label = int(str(row.get(label_field) or "").strip())
+        except ValueError:
+            continue
+        if title and label in LEVELS:
+            tasks.append((title, str(row.get("description") or "")))
+            labels.append(label)
+    return tasks, labels
+
+
+def build_pipeline(min_class_count: int):
+    from sklearn.calibration import CalibratedClassifierCV
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import FeatureUnion, Pipeline
+    from sklearn.preprocessing import FunctionTransformer
+
+    model = LogisticRegression(max_iter=2000, C=2.0, class_weight="balanced")
+    folds = min(3, min_class_count)
+    if folds >= 2:
+        # Sigmoid calibration: isotonic needs more examples per level than most teams have
+        model = CalibratedClassifierCV(model, method="sigmoid", cv=folds)
+    return Pipeline([
+        ("features", FeatureUnion([
+            ("words", TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, lowercase=True, min_df=1)),
+            ("rules", FunctionTransformer(rule_features)),
+        ])),
+        ("model", model),
+    ])
+
+
+@dataclass
+class PriorityScore:
+    priority: int
+    confidence: float
+    source: str  # "rules" or "model"
+
+
+class PriorityEngine:
+    def __init__(self, model_dir: Optional[str], threshold: float):
+        self.store = ModelStore(model_dir, MODEL_PREFIX)
+        self.threshold = threshold
+        self.analyzer = _analyzer
+        self._pipeline = None
+        self.version: Optional[str] = None
+        self.meta: Dict[str, Any] = {}
+
+        self.answered = {"rules": 0, "model": 0}
+        self.deferred = 0  # below the threshold, left to the LLM
+        self.triaged = 0  # scored by /priority/bulk
+
+    @property
+    def ready(self) -> bool:
+        return self._pipeline is not None
+
+    # --- persistence ----------------------------------------------------------
+
+    def load(self, version: Optional[str] = None) -> bool:
+        """Load the given model version, or the newest. Returns True if a model is loaded."""
+        try:
+            loaded = self.store.load(version)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load priority model {version or ''}: {e}")
+            return False
+        if loaded is None:
+            if self.store.model_dir:
+                logger.info(f"No priority model in {self.store.model_dir}; priorities come from the rules and the LLM")
+            return False
+        self.version, self._pipeline, self.meta = loaded
+        logger.info(f"✅ Loaded priority model {self.version} ({self.meta.get('examples', '?')} examples)")
+        return True
+
+    def save(self, pipeline, meta: Dict[str, Any]) -> str:
+        """Save a trained pipeline as a new version and make it current."""
+        self.version, path, self.meta = self.store.save(pipeline, meta)
+        self._pipeline = pipeline
+        return path
+
+    # --- scoring --------------------------------------------------------------
+
+    def _rules(self, text: str) -> Tuple[int, float, bool]:
+        """(priority, confidence, matched) from the keyword rules alone."""
+        scores = self.analyzer.keyword_scores(text)
+        matched = [level for level, count in scores.items() if count]
+        if not matched:
+            return self.analyzer._rule_based_analysis(text, scores), 0.5, False
+        priority = max(scores, key=scores.get)
+        if len(matched) == 1 and scores[priority] >= 2:
+            return priority, CLEAR_RULES_CONFIDENCE, True
+        return priority, self.analyzer._calculate_confidence(priority), True
+
+    def score_many(self, tasks: Sequence[Tuple[str, str]], use_model: bool = True) -> List[PriorityScore]:
+        """The best local score of each (title, description), however unsure."""
+        texts = [task_text(title, description) for title, description in tasks]
+        rules = [self._rules(text) for text in texts]
+        if not self.ready or not use_model or not texts:
+            return [PriorityScore(priority, confidence, "rules") for priority, confidence, _ in rules]
+
+        probabilities = self._pipeline.predict_proba(texts)
+        classes = self._pipeline.classes_
+        best = probabilities.argmax(axis=1)
+        scores = []
+        for (rule_priority, _, matched), row, i in zip(rules, probabilities, best):
+            priority, confidence = int(classes[i]), float(row[i])
+            if matched:
+                agreement = self.analyzer._calculate_confidence(rule_priority, priority)
+                if rule_priority == priority:
+                    # Two signals agree: meet the rules' agreement score halfway
+                    confidence = max(confidence, (confidence + agreement) / 2)
+                else:
+                    confidence = min(confidence, agreement)
+            scores.append(PriorityScore(priority, round(confidence, 4), "model"))
+        return scores
+
+    def decide_many(self, tasks: Sequence[Tuple[str, str]]) -> List[Optional[PriorityScore]]:
+        """The local score of each task when it is confident enough, else None."""
+        if not tasks:
+            return []
+        try:
+            scores = self.score_many(tasks)
+        except Exception as e:
+            logger.warning(f"⚠️ Priority model failed, asking the LLM: {e}")
+            return [None] * len(tasks)
+        decided = [score if score.confidence >= self.threshold else None for score in scores]
+        for score in decided:
+            if score is None:
+                self.deferred += 1
+            else:
+                self.answered[score.source] += 1
+        return decided
+
+    def decide(self, title: str, description: str = "") -> Optional[PriorityScore]:
+        return self.decide_many([(title, description)])[0]
+
+    def triage(self, tasks: Sequence[Tuple[str, str]], use_model: bool = True) -> List[PriorityScore]:
+        """Local scores for a whole backlog, confident or not; the LLM is never asked."""
+        scores = self.score_many(tasks, use_model)
+        self.triaged += len(scores)
+        return scores
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "threshold": self.threshold,
+            "rules": self.answered["rules"],
+            "model": self.answered["model"],
+            "deferred": self.deferred,
+            "triaged": self.triaged,
+            "holdout_accuracy": self.meta.get("holdout_accuracy"),
+        }
+
+
+_config = get_config()
+priority_engine = PriorityEngine(_config.PRIORITY_MODEL_DIR, _config.PRIORITY_CONFIDENCE)
+
+
+# --- CLI ----------------------------------------------------------------------
+
+def _report(engine: PriorityEngine, tasks: List[Tuple[str, str]], labels: List[int]) -> Dict[str, Any]:
+    """Accuracy of the rules and of the engine, and the share and accuracy of answers above each threshold."""
+    scores = engine.score_many(tasks)
+    correct = [score.priority == truth for score, truth in zip(scores, labels)]
+    rules_correct = [engine._rules(task_text(*task))[0] == truth for task, truth in zip(tasks, labels)]
+    report: Dict[str, Any] = {
+        "examples": len(tasks),
+        "accuracy": round(sum(correct) / len(correct), 4) if correct else None,
+        "rules_accuracy": round(sum(rules_correct) / len(rules_correct), 4) if rules_correct else None,
+        "mean_abs_error": round(sum(abs(s.priority - t) for s, t in zip(scores, labels)) / len(labels), 4) if labels else None,
+        "thresholds": {},
+    }
+    for threshold in (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95):
+        kept = [ok for score, ok in zip(scores, correct) if score.confidence >= threshold]
+        report["thresholds"][str(threshold)] = {
+            "coverage": round(len(kept) / len(correct), 4) if correct else None,
+            "accuracy": round(sum(kept) / len(kept), 4) if kept else None,
+        }
+    return report
+
+
+def _fit(tasks: List[Tuple[str, str]], labels: List[int]):
+    pipeline = build_pipeline(min(labels.count(level) for level in set(labels)))
+    return pipeline.fit([task_text(*task) for task in tasks], labels)
+
+
+def _train(args) -> int:
+    tasks, labels = load_examples(args.data, args.label_field)
+    if len(set(labels)) < 2:
+        print("Need examples of at least two priority levels to train", file=sys.stderr)
+        return 1
+
+    from sklearn.model_selection import train_test_split
+
+    meta: Dict[str, Any] = {"examples": len(tasks), "levels": {str(l): labels.count(l) for l in sorted(set(labels))}}
+    if args.test_size > 0:
+        try:
+            x_train, x_test, y_train, y_test = train_test_split(
+                tasks, labels, test_size=args.test_size, random_state=0, stratify=labels
+            )
+        except ValueError:
+            # Some level has a single example
+            x_train, x_test, y_train, y_test = train_test_split(
+                tasks, labels, test_size=args.test_size, random_state=0
+            )
+        holdout = PriorityEngine(None, args.threshold)
+        holdout._pipeline = _fit(x_train, y_train)
+        report = _report(holdout, x_test, y_test)
+        meta["holdout_accuracy"] = report["accuracy"]
+        meta["holdout"] = report
+        print(json.dumps(report, indent=2))
+
+    pipeline = _fit(tasks, labels)
+    if args.dry_run:
+        return 0
+    engine = PriorityEngine(args.model_dir, args.threshold)
+    print(f"Saved {engine.save(pipeline, meta)}")
+    return 0
+
+
+def _loaded(args) -> PriorityEngine:
+    engine = PriorityEngine(args.model_dir, args.threshold)
+    if not engine.load(args.version):
+        print(f"No priority model found in {args.model_dir}; using the rules alone", file=sys.stderr)
+    return engine
+
+
+def _eval(args) -> int:
+    engine = _loaded(args)
+    tasks, labels = load_examples(args.data, args.label_field)
+    print(json.dumps({"version": engine.version, **_report(engine, tasks, labels)}, indent=2))
+    return 0
+
+
+def _bench(args) -> int:
+    engine = _loaded(args)
+    tasks, _ = load_examples(args.data, args.label_field)
+    tasks = (tasks * (args.n // max(1, len(tasks)) + 1))[:args.n]
+    if not tasks:
+        print("No tasks to benchmark with", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    for title, description in tasks:
+        engine.decide(title, description)
+    single = (time.perf_counter() - start) / len(tasks)
+
+    start = time.perf_counter()
+    engine.decide_many(tasks)
+    batch = (time.perf_counter() - start) / len(tasks)
+
+    answered = sum(engine.answered.values())
+    print(json.dumps({
+        "tasks": len(tasks),
+        "single_us_per_task": round(single * 1e6, 1),
+        "batch_us_per_task": round(batch * 1e6, 1),
+        "answered_locally": round(answered / (answered + engine.deferred), 4),
+    }, indent=2))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m services.priority_engine", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model-dir", default=_config.PRIORITY_MODEL_DIR, help="default: PRIORITY_MODEL_DIR")
+    parser.add_argument("--threshold", type=float, default=_config.PRIORITY_CONFIDENCE, help="default: PRIORITY_CONFIDENCE")
+    parser.add_argument("--label-field", default="priority")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="fit a model on exported tasks and save it as a new version")
+    train.add_argument("data")
+    train.add_argument("--test-size", type=float, default=0.2, help="share held out for the report; 0 skips it")
+    train.add_argument("--dry-run", action="store_true", help="report only, do not save")
+    train.set_defaults(run=_train)
+
+    for name, run, help_text in (
+        ("eval", _eval, "accuracy and coverage of a saved model (or the rules) on exported tasks"),
+        ("bench", _bench, "scoring latency of a saved model (or the rules)"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("data")
+        command.add_argument("--version", help="model version; default the newest")
+        if name == "bench":
+            command.add_argument("-n", type=int, default=10000, help="tasks to score")
+        command.set_defaults(run=run)
+
+    args = parser.parse_args(argv)
+    if args.command == "train" and not args.model_dir and not args.dry_run:
+        parser.error("set PRIORITY_MODEL_DIR or pass --model-dir")
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Run the imported module rather than __main__, so saved pipelines refer to
+    # services.priority_engine.rule_features and load in the service
+    from services.priority_engine import main as _main
+    sys.exit(_main())
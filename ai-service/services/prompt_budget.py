@@ -0,0 +1,207 @@
+"""Token budget for assembling the chat system prompt.
+
+The system prompt used to grow with everything the backend sent: user memory,
+knowledge sources, referenced tasks and tickets with every comment, active work,
+objectives, quarters, meeting transcripts. Heavy users sent prompts that were slow and
+sometimes over the model's limit.
+
+The prompt is now built from PromptSections. Each section has a priority and an
+optional token cap. A prompt within budget is sent whole, caps and all. Over budget,
+assemble() first holds every section to its cap, then, if the total is still over,
+trims sections from the lowest priority (highest number) up. Priority 0 sections are
+never trimmed. A section made of items (tickets, meetings...) loses whole items from
+the end, so what remains is intact; the "[N more not shown]" note counts against
+the section's allowance. The token
+breakdown is logged and aggregated for /metrics. The report also gives the length of
+the leading run of sections marked stable, the prefix providers may cache.
+
+Tokens are counted with tiktoken for OpenAI-compatible providers when it is installed,
+and estimated from a characters-per-token ratio otherwise. Gemini and Anthropic only
+count tokens through an API call.
+"""
+
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = {
+    "anthropic": 3.5,
+    "gemini": 4.0,
+    "groq": 4.0,
+    "openai": 4.0,
+}
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _tiktoken_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str, provider: str) -> int:
+    if not text:
+        return 0
+    if provider in ("openai", "groq"):
+        encoding = _tiktoken_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN.get(provider, 4.0))
+
+
+@dataclass
+class PromptSection:
+    name: str
+    header: str = ""
+    items: List[str] = field(default_factory=list)
+    priority: int = 0  # 0 is never trimmed; higher numbers are trimmed first
+    max_tokens: Optional[int] = None  # cap applied once the prompt is over budget
+    stable: bool = False  # same text for every request of this company (or user)
+
+    @property
+    def text(self) -> str:
+        return self.header + "".join(self.items) if self.items else ""
+
+
+def _more(omitted: int) -> str:
+    return f"[{omitted} more not shown]\n" if omitted else ""
+
+
+def _fit(section: PromptSection, allowed: int, provider: str) -> str:
+    """The section cut down to `allowed` tokens, keeping whole items from the front."""
+    header_tokens = count_tokens(section.header, provider)
+    if allowed <= header_tokens:
+        return ""
+
+    kept = [section.header]
+    used = header_tokens
+    items = section.items
+    for i, item in enumerate(items):
+        tokens = count_tokens(item, provider)
+        # Keep room for the note about the items after this one
+        if used + tokens + count_tokens(_more(len(items) - i - 1), provider) <= allowed:
+            kept.append(item)
+            used += tokens
+            continue
+        omitted = len(items) - i
+        if i == 0:
+            # A single item larger than the whole allowance (say a long transcript)
+            room = allowed - used - count_tokens("\n[...]\n" + _more(omitted - 1), provider)
+            chars = int(room * CHARS_PER_TOKEN.get(provider, 4.0) * 0.9)
+            while chars > 0:
+                cut = item[:chars].rstrip() + "\n[...]\n"
+                if used + count_tokens(cut + _more(omitted - 1), provider) <= allowed:
+                    kept.append(cut)
+                    omitted -= 1
+                    break
+                chars = int(chars * 0.9)
+        if count_tokens(_more(omitted), provider) + used <= allowed:
+            kept.append(_more(omitted))
+        break
+    return "".join(kept)
+
+
+def assemble(sections: List[PromptSection], provider: str, budget: int) -> Tuple[str, Dict[str, Any]]:
+    """Join the sections within `budget` tokens. Returns the prompt and a token report."""
+    texts = [section.text for section in sections]
+    tokens = [count_tokens(text, provider) for text in texts]
+    trimmed = set()
+
+    total = sum(tokens)
+    if total > budget:
+        # Over budget: first hold each section to its own cap
+        for i, section in enumerate(sections):
+            if section.max_tokens is not None and tokens[i] > section.max_tokens:
+                texts[i] = _fit(section, section.max_tokens, provider)
+                tokens[i] = count_tokens(texts[i], provider)
+                trimmed.add(section.name)
+        total = sum(tokens)
+
+    if total > budget:
+        # Lowest priority first; among equals, the later section first
+        order = sorted(
+            (i for i, s in enumerate(sections) if s.priority > 0 and tokens[i]),
+            key=lambda i: (-sections[i].priority, -i),
+        )
+        for i in order:
+            if total <= budget:
+                break
+            allowed = max(0, tokens[i] - (total - budget))
+            texts[i] = _fit(sections[i], allowed, provider)
+            new_count = count_tokens(texts[i], provider)
+            total -= tokens[i] - new_count
+            tokens[i] = new_count
+            trimmed.add(sections[i].name)
+
+    # The leading run of stable sections is the part providers can cache
+    stable_chars = 0
+    for section, text in zip(sections, texts):
+        if not text:
+            continue
+        if not section.stable:
+            break
+        stable_chars += len(text)
+
+    report = {
+        "provider": provider,
+        "budget": budget,
+        "total": total,
+        "stable_chars": stable_chars,
+        "sections": {s.name: tokens[i] for i, s in enumerate(sections) if tokens[i]},
+        "trimmed": [s.name for s in sections if s.name in trimmed],
+    }
+    prompt_stats.record(report)
+    logger.info(
+        f"🧮 System prompt {total}/{budget} tokens ({provider}): "
+        + ", ".join(f"{name}={count}" for name, count in report["sections"].items())
+        + (f"; trimmed {', '.join(report['trimmed'])}" if report["trimmed"] else "")
+    )
+    return "".join(texts), report
+
+
+class PromptStats:
+    def __init__(self):
+        self.prompts = 0
+        self.trimmed_prompts = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.section_tokens: Dict[str, int] = {}
+        self.section_trims: Dict[str, int] = {}
+
+    def record(self, report: Dict[str, Any]) -> None:
+        self.prompts += 1
+        self.total_tokens += report["total"]
+        self.max_tokens = max(self.max_tokens, report["total"])
+        if report["trimmed"]:
+            self.trimmed_prompts += 1
+        for name, count in report["sections"].items():
+            self.section_tokens[name] = self.section_tokens.get(name, 0) + count
+        for name in report["trimmed"]:
+            self.section_trims[name] = self.section_trims.get(name, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        prompts = self.prompts or 1
+        return {
+            "prompts": self.prompts,
+            "trimmed_prompts": self.trimmed_prompts,
+            "avg_tokens": round(self.total_tokens / prompts),
+            "max_tokens": self.max_tokens,
+            "avg_section_tokens": {
+                name: round(count / prompts) for name, count in sorted(self.section_tokens.items())
+            },
+            "section_trims": dict(sorted(self.section_trims.items())),
+        }
+
+
+prompt_stats = PromptStats()
@@ -0,0 +1,256 @@
+"""Provider-side caching of the stable start of a system prompt.
+
+The company block at the start of a system prompt (instructions, and the knowledge
+sources when they are sent whole) is the same across many requests from one company,
+but it was sent and prefilled again on every call. The prompt builders now report how
+many leading characters of the prompt are stable, and the providers are told to cache
+that prefix:
+
+- Claude: the prefix becomes its own system block marked with cache_control, so the
+  API reuses it for five minutes after each use. Prefixes shorter than the model's
+  minimum are simply not cached by the API.
+- Gemini: the prefix is stored as a cachedContents entry, keyed by a fingerprint of
+  the API key, model and prefix, and requests name it instead of resending it. An
+  entry lives for GEMINI_CACHE_TTL seconds and is recreated on the first use after
+  that, or when Gemini says it is gone. Prefixes under GEMINI_CACHE_MIN_TOKENS are
+  sent as before, as are prefixes Gemini refused to cache, until the TTL passes.
+  At most GEMINI_CACHE_MAX_ENTRIES are tracked; one pushed out of that LRU is deleted
+  on Gemini too, rather than left to bill storage until its TTL.
+
+Token counts from both providers' usage reports are kept for /metrics.
+GEMINI_API_BASE_URL, and the Anthropic SDK's own ANTHROPIC_BASE_URL, point the
+service at a stand-in API for testing; tests/fake_provider_api.py is one.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
+
+import aiohttp
+from cachetools import LRUCache
+
+from config import get_config
+from . import http_transport
+from .prompt_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Recreate a Gemini entry this long before it expires, so a request never names an
+# entry that expires while it is in flight.
+EXPIRY_MARGIN = 30
+
+
+def split_prefix(system_prompt: str, cacheable_chars: int) -> Tuple[str, str]:
+    """The cacheable prefix of a system prompt and the rest of it."""
+    cacheable_chars = max(0, min(cacheable_chars or 0, len(system_prompt or "")))
+    return system_prompt[:cacheable_chars], system_prompt[cacheable_chars:]
+
+
+def anthropic_system(system_prompt: str, cacheable_chars: int) -> Any:
+    """The Messages API `system` value, with the stable prefix marked for caching."""
+    prefix, rest = split_prefix(system_prompt, cacheable_chars)
+    if not prefix.strip():
+        return system_prompt
+    blocks = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+    if rest.strip():
+        blocks.append({"type": "text", "text": rest})
+    return blocks
+
+
+@dataclass
+class _GeminiEntry:
+    name: Optional[str]  # None: Gemini would not cache this prefix
+    expires_at: float
+    base_url: str = ""
+    api_key: str = ""  # the key that created it; only that key can use or delete it
+
+
+class _GeminiEntries(LRUCache):
+    """The LRU of cachedContents entries, reporting the ones it evicts."""
+
+    def __init__(self, maxsize: int, on_evict):
+        super().__init__(maxsize=maxsize)
+        self._on_evict = on_evict
+
+    def popitem(self):
+        key, entry = super().popitem()
+        self._on_evict(entry)
+        return key, entry
+
+
+class PromptCache:
+    def __init__(self, gemini_ttl: int, gemini_min_tokens: int, max_entries: int):
+        self.gemini_ttl = gemini_ttl
+        self.gemini_min_tokens = gemini_min_tokens
+        self._gemini: LRUCache = _GeminiEntries(max(1, max_entries), self._evicted)
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._deleting: Set[asyncio.Task] = set()
+
+        self.anthropic_requests = 0
+        self.anthropic_cache_read_tokens = 0
+        self.anthropic_cache_write_tokens = 0
+        self.anthropic_input_tokens = 0
+        self.gemini_requests = 0
+        self.gemini_cached_tokens = 0
+        self.gemini_prompt_tokens = 0
+        self.gemini_hits = 0
+        self.gemini_created = 0
+        self.gemini_refused = 0
+        self.gemini_invalidated = 0
+        self.gemini_deleted = 0
+
+    # --- Gemini cachedContents ----------------------------------------------
+
+    @staticmethod
+    def _key(api_key: str, model: str, prefix: str) -> str:
+        digest = hashlib.sha256()
+        for part in (api_key, model, prefix):
+            digest.update(part.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    async def gemini_cached_content(
+        self, base_url: str, api_key: str, model: str, prefix: str
+    ) -> Optional[str]:
+        """The cachedContents name holding `prefix` as system instruction, or None.
+
+        None means the prefix should be sent in the request as usual: it is too short,
+        caching is disabled, or Gemini declined to cache it.
+        """
+        if self.gemini_ttl <= 0 or not api_key or not prefix.strip():
+            return None
+        if count_tokens(prefix, "gemini") < self.gemini_min_tokens:
+            return None
+
+        key = self._key(api_key, model, prefix)
+        entry = self._gemini.get(key)
+        if entry is not None and entry.expires_at - EXPIRY_MARGIN > time.monotonic():
+            if entry.name:
+                self.gemini_hits += 1
+            return entry.name
+
+        # One creation per prefix; concurrent requests wait for it
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        name = None
+        try:
+            name = await self._create(base_url, api_key, model, prefix, key)
+            return name
+        finally:
+            # If the creating request was cancelled, the waiters go uncached
+            del self._pending[key]
+            future.set_result(name)
+
+    async def _create(self, base_url: str, api_key: str, model: str, prefix: str, key: str) -> Optional[str]:
+        url = f"{base_url}/cachedContents"
+        payload = {
+            "model": model if model.startswith("models/") else f"models/{model}",
+            "systemInstruction": {"parts": [{"text": prefix}]},
+            "ttl": f"{self.gemini_ttl}s",
+        }
+        headers = {"Content-Type": "application/json", "X-goog-api-key": api_key}
+        expires_at = time.monotonic() + self.gemini_ttl
+        name = None
+        try:
+            session = http_transport.get_session()
+            async with session.post(url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status == 200:
+                    name = (await response.json()).get("name")
+                else:
+                    error_text = await response.text()
+                    logger.warning(f"⚠️ Gemini did not cache a system prompt prefix ({response.status}): {error_text[:200]}")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not create a Gemini cached prefix: {e}")
+
+        if name:
+            self.gemini_created += 1
+            logger.info(f"♻️ Cached a {len(prefix)}-char system prompt prefix on Gemini as {name}")
+        else:
+            self.gemini_refused += 1
+        self._gemini[key] = _GeminiEntry(name, expires_at, base_url, api_key)
+        return name
+
+    def _evicted(self, entry: _GeminiEntry) -> None:
+        if not entry.name or entry.expires_at <= time.monotonic():
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._delete(entry))
+        except RuntimeError:
+            return  # no event loop; Gemini drops it when the TTL passes
+        self._deleting.add(task)
+        task.add_done_callback(self._deleting.discard)
+
+    async def _delete(self, entry: _GeminiEntry) -> None:
+        url = f"{entry.base_url}/{entry.name}"
+        try:
+            session = http_transport.get_session()
+            async with session.delete(
+                url, headers={"X-goog-api-key": entry.api_key}, timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                if response.status in (200, 404):
+                    self.gemini_deleted += 1
+                else:
+                    logger.warning(f"⚠️ Could not delete Gemini cached prefix {entry.name} ({response.status})")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not delete Gemini cached prefix {entry.name}: {e}")
+
+    def invalidate_gemini(self, name: str) -> None:
+        """Forget a cachedContents entry Gemini no longer recognises."""
+        for key, entry in list(self._gemini.items()):
+            if entry.name == name:
+                del self._gemini[key]
+                self.gemini_invalidated += 1
+                logger.info(f"♻️ Gemini cached prefix {name} is gone; it will be recreated")
+
+    # --- usage ----------------------------------------------------------------
+
+    def record_anthropic_usage(self, usage: Any) -> None:
+        if usage is None:
+            return
+        self.anthropic_requests += 1
+        self.anthropic_cache_read_tokens += getattr(usage, "cache_read_input_tokens", None) or 0
+        self.anthropic_cache_write_tokens += getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.anthropic_input_tokens += getattr(usage, "input_tokens", None) or 0
+
+    def record_gemini_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        self.gemini_requests += 1
+        self.gemini_cached_tokens += usage.get("cachedContentTokenCount") or 0
+        self.gemini_prompt_tokens += usage.get("promptTokenCount") or 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "anthropic": {
+                "requests": self.anthropic_requests,
+                "cache_read_tokens": self.anthropic_cache_read_tokens,
+                "cache_write_tokens": self.anthropic_cache_write_tokens,
+                "uncached_input_tokens": self.anthropic_input_tokens,
+            },
+            "gemini": {
+                "live_entries": sum(1 for e in self._gemini.values() if e.name and e.expires_at > now),
+                "hits": self.gemini_hits,
+                "created": self.gemini_created,
+                "refused": self.gemini_refused,
+                "invalidated": self.gemini_invalidated,
+                "deleted": self.gemini_deleted,
+                "requests": self.gemini_requests,
+                "cached_tokens": self.gemini_cached_tokens,
+                "prompt_tokens": self.gemini_prompt_tokens,
+            },
+        }
+
+
+_config = get_config()
+prompt_cache = PromptCache(
+    _config.GEMINI_CACHE_TTL,
+    _config.GEMINI_CACHE_MIN_TOKENS,
+    _config.GEMINI_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,61 @@
+"""Memoized system prompt text.
+
+ContentGenerator rebuilt its whole company and competitor system prompt on every
+provider call: three times per /generate-content and again for every subtask
+request, from the same inputs each time.
+
+Built text is kept in an LRU keyed by a fingerprint of everything it was built from
+(company name, knowledge source ids, the excerpt versions the knowledge index
+reports, flags...). A changed input gives a different fingerprint, so stale entries
+are never served; they simply age out of the LRU. Text that is cheaper to build
+than to fingerprint, like a single f-string, is not worth memoizing.
+"""
+
+import hashlib
+import json
+from typing import Any, Callable, Dict
+
+from cachetools import LRUCache
+
+from config import get_config
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8", "surrogatepass")).hexdigest()[:16]
+
+
+class PromptMemo:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._cache: LRUCache = LRUCache(maxsize=max(1, maxsize))
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(namespace: str, parts: Any) -> str:
+        payload = json.dumps([namespace, parts], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get_or_build(self, namespace: str, parts: Any, build: Callable[[], Any]) -> Any:
+        """The value built for these inputs, calling `build()` only the first time."""
+        key = self.fingerprint(namespace, parts)
+        text = self._cache.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        text = build()
+        self._cache[key] = text
+        return text
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._cache),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_config = get_config()
+prompt_memo = PromptMemo(_config.PROMPT_MEMO_SIZE)
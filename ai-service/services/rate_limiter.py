@@ -0,0 +1,154 @@
+"""Process-wide rate limiting for outbound provider calls.
+
+ContentGenerator used to keep `last_request_time` on the instance, and every endpoint
+builds a fresh instance, so nothing was ever throttled across requests while calls
+inside one request still slept a second apart. This replaces that with one token
+bucket per (provider, API key) shared by the whole process.
+
+A caller takes a token and goes straight through while the bucket has one. Once it is
+empty, callers queue in arrival order and each waits only as long as the refill takes.
+Buckets are sized from RATE_LIMIT_REQUESTS per RATE_LIMIT_INTERVAL seconds.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """An async token bucket whose waiters are served first come, first served."""
+
+    def __init__(self, capacity: int, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = refill_per_second
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # asyncio.Lock wakes waiters in FIFO order, which is what makes the queue fair:
+        # the head of the queue holds the lock while it waits for the next token.
+        self._lock = asyncio.Lock()
+
+        self.waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        """True when nobody is queued and the bucket has refilled completely."""
+        self._refill()
+        return self.waiting == 0 and self.tokens >= self.capacity
+
+    async def acquire(self) -> float:
+        """Take one token, waiting for it if necessary. Returns seconds spent waiting."""
+        self._refill()
+        if self.waiting == 0 and self.tokens >= 1:
+            # Uncontended: no lock, no sleep.
+            self.tokens -= 1
+            self.acquired += 1
+            return 0.0
+
+        self.waiting += 1
+        self.throttled += 1
+        started = time.monotonic()
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    await asyncio.sleep((1 - self.tokens) / self.refill_per_second)
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.wait_seconds += waited
+        return waited
+
+
+class RateLimiter:
+    """Token buckets keyed by (provider, hash of the API key)."""
+
+    def __init__(self, requests: int, interval: int, max_buckets: int = 1024):
+        self.capacity = max(1, requests)
+        self.refill_per_second = self.capacity / max(1, interval)
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+
+    @staticmethod
+    def _key_id(api_key: str) -> str:
+        # Raw keys never become dict keys or metric labels.
+        return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+    def _bucket(self, provider: str, api_key: str) -> TokenBucket:
+        bucket_key = ((provider or "gemini").lower(), self._key_id(api_key))
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = TokenBucket(self.capacity, self.refill_per_second)
+            self._buckets[bucket_key] = bucket
+            self._prune()
+        else:
+            self._buckets.move_to_end(bucket_key)
+        return bucket
+
+    def _prune(self) -> None:
+        """Drop the least recently used idle buckets once there are too many.
+
+        An idle bucket is full with no waiters, so recreating it later is identical to
+        keeping it.
+        """
+        excess = len(self._buckets) - self.max_buckets
+        if excess <= 0:
+            return
+        for bucket_key in list(self._buckets.keys()):
+            if excess <= 0:
+                break
+            if self._buckets[bucket_key].idle:
+                del self._buckets[bucket_key]
+                excess -= 1
+
+    async def acquire(self, provider: str, api_key: str) -> None:
+        """Wait for permission to make one call to `provider` with `api_key`."""
+        bucket = self._bucket(provider, api_key)
+        waited = await bucket.acquire()
+        if waited > 0.05:
+            logger.info(f"⏳ Rate limiter held a {provider} call for {waited:.2f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Bucket state for the metrics endpoint."""
+        buckets = []
+        for (provider, key_id), bucket in self._buckets.items():
+            bucket._refill()
+            buckets.append({
+                "provider": provider,
+                "key": key_id[:8],
+                "tokens": round(bucket.tokens, 2),
+                "waiting": bucket.waiting,
+                "acquired": bucket.acquired,
+                "throttled": bucket.throttled,
+                "wait_seconds": round(bucket.wait_seconds, 3),
+            })
+        return {
+            "capacity": self.capacity,
+            "refill_per_second": round(self.refill_per_second, 4),
+            "waiting": sum(b["waiting"] for b in buckets),
+            "throttled": sum(b["throttled"] for b in buckets),
+            "buckets": buckets,
+        }
+
+
+_config = get_config()
+rate_limiter = RateLimiter(_config.RATE_LIMIT_REQUESTS, _config.RATE_LIMIT_INTERVAL)
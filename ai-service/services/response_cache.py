@@ -0,0 +1,88 @@
+"""In-process cache of LLM replies.
+
+Users retry, re-open drafts and re-run the same checks, and the backend forwards each
+of those as a fresh /detect-task-type, /summarize, /ticket-check or /generate-content
+call. Identical inputs get the reply we already paid for.
+
+Entries are keyed by a SHA-256 digest of provider, model, system prompt and user
+prompt; the API key never takes part. Entries expire after CACHE_TTL seconds, the
+least recently used are evicted first, and the total size of stored replies is capped
+at CACHE_MAX_BYTES. Nothing is cached unless the caller opts in with a namespace, so
+conversational endpoints keep getting fresh answers.
+"""
+
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry overhead (digest key plus bookkeeping) added to the reply size.
+_ENTRY_OVERHEAD_BYTES = 128
+
+
+def _sizeof(value: str) -> int:
+    return len(value.encode("utf-8")) + _ENTRY_OVERHEAD_BYTES
+
+
+class ResponseCache:
+    def __init__(self, enabled: bool, ttl: int, max_bytes: int):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._cache: TTLCache = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=_sizeof)
+        self._hits: Dict[str, int] = defaultdict(int)
+        self._misses: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, prompt: str, json_mode: bool = False) -> str:
+        digest = hashlib.sha256()
+        for part in (provider, model, "json" if json_mode else "text", system_prompt or "", prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x1f")  # separator, so ("ab", "c") and ("a", "bc") differ
+        return digest.hexdigest()
+
+    def get(self, key: str, namespace: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        value = self._cache.get(key)
+        if value is None:
+            self._misses[namespace] += 1
+            return None
+        self._hits[namespace] += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled or not value:
+            return
+        try:
+            self._cache[key] = value
+        except ValueError:
+            # A single reply larger than the whole cache; just don't store it.
+            logger.debug(f"Reply of {len(value)} chars exceeds the response cache size")
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        namespaces = sorted(set(self._hits) | set(self._misses))
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._cache),
+            "bytes": int(self._cache.currsize),
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": int(self._cache.ttl),
+            "hits": sum(self._hits.values()),
+            "misses": sum(self._misses.values()),
+            "by_endpoint": {
+                ns: {"hits": self._hits[ns], "misses": self._misses[ns]} for ns in namespaces
+            },
+        }
+
+
+_config = get_config()
+response_cache = ResponseCache(_config.CACHE_ENABLED, _config.CACHE_TTL, _config.CACHE_MAX_BYTES)
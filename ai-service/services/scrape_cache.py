@@ -0,0 +1,101 @@
+"""Cache of fast-scrape results for revalidating knowledge sources.
+
+Every refresh of a knowledge source used to download and re-parse the whole page even
+when nothing had changed. Each successful fast scrape is now kept here, keyed by the
+normalized URL, together with the page's ETag, its Last-Modified value and a hash of
+the HTML.
+
+Refetches send If-None-Match / If-Modified-Since. A 304 returns the cached extraction
+without parsing. So does a 200 whose HTML hashes the same, for servers that send no
+validators. Either way the result is flagged `unchanged: true`.
+
+Deep (browser) scrapes are not cached: a JavaScript app's HTML shell can stay the same
+while the content it loads changes.
+"""
+
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from cachetools import LRUCache
+
+from config import get_config
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Lowercase scheme and host, drop default ports and fragments, default path to "/"."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+@dataclass
+class ScrapeEntry:
+    title: str
+    content: str
+    content_hash: str  # SHA-256 of the page's HTML
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    stored_at: float = 0.0
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def _sizeof(entry: ScrapeEntry) -> int:
+    return len(entry.content) + len(entry.title) + 256
+
+
+class ScrapeCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=_sizeof)
+
+        self.misses = 0
+        self.not_modified = 0  # 304 responses
+        self.same_content = 0  # 200 responses with unchanged HTML
+        self.changed = 0
+
+    @staticmethod
+    def digest(html: bytes) -> str:
+        return hashlib.sha256(html).hexdigest()
+
+    def get(self, url: str) -> Optional[ScrapeEntry]:
+        entry = self._entries.get(normalize_url(url))
+        if entry is None:
+            self.misses += 1
+        return entry
+
+    def put(self, url: str, entry: ScrapeEntry) -> None:
+        entry.stored_at = time.time()
+        try:
+            self._entries[normalize_url(url)] = entry
+        except ValueError:
+            pass  # larger than the whole cache
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": int(self._entries.currsize),
+            "max_bytes": self.max_bytes,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "same_content": self.same_content,
+            "changed": self.changed,
+        }
+
+
+_config = get_config()
+scrape_cache = ScrapeCache(_config.SCRAPE_CACHE_MAX_BYTES)
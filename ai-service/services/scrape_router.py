@@ -0,0 +1,139 @@
+"""Per-domain memory of which scrape method works.
+
+scrape_url used to start every scrape with the fast aiohttp fetch and only fall back to
+the browser when the result was too short or looked blocked. Sites that are JavaScript
+apps or sit behind bot protection paid for a wasted fetch on every refresh.
+
+The router remembers, per host, whether the fast or the deep (browser) scrape last
+produced usable content. Hosts marked deep go straight to the browser until the
+record expires after SCRAPE_ROUTE_TTL seconds, when the fast path is tried again.
+Setting SCRAPE_ROUTES_FILE keeps the table across restarts.
+
+looks_like_spa_shell() recognises a client-rendered app shell from the first
+SPA_SNIFF_BYTES of its HTML (an empty framework mount point), so such a page goes to
+the browser before the rest is downloaded or parsed. A "please enable JavaScript"
+<noscript> notice alone is not enough: server-rendered sites ship it too. It only
+marks a shell when the parsed page also turns out too short to use.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+FAST = 'fast'
+DEEP = 'deep'
+
+SPA_SNIFF_BYTES = 16 * 1024
+
+# An empty mount point for a client-side framework, e.g. <div id="root"></div>
+_EMPTY_MOUNT = re.compile(
+    rb'<(?:div|main)\s+id=["\'](?:root|app|__next|__nuxt|q-app|svelte)["\'][^>]*>\s*</(?:div|main)>',
+    re.IGNORECASE,
+)
+_NOSCRIPT_NOTICE = re.compile(
+    rb'<noscript>[^<]*(?:enable javascript|javascript (?:is )?required|need to enable)',
+    re.IGNORECASE,
+)
+_ANGULAR_ROOT = re.compile(rb'<app-root[^>]*>\s*</app-root>', re.IGNORECASE)
+
+
+def looks_like_spa_shell(head: bytes) -> bool:
+    """True if the start of an HTML document is a client-rendered shell with no content."""
+    head = head[:SPA_SNIFF_BYTES]
+    return bool(_EMPTY_MOUNT.search(head) or _ANGULAR_ROOT.search(head))
+
+
+def has_noscript_notice(head: bytes) -> bool:
+    """True if the start of an HTML document asks the reader to enable JavaScript."""
+    return bool(_NOSCRIPT_NOTICE.search(head[:SPA_SNIFF_BYTES]))
+
+
+class ScrapeRouter:
+    def __init__(self, ttl: float, path: Optional[str] = None):
+        self.ttl = ttl
+        self.path = path or None
+        self._routes: Dict[str, Tuple[str, float]] = {}  # host -> (method, expires_at)
+
+        self.routed = 0
+        self.spa_shells = 0
+
+        if self.path:
+            self._load()
+
+    def route(self, host: str) -> Optional[str]:
+        """FAST or DEEP if a method is remembered for this host, else None."""
+        entry = self._routes.get(host)
+        if entry is None:
+            return None
+        method, expires_at = entry
+        if expires_at <= time.time():
+            del self._routes[host]
+            return None
+        return method
+
+    def record(self, host: str, method: str) -> None:
+        """Remember that `method` produced usable content for `host`."""
+        now = time.time()
+        previous = self._routes.get(host)
+        self._routes[host] = (method, now + self.ttl)
+        changed = previous is None or previous[0] != method
+        if changed:
+            logger.info(f"🧭 Scraping {host} with the {method} method from now on")
+        # Persist real changes, and a refreshed expiry at most every half TTL
+        if self.path and (changed or previous[1] - now < self.ttl / 2):
+            self._save()
+
+    def forget(self, host: str) -> None:
+        if self._routes.pop(host, None) is not None and self.path:
+            self._save()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Unreadable scrape routes file {self.path}: {e}")
+            return
+        now = time.time()
+        for host, (method, expires_at) in data.items():
+            if expires_at > now and method in (FAST, DEEP):
+                self._routes[host] = (method, expires_at)
+
+    def _save(self) -> None:
+        now = time.time()
+        data = {host: entry for host, entry in self._routes.items() if entry[1] > now}
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            # Write then rename, so a concurrent reader never sees half a file.
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(data, fh)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not write scrape routes file {self.path}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        live = [method for method, expires_at in self._routes.values() if expires_at > now]
+        return {
+            "fast_hosts": live.count(FAST),
+            "deep_hosts": live.count(DEEP),
+            "routed": self.routed,
+            "spa_shells": self.spa_shells,
+            "persisted_to": self.path,
+        }
+
+
+_config = get_config()
+scrape_router = ScrapeRouter(_config.SCRAPE_ROUTE_TTL, _config.SCRAPE_ROUTES_FILE)
@@ -0,0 +1,282 @@
+"""Local task type classifier in front of the LLM.
+
+detect_task_type asked the provider to pick one of ContentGenerator.TASK_TYPES for
+every title: a full round trip for an answer most titles make obvious ("Instagram post
+for the spring launch"). A TF-IDF + logistic regression model trained on labelled
+titles now answers first. If its top class probability is at least
+TASK_TYPE_CONFIDENCE, that label is returned at once; below it, the LLM decides as
+before.
+
+Models are trained with the CLI below from the tasks the backend exports
+(GET /tasks/training-data) and saved as versioned joblib files in TASK_TYPE_MODEL_DIR.
+The newest is loaded at startup. With no directory or no model, every title goes to
+the LLM.
+
+    python -m services.task_type_classifier train export.json   # fit, report, save
+    python -m services.task_type_classifier eval export.json    # accuracy and coverage
+    python -m services.task_type_classifier bench export.json   # prediction latency
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import get_config
+from .model_store import ModelStore, load_rows
+
+logger = logging.getLogger(__name__)
+
+MODEL_PREFIX = "task-type-"
+
+
+def load_examples(path: str, label_field: str = "taskType") -> Tuple[List[str], List[str]]:
+    """Titles and labels from a training export. Rows without a title or a label are skipped."""
+    titles, labels = [], []
+    for row in load_rows(path):
+        title = str(row.get("title") or "").strip()
+        label = str(row.get(label_field) or row.get("label") or "").strip().upper()
+        if title and label:
+            titles.append(title)
+            labels.append(label)
+    return titles, labels
+
+
+def build_pipeline():
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import FeatureUnion, Pipeline
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    return Pipeline([
+        ("features", FeatureUnion([
+            ("words", TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, lowercase=True)),
+            # Character n-grams catch "IG", "newsletter"/"newsletters", typos
+            ("chars", TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5), sublinear_tf=True, lowercase=True)),
+        ])),
+        ("model", LogisticRegression(max_iter=2000, C=5.0, class_weight="balanced")),
+    ])
+
+
+class TaskTypeClassifier:
+    def __init__(self, model_dir: Optional[str], threshold: float):
+        self.store = ModelStore(model_dir, MODEL_PREFIX)
+        self.threshold = threshold
+        self._pipeline = None
+        self.version: Optional[str] = None
+        self.meta: Dict[str, Any] = {}
+
+        self.local = 0  # answered here
+        self.deferred = 0  # below the threshold, left to the LLM
+
+    @property
+    def ready(self) -> bool:
+        return self._pipeline is not None
+
+    # --- persistence ----------------------------------------------------------
+
+    def load(self, version: Optional[str] = None) -> bool:
+        """Load the given model version, or the newest. Returns True if a model is loaded."""
+        try:
+            loaded = self.store.load(version)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load task type model {version or ''}: {e}")
+            return False
+        if loaded is None:
+            if self.store.model_dir:
+                logger.info(f"No task type model in {self.store.model_dir}; task types come from the LLM")
+            return False
+        self.version, self._pipeline, self.meta = loaded
+        logger.info(f"✅ Loaded task type model {self.version} ({self.meta.get('examples', '?')} examples)")
+        return True
+
+    def save(self, pipeline, meta: Dict[str, Any]) -> str:
+        """Save a trained pipeline as a new version and make it current."""
+        self.version, path, self.meta = self.store.save(pipeline, meta)
+        self._pipeline = pipeline
+        return path
+
+    # --- prediction ----------------------------------------------------------
+
+    def predict(self, titles: Sequence[str]) -> List[Tuple[str, float]]:
+        """The most likely label of each title and its probability."""
+        probabilities = self._pipeline.predict_proba(list(titles))
+        classes = self._pipeline.classes_
+        best = probabilities.argmax(axis=1)
+        return [(str(classes[i]), float(row[i])) for row, i in zip(probabilities, best)]
+
+    def classify_many(self, titles: Sequence[str]) -> List[Optional[str]]:
+        """The label of each title when the model is confident enough, else None."""
+        if not self.ready or not titles:
+            return [None] * len(titles)
+        try:
+            predictions = self.predict(titles)
+        except Exception as e:
+            logger.warning(f"⚠️ Task type model failed, asking the LLM: {e}")
+            return [None] * len(titles)
+        labels = [label if confidence >= self.threshold else None for label, confidence in predictions]
+        answered = sum(1 for label in labels if label)
+        self.local += answered
+        self.deferred += len(labels) - answered
+        return labels
+
+    def classify(self, title: str) -> Optional[str]:
+        return self.classify_many([title])[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "threshold": self.threshold,
+            "local": self.local,
+            "deferred": self.deferred,
+            "holdout_accuracy": self.meta.get("holdout_accuracy"),
+        }
+
+
+_config = get_config()
+task_type_classifier = TaskTypeClassifier(_config.TASK_TYPE_MODEL_DIR, _config.TASK_TYPE_CONFIDENCE)
+
+
+# --- CLI ----------------------------------------------------------------------
+
+def _report(classifier: TaskTypeClassifier, titles: List[str], labels: List[str]) -> Dict[str, Any]:
+    """Accuracy overall, and the share and accuracy of answers above each threshold."""
+    predictions = classifier.predict(titles)
+    correct = [label == truth for (label, _), truth in zip(predictions, labels)]
+    report: Dict[str, Any] = {
+        "examples": len(titles),
+        "accuracy": round(sum(correct) / len(correct), 4) if correct else None,
+        "thresholds": {},
+    }
+    for threshold in (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95):
+        kept = [ok for (_, confidence), ok in zip(predictions, correct) if confidence >= threshold]
+        report["thresholds"][str(threshold)] = {
+            "coverage": round(len(kept) / len(correct), 4) if correct else None,
+            "accuracy": round(sum(kept) / len(kept), 4) if kept else None,
+        }
+    return report
+
+
+def _known_labels() -> List[str]:
+    from services.content_generator import ContentGenerator
+    return list(ContentGenerator.TASK_TYPES)
+
+
+def _train(args) -> int:
+    titles, labels = load_examples(args.data, args.label_field)
+    known = set(_known_labels())
+    pairs = [(t, l) for t, l in zip(titles, labels) if l in known]
+    if len(pairs) < len(titles):
+        print(f"Skipped {len(titles) - len(pairs)} examples with unknown labels", file=sys.stderr)
+    if len({l for _, l in pairs}) < 2:
+        print("Need examples of at least two task types to train", file=sys.stderr)
+        return 1
+    titles, labels = [t for t, _ in pairs], [l for _, l in pairs]
+
+    from sklearn.model_selection import train_test_split
+
+    meta: Dict[str, Any] = {"examples": len(titles), "labels": sorted(set(labels))}
+    if args.test_size > 0:
+        try:
+            x_train, x_test, y_train, y_test = train_test_split(
+                titles, labels, test_size=args.test_size, random_state=0, stratify=labels
+            )
+        except ValueError:
+            # Some type has a single example
+            x_train, x_test, y_train, y_test = train_test_split(
+                titles, labels, test_size=args.test_size, random_state=0
+            )
+        holdout = TaskTypeClassifier(None, args.threshold)
+        holdout._pipeline = build_pipeline().fit(x_train, y_train)
+        report = _report(holdout, x_test, y_test)
+        meta["holdout_accuracy"] = report["accuracy"]
+        meta["holdout"] = report
+        print(json.dumps(report, indent=2))
+
+    pipeline = build_pipeline().fit(titles, labels)
+    if args.dry_run:
+        return 0
+    classifier = TaskTypeClassifier(args.model_dir, args.threshold)
+    print(f"Saved {classifier.save(pipeline, meta)}")
+    return 0
+
+
+def _loaded(args) -> Optional[TaskTypeClassifier]:
+    classifier = TaskTypeClassifier(args.model_dir, args.threshold)
+    if not classifier.load(args.version):
+        print(f"No task type model found in {args.model_dir}", file=sys.stderr)
+        return None
+    return classifier
+
+
+def _eval(args) -> int:
+    classifier = _loaded(args)
+    if classifier is None:
+        return 1
+    titles, labels = load_examples(args.data, args.label_field)
+    print(json.dumps({"version": classifier.version, **_report(classifier, titles, labels)}, indent=2))
+    return 0
+
+
+def _bench(args) -> int:
+    classifier = _loaded(args)
+    if classifier is None:
+        return 1
+    titles, _ = load_examples(args.data, args.label_field)
+    titles = (titles * (args.n // max(1, len(titles)) + 1))[:args.n]
+    if not titles:
+        print("No titles to benchmark with", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    for title in titles:
+        classifier.classify(title)
+    single = (time.perf_counter() - start) / len(titles)
+
+    start = time.perf_counter()
+    classifier.classify_many(titles)
+    batch = (time.perf_counter() - start) / len(titles)
+
+    print(json.dumps({
+        "titles": len(titles),
+        "single_us_per_title": round(single * 1e6, 1),
+        "batch_us_per_title": round(batch * 1e6, 1),
+        "answered_locally": round(classifier.local / (classifier.local + classifier.deferred), 4),
+    }, indent=2))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m services.task_type_classifier", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model-dir", default=_config.TASK_TYPE_MODEL_DIR, help="default: TASK_TYPE_MODEL_DIR")
+    parser.add_argument("--threshold", type=float, default=_config.TASK_TYPE_CONFIDENCE, help="default: TASK_TYPE_CONFIDENCE")
+    parser.add_argument("--label-field", default="taskType")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="fit a model on exported tasks and save it as a new version")
+    train.add_argument("data")
+    train.add_argument("--test-size", type=float, default=0.2, help="share held out for the report; 0 skips it")
+    train.add_argument("--dry-run", action="store_true", help="report only, do not save")
+    train.set_defaults(run=_train)
+
+    for name, run, help_text in (
+        ("eval", _eval, "accuracy and coverage of a saved model on labelled tasks"),
+        ("bench", _bench, "prediction latency of a saved model"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("data")
+        command.add_argument("--version", help="model version; default the newest")
+        if name == "bench":
+            command.add_argument("-n", type=int, default=10000, help="titles to classify")
+        command.set_defaults(run=run)
+
+    args = parser.parse_args(argv)
+    if args.command == "train" and not args.model_dir and not args.dry_run:
+        parser.error("set TASK_TYPE_MODEL_DIR or pass --model-dir")
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
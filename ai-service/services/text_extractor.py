@@ -1,14 +1,21 @@
 import asyncio
 import logging
 import os
-from typing import Dict, Any, List
-from PIL import Image
+from typing import Dict, Any, List, Optional
 import pytesseract
-import PyPDF2
-import io
+
+from config import get_config
+from . import document_parsing
+from .ocr_engine import ocr_engine
+from .extraction_cache import ExtractedText, extraction_cache
 
 logger = logging.getLogger(__name__)
 
+def _read_bytes(file_path: str) -> bytes:
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
 class TextExtractorService:
     def __init__(self):
         self.supported_image_types = [
@@ -19,6 +26,9 @@ class TextExtractorService:
             'application/pdf', 'text/plain'
         ]
         
+        # PDFs stop being read once this much text has been extracted
+        self.max_pdf_chars = get_config().PDF_EXTRACT_MAX_CHARS
+
         # Configure Tesseract if available
         self.tesseract_available = self._check_tesseract_availability()
     
@@ -31,8 +41,12 @@ class TextExtractorService:
             logger.warning(f"Tesseract not available: {str(e)}")
             return False
     
-    async def extract(self, file_path: str, mime_type: str) -> Dict[str, Any]:
-        """Extract text from file based on mime type"""
+    async def extract(self, file_path: str, mime_type: str, max_chars: Optional[int] = None) -> Dict[str, Any]:
+        """Extract text from file based on mime type.
+
+        PDFs are read page by page and stop at `max_chars` (PDF_EXTRACT_MAX_CHARS by
+        default); the result then reports `pages_included`, `page_count` and `truncated`.
+        """
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
@@ -40,7 +54,7 @@ class TextExtractorService:
             if mime_type in self.supported_image_types:
                 return await self._extract_from_image(file_path)
             elif mime_type in self.supported_document_types:
-                return await self._extract_from_document(file_path, mime_type)
+                return await self._extract_from_document(file_path, mime_type, max_chars)
             else:
                 return {
                     'extracted_text': f'Unsupported file type: {mime_type}',
@@ -64,39 +78,25 @@ class TextExtractorService:
         
         try:
             loop = asyncio.get_event_loop()
-            
-            def _ocr_extract():
-                # Open and preprocess image
-                image = Image.open(file_path)
-                
-                # Convert to RGB if necessary
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # Extract text using Tesseract
-                extracted_text = pytesseract.image_to_string(
-                    image,
-                    config='--psm 6'  # Assume uniform block of text
-                )
-                
-                # Get confidence data
-                data = pytesseract.image_to_data(
-                    image, 
-                    output_type=pytesseract.Output.DICT,
-                    config='--psm 6'
-                )
-                
-                # Calculate average confidence
-                confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-                avg_confidence = sum(confidences) / len(confidences) if confidences else 0
-                
-                return extracted_text.strip(), avg_confidence / 100.0
-            
-            text, confidence = await loop.run_in_executor(None, _ocr_extract)
-            
+            data = await loop.run_in_executor(None, _read_bytes, file_path)
+
+            digest = extraction_cache.digest(data)
+            cached = extraction_cache.get("ocr", digest)
+            if cached is not None:
+                return {
+                    'extracted_text': cached.text if cached.text else 'No text found in image',
+                    'confidence': cached.confidence,
+                    'timings_ms': {'total': 0.0, 'cached': True}
+                }
+
+            # One Tesseract pass on a normalized image, in the dedicated OCR pool
+            result = await ocr_engine.recognize(data)
+            extraction_cache.put("ocr", digest, ExtractedText(text=result['text'], confidence=result['confidence']))
+
             return {
-                'extracted_text': text if text else 'No text found in image',
-                'confidence': confidence
+                'extracted_text': result['text'] if result['text'] else 'No text found in image',
+                'confidence': result['confidence'],
+                'timings_ms': result['timings_ms']
             }
             
         except Exception as e:
@@ -106,11 +106,11 @@ class TextExtractorService:
                 'confidence': 0.0
             }
     
-    async def _extract_from_document(self, file_path: str, mime_type: str) -> Dict[str, Any]:
+    async def _extract_from_document(self, file_path: str, mime_type: str, max_chars: Optional[int] = None) -> Dict[str, Any]:
         """Extract text from document files"""
         try:
             if mime_type == 'application/pdf':
-                return await self._extract_from_pdf(file_path)
+                return await self._extract_from_pdf(file_path, max_chars)
             elif mime_type == 'text/plain':
                 return await self._extract_from_text(file_path)
             else:
@@ -126,36 +126,31 @@ class TextExtractorService:
                 'confidence': 0.0
             }
     
-    async def _extract_from_pdf(self, file_path: str) -> Dict[str, Any]:
+    async def _extract_from_pdf(self, file_path: str, max_chars: Optional[int] = None) -> Dict[str, Any]:
         """Extract text from PDF file"""
         try:
             loop = asyncio.get_event_loop()
-            
-            def _pdf_extract():
-                text_content = []
-                
-                with open(file_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        try:
-                            page_text = page.extract_text()
-                            if page_text.strip():
-                                text_content.append(page_text)
-                        except Exception as e:
-                            logger.warning(f"Error extracting page {page_num}: {str(e)}")
-                            continue
-                
-                return '\n\n'.join(text_content)
-            
-            extracted_text = await loop.run_in_executor(None, _pdf_extract)
+            data = await loop.run_in_executor(None, _read_bytes, file_path)
+
+            # Parsed in the CPU pool, and cached by content so a PDF already seen in
+            # chat is not parsed again
+            extracted = await document_parsing.extract("pdf", data, max_chars or self.max_pdf_chars)
+            # Pages end in the "\n" document_parsing adds, except a page cut by max_chars
+            text_content = [
+                page[:-1] if page.endswith("\n") else page
+                for page in extracted.pages() if page.strip()
+            ]
+            extracted_text = '\n\n'.join(text_content)
             
             # Calculate confidence based on text quality
             confidence = self._calculate_text_confidence(extracted_text)
             
             return {
                 'extracted_text': extracted_text if extracted_text.strip() else 'No text found in PDF',
-                'confidence': confidence
+                'confidence': confidence,
+                'page_count': extracted.page_count,
+                'pages_included': extracted.pages_included,
+                'truncated': extracted.truncated
             }
             
         except Exception as e:
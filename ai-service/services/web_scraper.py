@@ -1,14 +1,18 @@
 import logging
 import os
 import aiohttp
-from bs4 import BeautifulSoup
-from typing import Dict, Optional, List
+from typing import AsyncIterator, Dict, Optional, List, Tuple
 import asyncio
+from contextlib import asynccontextmanager
 from urllib.parse import urlparse
-import re
-from playwright.async_api import async_playwright
 # playwright_stealth imported lazily inside method to handle version differences
-import subprocess
+
+from config import get_config
+from .browser_pool import browser_pool
+from .cpu_pool import cpu_pool
+from .html_extractor import extract as extract_html
+from .scrape_cache import ScrapeEntry, scrape_cache
+from .scrape_router import DEEP, FAST, SPA_SNIFF_BYTES, has_noscript_notice, looks_like_spa_shell, scrape_router
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +21,12 @@ class WebScraperError(Exception):
     pass
 
 class WebScraper:
-    """Service for extracting content from websites with JS support"""
+    """Service for extracting content from websites with JS support
+
+    Scrapes run concurrently, up to SCRAPE_CONCURRENCY at once and at most
+    SCRAPE_PER_HOST_CONCURRENCY against the same host. Deep (browser) scrapes are
+    further limited by the browser pool to BROWSER_MAX_CONTEXTS.
+    """
     
     def __init__(self):
         self.timeout = aiohttp.ClientTimeout(total=45) 
@@ -27,17 +36,55 @@ class WebScraper:
             'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
         ]
-        
+        config = get_config()
+        self.max_download_bytes = config.SCRAPE_MAX_BYTES
+        self.per_host_limit = max(1, config.SCRAPE_PER_HOST_CONCURRENCY)
+        self._slots = asyncio.Semaphore(max(1, config.SCRAPE_CONCURRENCY))
+        # host -> (semaphore, scrapes holding or waiting for it); dropped when unused
+        self._host_slots: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+
+    @asynccontextmanager
+    async def _host_slot(self, host: str):
+        semaphore, users = self._host_slots.get(host) or (asyncio.Semaphore(self.per_host_limit), 0)
+        self._host_slots[host] = (semaphore, users + 1)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            semaphore, users = self._host_slots[host]
+            if users > 1:
+                self._host_slots[host] = (semaphore, users - 1)
+            else:
+                del self._host_slots[host]
+
     async def scrape_url(self, url: str) -> Dict[str, any]:
         """
         Scrape content from a URL. Tries fast method first, falls back to browser if needed.
+        Hosts where only the browser works go straight to it (see scrape_router).
+        `unchanged` is true when the page is the same as at its last scrape and the
+        cached extraction was returned.
         """
+        host = (urlparse(url).hostname or '').lower()
+        async with self._host_slot(host), self._slots:
+            return await self._scrape(url)
+
+    async def _scrape(self, url: str) -> Dict[str, any]:
         try:
             # Validate URL
             parsed = urlparse(url)
             if not parsed.scheme or not parsed.netloc:
                 raise WebScraperError(f"Invalid URL: {url}")
             
+            host = parsed.hostname.lower()
+            if scrape_router.route(host) == DEEP:
+                scrape_router.routed += 1
+                logger.info(f"🧭 {host} is known to need a browser. Going straight to Deep Scrape...")
+                result = await self._scrape_with_playwright(url)
+                if not result.get('success'):
+                    # Maybe the site changed; probe both methods next time
+                    scrape_router.forget(host)
+                return result
+
             logger.info(f"🚀 Attempting fast scrape: {url}")
             
             # 1. Try Fast Scrape (aiohttp)
@@ -49,14 +96,14 @@ class WebScraper:
             # - Content is very short (likely skeleton/SPA)
             # - Common "blocked" markers found
             
-            content_len = len(fast_result.get('content', '') or '')
-            is_suspiciously_short = content_len < 1000 
-            is_blocked = any(m in (fast_result.get('content', '') or '').lower() for m in ['enable javascript', 'access denied', 'please wait...', 'checking your browser'])
-            
-            if not fast_result.get('success') or is_suspiciously_short or is_blocked:
-                logger.info(f"🕵️ Fast scrape insufficient (len={content_len}, blocked={is_blocked}). Switching to Deep Scrape (Playwright)...")
-                return await self._scrape_with_playwright(url)
+            if self._needs_deep_scrape(fast_result):
+                logger.info(f"🕵️ Fast scrape insufficient (len={len(fast_result.get('content', '') or '')}). Switching to Deep Scrape (Playwright)...")
+                deep_result = await self._scrape_with_playwright(url)
+                if deep_result.get('success') and not self._needs_deep_scrape(deep_result):
+                    scrape_router.record(host, DEEP)
+                return deep_result
             
+            scrape_router.record(host, FAST)
             return fast_result
 
         except Exception as e:
@@ -66,11 +113,60 @@ class WebScraper:
                 'content': None,
                 'title': None,
                 'metadata': None,
+                'unchanged': False,
                 'error': str(e)
             }
 
+    @staticmethod
+    def _needs_deep_scrape(fast_result: Dict[str, any]) -> bool:
+        content_len = len(fast_result.get('content', '') or '')
+        is_suspiciously_short = content_len < 1000 
+        is_blocked = any(m in (fast_result.get('content', '') or '').lower() for m in ['enable javascript', 'access denied', 'please wait...', 'checking your browser'])
+        return not fast_result.get('success') or is_suspiciously_short or is_blocked
+
+    @staticmethod
+    def _fast_result(url: str, title: str, content: str, content_hash: str, unchanged: bool) -> Dict[str, any]:
+        return {
+            'success': True,
+            'content': content,
+            'title': title,
+            'metadata': {
+                'method': 'fast',
+                'url': url,
+                'content_length': len(content),
+                'content_hash': content_hash
+            },
+            'unchanged': unchanged,
+            'error': None
+        }
+
+    @staticmethod
+    async def _read_head(response: aiohttp.ClientResponse) -> bytes:
+        """The first SPA_SNIFF_BYTES of the response body (less if it is shorter)."""
+        head = b''
+        while len(head) < SPA_SNIFF_BYTES:
+            chunk = await response.content.read(SPA_SNIFF_BYTES - len(head))
+            if not chunk:
+                break
+            head += chunk
+        return head
+
+    async def _read_capped(self, response: aiohttp.ClientResponse, head: bytes = b'') -> bytes:
+        """The response body, cut off at SCRAPE_MAX_BYTES. `head` is what was already read."""
+        chunks = [head]
+        size = len(head)
+        if size >= self.max_download_bytes:
+            return head[:self.max_download_bytes]
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_download_bytes:
+                logger.info(f"✂️ Stopped reading {response.url} at {size} bytes")
+                break
+        return b''.join(chunks)[:self.max_download_bytes]
+
     async def _scrape_fast(self, url: str) -> Dict[str, any]:
-        """Fast scrape using aiohttp and BeautifulSoup"""
+        """Fast scrape using aiohttp and the lxml extractor, revalidating against the scrape cache"""
         try:
             async with aiohttp.ClientSession(timeout=self.timeout) as session:
                 headers = {
@@ -78,58 +174,60 @@ class WebScraper:
                     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
                     'Accept-Language': 'en-US,en;q=0.5',
                 }
+                cached = scrape_cache.get(url)
+                if cached is not None:
+                    headers.update(cached.conditional_headers())
                 
                 async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and cached is not None:
+                        scrape_cache.not_modified += 1
+                        logger.info(f"♻️ Not modified since last scrape: {url}")
+                        return self._fast_result(url, cached.title, cached.content, cached.content_hash, True)
+
                     if response.status != 200:
                         return {'success': False, 'error': f"HTTP {response.status}"}
                     
-                    html = await response.text()
-                    soup = BeautifulSoup(html, 'html.parser')
-                    
-                    title = self._extract_title(soup)
-                    content = self._extract_content(soup)
-                    
-                    return {
-                        'success': True,
-                        'content': content,
-                        'title': title,
-                        'metadata': {
-                            'method': 'fast',
-                            'url': url,
-                            'content_length': len(content)
-                        },
-                        'error': None
-                    }
+                    # Sniff the start of the page before downloading the rest
+                    head = await self._read_head(response)
+                    if looks_like_spa_shell(head):
+                        scrape_router.spa_shells += 1
+                        return {'success': False, 'error': "Page is a client-rendered app shell"}
+                    html = await self._read_capped(response, head)
+
+                    content_hash = scrape_cache.digest(html)
+                    if cached is not None and cached.content_hash == content_hash:
+                        scrape_cache.same_content += 1
+                        logger.info(f"♻️ Page unchanged since last scrape: {url}")
+                        return self._fast_result(url, cached.title, cached.content, content_hash, True)
+
+                    title, content = await cpu_pool.run(
+                        extract_html, html, self.max_content_length, response.charset
+                    )
+                    result = self._fast_result(url, title, content, content_hash, False)
+                    if has_noscript_notice(head) and self._needs_deep_scrape(result):
+                        # The JavaScript notice was not decoration after all
+                        scrape_router.spa_shells += 1
+
+                    if cached is not None:
+                        scrape_cache.changed += 1
+                    if not self._needs_deep_scrape(result):
+                        scrape_cache.put(url, ScrapeEntry(
+                            title=title,
+                            content=content,
+                            content_hash=content_hash,
+                            etag=response.headers.get('ETag'),
+                            last_modified=response.headers.get('Last-Modified'),
+                        ))
+                    return result
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
     async def _scrape_with_playwright(self, url: str) -> Dict[str, any]:
         """Deep scrape using headless browser (Playwright) to handle JS and anti-bot"""
         
-        # In a Native Python environment (like Render), Playwright needs to install the browser
-        # into its default user cache. By running the install command here dynamically,
-        # we bypass the need for root permissions or complex Dockerfile modifications.
-        try:
-            # We don't overwrite environment variables here; we let Playwright use its defaults.
-            # Running this command is practically instant if already installed.
-            subprocess.run(
-                ["playwright", "install", "chromium"], 
-                check=True, 
-                stdout=subprocess.DEVNULL, 
-                stderr=subprocess.DEVNULL
-            )
-        except Exception as e:
-            logger.error(f"⚠️ Runtime Playwright update warning: {e}")
-
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(
-                user_agent=self.user_agents[0],
-                viewport={'width': 1280, 'height': 800}
-            )
-            
+        # The browser is shared and long-lived; only a page is leased per scrape.
+        async with browser_pool.page(user_agent=self.user_agents[0]) as page:
             # Apply stealth to avoid bot detection (if the package supports it)
-            page = await context.new_page()
             try:
                 from playwright_stealth import stealth_async as _stealth_async
                 await _stealth_async(page)
@@ -158,8 +256,9 @@ class WebScraper:
                 title = await page.title()
                 
                 # Use BS4 on the rendered HTML for better cleaning
-                soup = BeautifulSoup(html, 'html.parser')
-                content = self._extract_content(soup)
+                _, content = await cpu_pool.run(
+                    extract_html, html.encode('utf-8'), self.max_content_length, 'utf-8'
+                )
                 
                 logger.info(f"✅ Deep scrape successful: {len(content)} chars")
                 
@@ -180,54 +279,27 @@ class WebScraper:
                     'success': False,
                     'error': f"Browser scraping failed: {str(e)}"
                 }
-            finally:
-                await browser.close()
-
-    def _extract_title(self, soup: BeautifulSoup) -> str:
-        if soup.title and soup.title.string:
-            return soup.title.string.strip()
-        return "Untitled"
-
-    def _extract_content(self, soup: BeautifulSoup) -> str:
-        """Extract main content from the page, cleaning up noise"""
-        # Remove noisy elements
-        for element in soup(['script', 'style', 'nav', 'header', 'footer', 
-                           'aside', 'iframe', 'noscript', 'svg', 'form']):
-            element.decompose()
-        
-        # Priority content areas
-        main_content = None
-        for selector in ['main', 'article', '[role="main"]', '.content', '#content', '.post-content']:
-            main_content = soup.select_one(selector)
-            if main_content: break
-            
-        if not main_content:
-            main_content = soup.body if soup.body else soup
-            
-        # Extract text with separator to preserve block structure
-        text = main_content.get_text(separator='\n', strip=True)
-        
-        # Cleanup
-        text = re.sub(r'\n{3,}', '\n\n', text) # Normalize newlines
-        text = re.sub(r' +', ' ', text) # Normalize spaces
-        
-        # Deduplication of lines (common in scraped menus/footers that slipped through)
-        lines = text.split('\n')
-        unique_lines = []
-        seen = set()
-        for line in lines:
-            trimmed = line.strip()
-            if not trimmed: continue
-            if trimmed not in seen:
-                unique_lines.append(trimmed)
-                seen.add(trimmed)
-        
-        final_text = '\n'.join(unique_lines)
-        return final_text[:self.max_content_length]
+
+    async def _scrape_tagged(self, url: str) -> Tuple[str, Dict[str, any]]:
+        return url, await self.scrape_url(url)
+
+    async def scrape_each(self, urls: List[str]) -> AsyncIterator[Tuple[str, Dict[str, any]]]:
+        """Scrape all URLs concurrently, yielding (url, result) as each one finishes.
+
+        Duplicate URLs are scraped once. Scrapes still running when the caller stops
+        iterating (say the client disconnected) are cancelled.
+        """
+        tasks = [asyncio.ensure_future(self._scrape_tagged(url)) for url in dict.fromkeys(urls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def scrape_multiple(self, urls: List[str]) -> Dict[str, Dict]:
         results = {}
-        for url in urls:
-            results[url] = await self.scrape_url(url)
+        async for url, result in self.scrape_each(urls):
+            results[url] = result
         return results
 
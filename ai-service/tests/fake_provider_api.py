@@ -0,0 +1,189 @@
+"""A local stand-in for the parts of the Gemini and Anthropic APIs that prompt caching uses.
+
+Gemini: cachedContents create and delete, and generateContent /
+streamGenerateContent with or without a cachedContent. An entry can only be used or
+deleted with the key that created it, and is gone once its ttl passes or drop() is
+called, answering 404 like the real API.
+
+Anthropic: /v1/messages. System blocks marked with cache_control are cached for five
+minutes from their last use, and the usage block reports cache writes, cache reads
+and uncached input tokens.
+
+Token counts are estimated as characters / 4. Run it on its own to point a local
+ai-service at it:
+
+    python tests/fake_provider_api.py --port 8099
+    GEMINI_API_BASE_URL=http://127.0.0.1:8099/v1beta ANTHROPIC_BASE_URL=http://127.0.0.1:8099
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+ANTHROPIC_CACHE_SECONDS = 300
+
+
+def _tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+class FakeProviderAPI:
+    def __init__(self, gemini_min_tokens: int = 0, anthropic_min_tokens: int = 0):
+        self.gemini_min_tokens = gemini_min_tokens
+        self.anthropic_min_tokens = anthropic_min_tokens
+        self.clock = time.monotonic
+        self.cached_contents: Dict[str, Dict[str, Any]] = {}
+        self.anthropic_cache: Dict[str, float] = {}
+        self.requests: List[Dict[str, Any]] = []
+        self.quota_exhausted: set = set()  # keys answered with 429
+        self._ids = itertools.count(1)
+
+        self.app = web.Application()
+        self.app.router.add_post("/v1beta/cachedContents", self.create_cached_content)
+        self.app.router.add_delete("/v1beta/cachedContents/{id}", self.delete_cached_content)
+        self.app.router.add_post("/v1beta/models/{target}", self.generate_content)
+        self.app.router.add_post("/v1/messages", self.messages)
+
+    # --- helpers --------------------------------------------------------------
+
+    def drop(self, name: str) -> None:
+        """Forget a cachedContents entry, as if it expired early."""
+        self.cached_contents.pop(name, None)
+
+    def calls(self, kind: str) -> List[Dict[str, Any]]:
+        return [request for request in self.requests if request["kind"] == kind]
+
+    @staticmethod
+    def _error(status: int, message: str, reason: str) -> web.Response:
+        return web.json_response({"error": {"code": status, "message": message, "status": reason}}, status=status)
+
+    @staticmethod
+    def _gemini_key(request: web.Request) -> str:
+        return request.headers.get("X-goog-api-key") or request.query.get("key", "")
+
+    def _live_entry(self, name: str, api_key: str) -> Optional[Dict[str, Any]]:
+        entry = self.cached_contents.get(name)
+        if entry is None or entry["expires_at"] <= self.clock():
+            self.cached_contents.pop(name, None)
+            return None
+        return entry if entry["api_key"] == api_key else None
+
+    # --- Gemini ---------------------------------------------------------------
+
+    async def create_cached_content(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        api_key = self._gemini_key(request)
+        text = "".join(part.get("text", "") for part in body["systemInstruction"]["parts"])
+        self.requests.append({"kind": "create", "api_key": api_key, "text": text})
+        if _tokens(text) < self.gemini_min_tokens:
+            return self._error(400, f"Cached content is too small. total_token_count={_tokens(text)}", "INVALID_ARGUMENT")
+
+        name = f"cachedContents/fake{next(self._ids)}"
+        ttl = float(body.get("ttl", "3600s").rstrip("s"))
+        self.cached_contents[name] = {"text": text, "api_key": api_key, "expires_at": self.clock() + ttl}
+        return web.json_response({"name": name, "model": body["model"], "usageMetadata": {"totalTokenCount": _tokens(text)}})
+
+    async def delete_cached_content(self, request: web.Request) -> web.Response:
+        name = f"cachedContents/{request.match_info['id']}"
+        api_key = self._gemini_key(request)
+        self.requests.append({"kind": "delete", "api_key": api_key, "name": name})
+        if self._live_entry(name, api_key) is None:
+            return self._error(404, "CachedContent not found (or permission denied)", "NOT_FOUND")
+        del self.cached_contents[name]
+        return web.json_response({})
+
+    async def generate_content(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        api_key = self._gemini_key(request)
+        name = body.get("cachedContent")
+        self.requests.append({"kind": "generate", "api_key": api_key, "cached_content": name, "body": body})
+
+        if api_key in self.quota_exhausted:
+            return self._error(429, "Resource has been exhausted (e.g. check quota).", "RESOURCE_EXHAUSTED")
+
+        cached_tokens = 0
+        if name:
+            if body.get("systemInstruction"):
+                return self._error(400, "CachedContent can not be used with system_instruction", "INVALID_ARGUMENT")
+            entry = self._live_entry(name, api_key)
+            if entry is None:
+                return self._error(404, "CachedContent not found (or permission denied)", "NOT_FOUND")
+            cached_tokens = _tokens(entry["text"])
+
+        text = json.dumps(body.get("contents", []))
+        text += json.dumps(body.get("systemInstruction") or {})
+        usage = {
+            "promptTokenCount": cached_tokens + _tokens(text),
+            "cachedContentTokenCount": cached_tokens,
+            "candidatesTokenCount": 2,
+        }
+        candidate = {"content": {"role": "model", "parts": [{"text": "OK"}]}, "finishReason": "STOP"}
+        reply = {"candidates": [candidate], "usageMetadata": usage}
+
+        if request.match_info["target"].endswith(":streamGenerateContent"):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            await response.write(f"data: {json.dumps(reply)}\r\n\r\n".encode())
+            await response.write_eof()
+            return response
+        return web.json_response(reply)
+
+    # --- Anthropic ------------------------------------------------------------
+
+    async def messages(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.requests.append({"kind": "messages", "api_key": request.headers.get("x-api-key", ""), "body": body})
+
+        system = body.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+
+        now = self.clock()
+        written = read = 0
+        prefix = ""
+        cached_upto = 0  # tokens of the system prompt covered by a cache hit or write
+        for block in system:
+            prefix += block.get("text", "")
+            if not block.get("cache_control") or _tokens(prefix) < self.anthropic_min_tokens:
+                continue
+            key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+            if self.anthropic_cache.get(key, 0) > now:
+                read = _tokens(prefix)
+                written = 0
+            else:
+                written = _tokens(prefix) - read
+            self.anthropic_cache[key] = now + ANTHROPIC_CACHE_SECONDS
+            cached_upto = _tokens(prefix)
+
+        uncached = _tokens("".join(block.get("text", "") for block in system)) - cached_upto
+        uncached += _tokens(json.dumps(body.get("messages", [])))
+        return web.json_response({
+            "id": f"msg_fake{next(self._ids)}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "claude"),
+            "content": [{"type": "text", "text": "OK"}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": uncached,
+                "output_tokens": 1,
+                "cache_creation_input_tokens": written,
+                "cache_read_input_tokens": read,
+            },
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--gemini-min-tokens", type=int, default=1024)
+    parser.add_argument("--anthropic-min-tokens", type=int, default=1024)
+    args = parser.parse_args()
+    api = FakeProviderAPI(args.gemini_min_tokens, args.anthropic_min_tokens)
+    web.run_app(api.app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import pytest
+
+from services.content_generator import ContentGenerator, ContentGeneratorError
+from services.response_cache import response_cache
+
+SOCIAL_MARKER = "SOCIAL MEDIA POST task"
+DESCRIPTION = (
+    "Launch the spring campaign across our channels to build awareness. "
+    "It introduces the new range to existing customers and new audiences alike."
+)
+GOALS = [
+    "Reach ten thousand people in the target market within the first month",
+    "Gain five hundred new followers across the brand accounts by the end of the quarter",
+]
+
+
+def _generator(monkeypatch, flags):
+    generator = ContentGenerator("test-key", provider="gemini")
+
+    async def fake_request(prompt, system_prompt, json_mode=False, cacheable_chars=0):
+        flags.append(SOCIAL_MARKER in system_prompt)
+        if json_mode:
+            return json.dumps({
+                "description": DESCRIPTION,
+                "goals": GOALS,
+                "priority": 3,
+            })
+        if "priority level" in prompt:
+            return "3"
+        if "goals" in prompt.split("\n", 1)[0]:
+            return "\n".join(f"• {goal}" for goal in GOALS)
+        return DESCRIPTION
+
+    monkeypatch.setattr(generator, "_make_gemini_request", fake_request)
+    return generator
+
+
+@pytest.mark.parametrize("title, expected", [
+    ("Instagram reel for the spring launch", True),
+    ("Quarterly budget review", False),
+])
+def test_social_media_flag_is_the_same_in_every_mode(monkeypatch, title, expected):
+    by_mode = {}
+    for mode in ContentGenerator.GENERATION_MODES:
+        flags = []
+        generator = _generator(monkeypatch, flags)
+        asyncio.run(generator.generate_task_content(title, mode))
+        assert flags, mode
+        by_mode[mode] = set(flags)
+
+    assert all(flags == {expected} for flags in by_mode.values()), by_mode
+
+
+def test_a_rejected_reply_is_not_replayed_from_the_response_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "enabled", True)
+    response_cache.clear()
+    generator = ContentGenerator("test-key", provider="gemini", cache_namespace="generate-content")
+    replies = iter(["Too short.", DESCRIPTION])
+
+    async def fake_request(prompt, system_prompt, json_mode=False, cacheable_chars=0):
+        return next(replies)
+
+    monkeypatch.setattr(generator, "_make_gemini_request", fake_request)
+
+    with pytest.raises(ContentGeneratorError):
+        asyncio.run(generator.generate_description("Quarterly budget review"))
+    assert asyncio.run(generator.generate_description("Quarterly budget review")) == DESCRIPTION
+    # The good reply was cached and is served without another provider call
+    assert asyncio.run(generator.generate_description("Quarterly budget review")) == DESCRIPTION
+    response_cache.clear()
@@ -0,0 +1,45 @@
+import asyncio
+
+from services.knowledge_index import KnowledgeIndex
+
+
+def _index():
+    return KnowledgeIndex(context_chars=2000, chunk_chars=400, top_k=4, embedding_model="", max_bytes=1024 * 1024)
+
+
+def test_empty_source_next_to_an_over_budget_source():
+    long_content = "\n".join(f"Line {i} about pricing plans and onboarding for new customers." for i in range(500))
+    sources = [
+        {"name": "Website", "content": long_content},
+        {"name": "Description only", "description": "A competitor we track", "content": ""},
+    ]
+
+    excerpts = asyncio.run(_index().retrieve(sources, "pricing plans"))
+
+    assert len(excerpts) == 2
+    assert excerpts[0] and "pricing" in excerpts[0]
+    assert len(excerpts[0]) <= 2000 + 3 * 4
+    assert excerpts[1] is None
+
+
+def test_small_sources_pass_through_whole():
+    sources = [{"content": "  Short note.  "}, {"content": None}]
+
+    assert asyncio.run(_index().retrieve(sources, "note")) == ["Short note.", None]
+
+
+def test_versions_identify_the_excerpts():
+    index = _index()
+    long_content = "\n".join(f"Line {i} about pricing plans and onboarding for new customers." for i in range(500))
+    sources = [{"content": long_content}, {"content": ""}]
+
+    excerpts, versions = asyncio.run(index.retrieve_versioned(sources, "pricing plans"))
+    again, same = asyncio.run(index.retrieve_versioned(sources, "pricing plans"))
+    _, other = asyncio.run(index.retrieve_versioned(sources, "line 499"))
+
+    assert again == excerpts and same == versions
+    assert versions[1] is None and other[0] != versions[0]
+    assert versions[0].startswith(index._key(long_content))
+
+    small = [{"content": "Short note."}]
+    assert asyncio.run(index.retrieve_versioned(small, "note")) == (["Short note."], [index._key("Short note.")])
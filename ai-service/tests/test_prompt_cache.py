@@ -0,0 +1,169 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestServer
+
+from services import anthropic_client, chat_service, content_generator, http_transport
+from services import prompt_cache as prompt_cache_module
+from services.chat_service import ChatService
+from services.content_generator import ContentGenerator
+from services.prompt_cache import PromptCache
+
+from fake_provider_api import FakeProviderAPI
+
+PREFIX = "You write marketing copy for Acme. " * 20
+SYSTEM_PROMPT = PREFIX + "Today is Monday."
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = PromptCache(gemini_ttl=900, gemini_min_tokens=10, max_entries=8)
+    for module in (content_generator, chat_service, anthropic_client):
+        monkeypatch.setattr(module, "prompt_cache", cache)
+    return cache
+
+
+def _run(api, scenario):
+    """Serve the stand-in and run `scenario(base_url)` against it."""
+    async def main():
+        server = TestServer(api.app)
+        await server.start_server()
+        try:
+            return await scenario(str(server.make_url("")).rstrip("/"))
+        finally:
+            await http_transport.close()
+            await server.close()
+    return asyncio.run(main())
+
+
+def _generator(base_url, api_key="key-a"):
+    generator = ContentGenerator(api_key, provider="gemini")
+    generator.base_url = f"{base_url}/v1beta"
+    return generator
+
+
+def test_gemini_prefix_is_created_once_then_reused(cache):
+    api = FakeProviderAPI()
+
+    async def scenario(base_url):
+        generator = _generator(base_url)
+        for _ in range(2):
+            assert await generator._make_gemini_request("Write a post", SYSTEM_PROMPT, cacheable_chars=len(PREFIX)) == "OK"
+
+    _run(api, scenario)
+
+    assert len(api.calls("create")) == 1
+    assert api.calls("create")[0]["text"] == PREFIX
+    names = {call["cached_content"] for call in api.calls("generate")}
+    assert len(names) == 1 and None not in names
+    stats = cache.get_stats()["gemini"]
+    assert (stats["created"], stats["hits"]) == (1, 1)
+    assert stats["cached_tokens"] > 0
+
+
+def test_gemini_prefix_is_recreated_after_its_ttl(cache, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(prompt_cache_module, "time", clock)
+    api = FakeProviderAPI()
+    api.clock = clock.monotonic
+
+    async def scenario(base_url):
+        generator = _generator(base_url)
+        await generator._make_gemini_request("Write a post", SYSTEM_PROMPT, cacheable_chars=len(PREFIX))
+        clock.now += cache.gemini_ttl
+        await generator._make_gemini_request("Write a post", SYSTEM_PROMPT, cacheable_chars=len(PREFIX))
+
+    _run(api, scenario)
+
+    assert len(api.calls("create")) == 2
+    first, second = (call["cached_content"] for call in api.calls("generate"))
+    assert first != second
+
+
+def test_gemini_prefix_that_is_gone_is_invalidated_and_resent(cache):
+    api = FakeProviderAPI()
+
+    async def scenario(base_url):
+        generator = _generator(base_url)
+        await generator._make_gemini_request("Write a post", SYSTEM_PROMPT, cacheable_chars=len(PREFIX))
+        api.drop(api.calls("generate")[0]["cached_content"])
+        assert await generator._make_gemini_request("Write a post", SYSTEM_PROMPT, cacheable_chars=len(PREFIX)) == "OK"
+        await generator._make_gemini_request("Write a post", SYSTEM_PROMPT, cacheable_chars=len(PREFIX))
+
+    _run(api, scenario)
+
+    first, gone, resent, recreated = api.calls("generate")
+    assert gone["cached_content"] == first["cached_content"]
+    assert resent["cached_content"] is None
+    assert PREFIX in resent["body"]["contents"][0]["parts"][0]["text"]
+    assert recreated["cached_content"] not in (None, first["cached_content"])
+    assert cache.get_stats()["gemini"]["invalidated"] == 1
+
+
+def test_evicted_gemini_prefix_is_deleted_remotely(cache, monkeypatch):
+    small = PromptCache(gemini_ttl=900, gemini_min_tokens=10, max_entries=1)
+    monkeypatch.setattr(content_generator, "prompt_cache", small)
+    api = FakeProviderAPI()
+
+    async def scenario(base_url):
+        generator = _generator(base_url)
+        await generator._make_gemini_request("Write a post", SYSTEM_PROMPT, cacheable_chars=len(PREFIX))
+        other = "You write release notes for Acme. " * 20
+        await generator._make_gemini_request("Write a post", other + "Today is Monday.", cacheable_chars=len(other))
+        await asyncio.gather(*small._deleting)
+
+    _run(api, scenario)
+
+    first_name = api.calls("generate")[0]["cached_content"]
+    assert [call["name"] for call in api.calls("delete")] == [first_name]
+    assert first_name not in api.cached_contents
+    assert small.get_stats()["gemini"]["deleted"] == 1
+
+
+def test_chat_does_not_send_the_previous_keys_cached_content_after_rotation(cache):
+    api = FakeProviderAPI()
+    api.quota_exhausted.add("key-a")
+
+    async def scenario(base_url):
+        service = ChatService(["key-a", "key-b"])
+        service.base_url = f"{base_url}/v1beta"
+        return await service._generate_via_rest("Hello", SYSTEM_PROMPT, "", [], cacheable_chars=len(PREFIX))
+
+    assert _run(api, scenario) == "OK"
+
+    owners = {name: entry["api_key"] for name, entry in api.cached_contents.items()}
+    for call in api.calls("generate"):
+        assert call["cached_content"] is None or owners[call["cached_content"]] == call["api_key"]
+    assert [call["api_key"] for call in api.calls("generate")] == ["key-a", "key-b"]
+
+
+def test_anthropic_prefix_is_written_then_read(cache, monkeypatch):
+    api = FakeProviderAPI()
+
+    async def scenario(base_url):
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", base_url)
+        for _ in range(2):
+            reply = await anthropic_client.generate(
+                "anthropic-test-key", "Write a post", SYSTEM_PROMPT, model="claude-test", cacheable_chars=len(PREFIX)
+            )
+            assert reply == "OK"
+        for entry in list(anthropic_client._clients.values()):
+            await entry.client.close()
+        anthropic_client._clients.clear()
+
+    _run(api, scenario)
+
+    system = api.calls("messages")[0]["body"]["system"]
+    assert system[0] == {"type": "text", "text": PREFIX, "cache_control": {"type": "ephemeral"}}
+    stats = cache.get_stats()["anthropic"]
+    assert stats["requests"] == 2
+    assert stats["cache_write_tokens"] > 0
+    assert stats["cache_read_tokens"] == stats["cache_write_tokens"]
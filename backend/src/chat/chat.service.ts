@@ -1135,6 +1135,8 @@ export class ChatService {
       // Update user context if AI learned something new
       if (aiResponse.learnedContext) {
         await this.updateUserContext(userId, aiResponse.learnedContext);
+      } else if (aiResponse?.learningQueued) {
+        this.collectLearnedContext(userId);
       }
 
       // Track CHAT AI usage (fire-and-forget)
@@ -1551,6 +1553,37 @@ export class ChatService {
     return new Promise((resolve) => setTimeout(resolve, ms));
   }
 
+  /** First wait, and the gap between later tries, when collecting background learning. */
+  private static readonly LEARNED_CONTEXT_POLL_MS = 5_000;
+  private static readonly LEARNED_CONTEXT_POLL_TRIES = 6;
+
+  /**
+   * Pick up what the AI service learned from this user's message.
+   *
+   * Learning is a second AI call, so the service no longer makes the reply wait for
+   * it. It queues the work, coalescing messages sent close together, and keeps the
+   * result until we ask. Fire-and-forget: a missed result only costs a detail the
+   * next message will likely repeat.
+   */
+  private collectLearnedContext(userId: string, attempt = 1) {
+    setTimeout(async () => {
+      try {
+        const response = await this.httpService.axiosRef.get(
+          `${this.aiServiceUrl}/learned-context/${encodeURIComponent(userId)}`,
+          { headers: this.aiServiceHeaders, timeout: 5000 },
+        );
+        if (response.data?.learnedContext) {
+          await this.updateUserContext(userId, response.data.learnedContext);
+        }
+        if (response.data?.pending && attempt < ChatService.LEARNED_CONTEXT_POLL_TRIES) {
+          this.collectLearnedContext(userId, attempt + 1);
+        }
+      } catch (error) {
+        this.logger.warn(`Failed to collect learned context: ${error.message}`);
+      }
+    }, ChatService.LEARNED_CONTEXT_POLL_MS);
+  }
+
   /**
    * Ask the AI service, and keep asking while it is worth asking.
    *
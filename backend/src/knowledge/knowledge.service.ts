@@ -219,34 +219,7 @@ export class KnowledgeService {
         }),
       );
 
-      const scrapedData = response.data;
-
-      if (scrapedData.success) {
-        // Update source with scraped content
-        const updated = await this.prisma.knowledgeSource.update({
-          where: { id },
-          data: {
-            content: scrapedData.content,
-            metadata: scrapedData.metadata,
-            lastScraped: new Date(),
-            scrapingError: null,
-          },
-        });
-
-        this.logger.log(`Successfully scraped ${source.name}: ${scrapedData.content?.length || 0} characters`);
-        return updated;
-      } else {
-        // Update with error
-        const updated = await this.prisma.knowledgeSource.update({
-          where: { id },
-          data: {
-            scrapingError: scrapedData.error,
-            lastScraped: new Date(),
-          },
-        });
-
-        throw new Error(`Scraping failed: ${scrapedData.error}`);
-      }
+      return await this.recordScrapeResult(source, response.data);
     } catch (error) {
       this.logger.error(`Error scraping source ${source.name}:`, error.message);
 
@@ -263,6 +236,50 @@ export class KnowledgeService {
     }
   }
 
+  /** Store one /scrape-url result on its source; throws if the scrape failed */
+  private async recordScrapeResult(source: { id: string; name: string }, scrapedData: any) {
+    if (scrapedData.success && scrapedData.unchanged) {
+      // Page is the same as last time; only record that it was checked
+      const updated = await this.prisma.knowledgeSource.update({
+        where: { id: source.id },
+        data: {
+          lastScraped: new Date(),
+          scrapingError: null,
+        },
+      });
+
+      this.logger.log(`${source.name} unchanged since last scrape`);
+      return updated;
+    }
+
+    if (scrapedData.success) {
+      // Update source with scraped content
+      const updated = await this.prisma.knowledgeSource.update({
+        where: { id: source.id },
+        data: {
+          content: scrapedData.content,
+          metadata: scrapedData.metadata,
+          lastScraped: new Date(),
+          scrapingError: null,
+        },
+      });
+
+      this.logger.log(`Successfully scraped ${source.name}: ${scrapedData.content?.length || 0} characters`);
+      return updated;
+    }
+
+    // Update with error
+    await this.prisma.knowledgeSource.update({
+      where: { id: source.id },
+      data: {
+        scrapingError: scrapedData.error,
+        lastScraped: new Date(),
+      },
+    });
+
+    throw new Error(`Scraping failed: ${scrapedData.error}`);
+  }
+
   async scrapeAll(userId: string) {
     const companyId = await this.getUserCompanyId(userId);
 
@@ -273,22 +290,72 @@ export class KnowledgeService {
       },
     });
 
-    const results = [];
+    // Sources sharing a URL are scraped once
+    const sourcesByUrl = new Map<string, typeof sources>();
     for (const source of sources) {
+      sourcesByUrl.set(source.url, [...(sourcesByUrl.get(source.url) || []), source]);
+    }
+
+    const results = [];
+    const record = async (source: (typeof sources)[number], scrapedData: any) => {
       try {
-        await this.scrapeSource(source.id, userId);
-        results.push({
-          id: source.id,
-          name: source.name,
-          success: true,
-        });
+        await this.recordScrapeResult(source, scrapedData);
+        results.push({ id: source.id, name: source.name, success: true });
       } catch (error) {
-        results.push({
-          id: source.id,
-          name: source.name,
-          success: false,
-          error: error.message,
-        });
+        results.push({ id: source.id, name: source.name, success: false, error: error.message });
+      }
+    };
+
+    // The AI service scrapes every URL concurrently and streams one JSON line per URL
+    // as it finishes, so each source is saved as soon as its own site has answered.
+    const saves: Promise<void>[] = [];
+    try {
+      const response = await firstValueFrom(
+        this.httpService.post(`${this.aiServiceUrl}/scrape-urls`, {
+          urls: [...sourcesByUrl.keys()],
+        }, {
+          headers: this.aiServiceHeaders,
+          responseType: 'stream',
+          timeout: 300000, // 5 minutes for the whole batch
+        }),
+      );
+
+      let buffered = '';
+      const handleLine = (line: string) => {
+        if (!line.trim()) return;
+        let parsed: any;
+        try {
+          parsed = JSON.parse(line);
+        } catch {
+          // One garbled line must not cost the results after it
+          this.logger.warn(`Skipping unreadable scrape result line: ${line.slice(0, 200)}`);
+          return;
+        }
+        const { url, ...scrapedData } = parsed;
+        for (const source of sourcesByUrl.get(url) || []) {
+          saves.push(record(source, scrapedData));
+        }
+        sourcesByUrl.delete(url);
+      };
+
+      for await (const chunk of response.data) {
+        buffered += chunk.toString();
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.forEach(handleLine);
+      }
+      handleLine(buffered);
+    } catch (error) {
+      this.logger.error('Batch scrape failed:', error.message);
+    } finally {
+      // Saves already started finish (and are counted) even if the stream broke
+      await Promise.all(saves);
+    }
+
+    // Anything the batch did not report on (e.g. the stream broke) is marked failed
+    for (const pending of sourcesByUrl.values()) {
+      for (const source of pending) {
+        await record(source, { success: false, error: 'No result from scraping service' });
       }
     }
 
@@ -109,6 +109,17 @@ export class TasksController {
     return this.tasksService.getTasksByPhase(req.user?.id);
   }
 
+  @Get('training-data')
+  @UseGuards(RolesGuard)
+  @Roles(UserRole.SUPER_ADMIN, UserRole.COMPANY_ADMIN, UserRole.ADMIN)
+  @ApiOperation({ summary: "Export the company's task titles, types and priorities for AI training" })
+  @ApiQuery({ name: 'companyId', type: 'string', required: false, description: 'Required for super admins' })
+  @ApiResponse({ status: 200, description: 'Labelled tasks retrieved successfully' })
+  @ApiResponse({ status: 400, description: 'Super admin did not choose a company' })
+  exportTrainingData(@Query('companyId') companyId: string | undefined, @Request() req) {
+    return this.tasksService.exportTrainingData(req.user.role, req.user.companyId, companyId);
+  }
+
   @Get(':id')
   @ApiOperation({ summary: 'Get task by ID' })
   @ApiResponse({ status: 200, description: 'Task retrieved successfully' })
@@ -2291,6 +2291,30 @@ export class TasksService {
     });
   }
 
+  /**
+   * Every task's title, description, type and priority, for training the AI service's
+   * local classifiers (python -m services.task_type_classifier train <export>).
+   */
+  async exportTrainingData(role: string, userCompanyId: string | null, requestedCompanyId?: string) {
+    // A super admin belongs to no company, so they name the one to export
+    let companyId = userCompanyId;
+    if (role === UserRole.SUPER_ADMIN) {
+      if (!requestedCompanyId) throw new BadRequestException('Choose a company first.');
+      companyId = requestedCompanyId;
+    } else {
+      if (!companyId) throw new ForbiddenException('You are not part of a company.');
+      if (requestedCompanyId && requestedCompanyId !== companyId) {
+        throw new ForbiddenException("You can only export your own company's tasks.");
+      }
+    }
+
+    return this.prisma.task.findMany({
+      where: { companyId },
+      select: { title: true, description: true, taskType: true, priority: true },
+      orderBy: { createdAt: 'desc' },
+    });
+  }
+
   private async generateTaskNumber(companyId: string): Promise<string> {
     const lastTask = await this.prisma.task.findFirst({
       where: { companyId, taskNumber: { startsWith: 'TSK-' } },